@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk cache of the parsed state of qa4sm results files.
+Each entry is a directory with one .npy file per array (memory-mapped on load)
+and a small json file with the metadata.
+"""
+from qa4sm_reader import globals
+import numpy as np
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+_meta_file = 'meta.json'
+_version = 1  # bump when the layout of entries changes
+
+
+def _to_json(value):
+    """ Convert netcdf attribute values (numpy types) to json types """
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    return value
+
+
+class QA4SMCache(object):
+    """
+    Size-bounded cache directory. Entries are keyed by the path, size,
+    modification time and a hash of (the head and tail of) the content of a
+    file. Least recently used entries are removed when the cache grows
+    beyond its maximum size.
+    """
+    def __init__(self, cache_dir, max_size=globals.cache_max_size,
+                 hash_bytes=globals.cache_hash_bytes):
+        """
+        Parameters
+        ----------
+        cache_dir : str
+            Directory to keep the cache entries in, is created if it does not exist.
+        max_size : int, optional (default: from globals)
+            Maximum size of all entries in bytes.
+        hash_bytes : int, optional (default: from globals)
+            Number of bytes at the start and at the end of a file that are
+            hashed for the key.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hash_bytes = hash_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, filepath) -> str:
+        """ Get the cache key for the current state of a file """
+        stat = os.stat(filepath)
+        h = hashlib.sha1()
+        h.update('{}|{}|{}|{}'.format(_version, os.path.abspath(filepath),
+                                      stat.st_size, stat.st_mtime_ns).encode('utf-8'))
+        with open(filepath, 'rb') as f:
+            h.update(f.read(self.hash_bytes))
+            if stat.st_size > self.hash_bytes:
+                f.seek(max(self.hash_bytes, stat.st_size - self.hash_bytes))
+                h.update(f.read(self.hash_bytes))
+        return h.hexdigest()
+
+    def _entry_dir(self, key) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, filepath) -> (dict or None):
+        """
+        Look up the entry for a file.
+
+        Parameters
+        ----------
+        filepath : str
+            Path to the file that was cached.
+
+        Returns
+        -------
+        entry : dict or None
+            The metadata (in 'meta') and the memory-mapped arrays (in 'arrays')
+            of the entry, or None if the file is not (or no longer) cached.
+        """
+        entry_dir = self._entry_dir(self.key(filepath))
+        meta_path = os.path.join(entry_dir, _meta_file)
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            arrays = {name: np.load(os.path.join(entry_dir, fname), mmap_mode='r')
+                      for name, fname in meta['arrays'].items()}
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        os.utime(meta_path, None)  # mark as recently used
+        return {'meta': meta, 'arrays': arrays}
+
+    def save(self, filepath, meta:dict, arrays:dict):
+        """
+        Store the entry for a file and evict old entries if the cache is full.
+
+        Parameters
+        ----------
+        filepath : str
+            Path to the file that is cached.
+        meta : dict
+            Metadata of the entry, must be json serializable.
+        arrays : dict
+            Names as the keys, np.arrays as the values.
+        """
+        key = self.key(filepath)
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+        try:
+            meta = dict(meta, arrays=dict())
+            for i, (name, values) in enumerate(arrays.items()):
+                fname = '{}.npy'.format(i)
+                np.save(os.path.join(tmp_dir, fname), np.asarray(values))
+                meta['arrays'][name] = fname
+            with open(os.path.join(tmp_dir, _meta_file), 'w') as f:
+                json.dump(meta, f, default=_to_json)
+            os.rename(tmp_dir, self._entry_dir(key))
+        except OSError:  # entry was written by another process in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict(keep=key)
+
+    def entries(self) -> list:
+        """ Get (last use, size, key) for all entries, least recently used first """
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry_dir = self._entry_dir(key)
+            meta_path = os.path.join(entry_dir, _meta_file)
+            if key.startswith('.') or not os.path.isfile(meta_path):
+                continue
+            size = sum([os.path.getsize(os.path.join(entry_dir, fname))
+                        for fname in os.listdir(entry_dir)])
+            entries.append((os.path.getmtime(meta_path), size, key))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        """ Remove the least recently used entries until the cache fits its size """
+        entries = self.entries()
+        total = sum([size for _, size, _ in entries])
+        for _, size, key in entries:
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """ Remove all entries """
+        for _, _, key in self.entries():
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
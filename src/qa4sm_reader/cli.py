@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+Command line interface to create the plots of many QA4SM results files, e.g.
+
+    qa4sm-reader results/*.nc --metrics R ubRMSD --out-type png svg --jobs 8
+
+Files are processed in parallel, the largest ones first. When there are
+fewer files than processes, the plots of each file are spread over the
+processes as well. The plots of a file are written to <out-dir>/<file name>.
+"""
+from qa4sm_reader.img import QA4SMImg
+from qa4sm_reader.plotter import QA4SMPlotter
+from qa4sm_reader.plot_all import plot_all, _plot_jobs, _plot_job
+from qa4sm_reader.ranges import value_ranges, load_value_ranges
+import matplotlib.pyplot as plt
+import multiprocessing
+import traceback
+import argparse
+import glob
+import time
+import sys
+import os
+
+_worker = dict()  # options and the last loaded file of a worker process, see _init_worker
+
+def find_files(patterns) -> list:
+    """
+    Expand file names and glob patterns ('**' matches subdirectories) to a
+    list of unique, existing files, largest first.
+
+    Parameters
+    ----------
+    patterns : list
+        Paths or glob patterns of results files.
+
+    Returns
+    -------
+    filepaths : list
+        The matching files, sorted by size (descending).
+
+    Raises
+    ------
+    FileNotFoundError
+        If a pattern matches no file.
+    """
+    filepaths = []
+    for pattern in patterns:
+        matches = sorted([f for f in glob.glob(pattern, recursive=True) if os.path.isfile(f)])
+        if len(matches) == 0:
+            raise FileNotFoundError('No file matches {}'.format(pattern))
+        filepaths += [f for f in matches if f not in filepaths]
+    return sorted(filepaths, key=os.path.getsize, reverse=True)
+
+def schedule(filepaths, n_jobs, metrics=None, extent=None) -> list:
+    """
+    Split the work into tasks for the worker processes. Each file is a task,
+    unless there are fewer files than processes: then each box plot and map
+    of the files is a separate task, to keep all processes busy. With an
+    extent, the files are not split, as finding the variables that are empty
+    in the extent would read all values.
+
+    Parameters
+    ----------
+    filepaths : list
+        The results files, in the order to process them.
+    n_jobs : int
+        Number of processes.
+    metrics : list, optional (default: None)
+        Metrics to plot, if None, all metrics (that have data).
+    extent : tuple, optional (default: None)
+        Area to subset the values for, (min_lon, max_lon, min_lat, max_lat).
+        If given, each file is a single task.
+
+    Returns
+    -------
+    tasks : list
+        (filepath, job) tuples, where job is None for all plots of the file
+        or ('box', metric) and ('map', varname) as in plot_all.
+    """
+    if len(filepaths) >= n_jobs or extent is not None:
+        return [(filepath, None) for filepath in filepaths]
+    tasks = []
+    for filepath in filepaths:
+        try:
+            # only the metadata is read
+            img = QA4SMImg(filepath, ignore_empty=True, metrics=metrics, lazy=True)
+            jobs = _plot_jobs(img, metrics or img.ls_metrics(False))
+            if img.ds is not None:
+                img.ds.close()
+        except Exception:  # reported when the file is processed
+            jobs = [None]
+        tasks += [(filepath, job) for job in jobs]
+    return tasks
+
+def _init_worker(options, backend=None):
+    """
+    Keep the plot options in the worker, for all its tasks. The matplotlib
+    backend is only switched if one is given (in the pool workers).
+    """
+    if backend is not None:
+        plt.switch_backend(backend)
+    _worker.clear()
+    _worker.update(options=options, filepath=None, plotter=None)
+
+def _plotter(filepath) -> QA4SMPlotter:
+    """ Get the plotter of a file, the last loaded file is kept in the worker """
+    if _worker['filepath'] != filepath:
+        options = _worker['options']
+        _worker.update(filepath=None, plotter=None)  # release the previous file first
+        img = QA4SMImg(filepath, extent=options['extent'], ignore_empty=True)
+        _worker['plotter'] = QA4SMPlotter(img, out_dir=options['out_dir'](filepath),
+                                          value_ranges=options['value_ranges'])
+        _worker['filepath'] = filepath
+    return _worker['plotter']
+
+def _run_task(task) -> (str, tuple, int, float, list):
+    """
+    Create the plots of a task in a worker, errors are returned and not raised.
+
+    Returns
+    -------
+    filepath : str
+        The file of the task.
+    job : tuple or None
+        The job of the task.
+    n_plots : int
+        Number of files that were written.
+    seconds : float
+        Run time of the task.
+    errors : list
+        (job, traceback) of each plot that failed.
+    """
+    filepath, job = task
+    options = _worker['options']
+    start = time.perf_counter()
+    fnames, errors = [], []
+    try:
+        if job is None:
+            fnames_boxes, fnames_maps = plot_all(
+                filepath, metrics=options['metrics'], extent=options['extent'],
+                out_dir=options['out_dir'](filepath), out_type=options['out_type'],
+                errors=errors, value_ranges=options['value_ranges'])
+            fnames = fnames_boxes + fnames_maps
+        else:
+            fnames = _plot_job(_plotter(filepath), job, options['out_type'], dict(), dict())
+    except Exception:
+        errors.append((job, traceback.format_exc()))
+    return filepath, job, len(fnames), time.perf_counter() - start, errors
+
+class _OutDir(object):
+    """ Output directory of the plots of a file (picklable, for the workers) """
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+
+    def __call__(self, filepath):
+        return os.path.join(self.out_dir, os.path.basename(filepath))
+
+def parse_args(args) -> argparse.Namespace:
+    """
+    Parse the command line arguments.
+
+    Parameters
+    ----------
+    args : list
+        Command line arguments, without the program name.
+
+    Returns
+    -------
+    args : argparse.Namespace
+        The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='qa4sm-reader',
+        description='Create the box plots and maps of QA4SM results files.')
+    parser.add_argument('files', nargs='+', metavar='FILE',
+                        help="Results files or glob patterns ('**' matches subdirectories).")
+    parser.add_argument('--metrics', nargs='+', metavar='METRIC', default=None,
+                        help='Metrics to plot. Default: all metrics that have data.')
+    parser.add_argument('--extent', nargs=4, type=float, default=None,
+                        metavar=('MIN_LON', 'MAX_LON', 'MIN_LAT', 'MAX_LAT'),
+                        help='Only plot the values in this area.')
+    parser.add_argument('--out-type', nargs='+', default=['png'], metavar='TYPE',
+                        help="File types of the plots, e.g. 'png', 'svg', 'pdf'. Default: png.")
+    parser.add_argument('--out-dir', default=os.getcwd(),
+                        help='Directory to write the plots of each file to, in a '
+                             'folder named as the file. Default: the working directory.')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Number of processes. Default: one per CPU.')
+    ranges = parser.add_mutually_exclusive_group()
+    ranges.add_argument('--value-ranges', default=None, metavar='JSON',
+                        help='Colour ranges of the maps per metric, from a file '
+                             'written by ranges.save_value_ranges.')
+    ranges.add_argument('--common-ranges', action='store_true',
+                        help='Use the same colour ranges for the maps of all files.')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='Only print the summary.')
+    return parser.parse_args(args)
+
+def main(args=None) -> int:
+    """
+    Create the plots of the files given on the command line, and print the
+    progress and a summary of the run time and failures of each file.
+
+    Parameters
+    ----------
+    args : list, optional (default: None)
+        Command line arguments, if None, they are taken from sys.argv.
+
+    Returns
+    -------
+    exit_code : int
+        0 if all plots were created, 1 otherwise.
+    """
+    args = parse_args(sys.argv[1:] if args is None else args)
+    try:
+        filepaths = find_files(args.files)
+    except FileNotFoundError as e:
+        print('qa4sm-reader: error: {}'.format(e), file=sys.stderr)
+        return 2
+
+    n_jobs = args.jobs or os.cpu_count() or 1
+    metrics = args.metrics
+    extent = tuple(args.extent) if args.extent is not None else None
+    if args.common_ranges:
+        ranges = value_ranges(filepaths, metrics, extent=extent)
+    elif args.value_ranges is not None:
+        ranges = load_value_ranges(args.value_ranges)
+    else:
+        ranges = None
+    options = dict(metrics=metrics, extent=extent, out_type=args.out_type,
+                   out_dir=_OutDir(args.out_dir), value_ranges=ranges)
+
+    tasks = schedule(filepaths, n_jobs, metrics, extent)
+    n_jobs = max(1, min(n_jobs, len(tasks)))
+    summary = dict([(filepath, [0, 0., []]) for filepath in filepaths])  # n_plots, seconds, errors
+
+    start = time.perf_counter()
+    if n_jobs == 1:
+        _init_worker(options)
+        results = map(_run_task, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(n_jobs, initializer=_init_worker,
+                                    initargs=(options, 'Agg'))
+        results = pool.imap_unordered(_run_task, tasks, chunksize=1)
+    try:
+        for i, (filepath, job, n_plots, seconds, errors) in enumerate(results):
+            summary[filepath][0] += n_plots
+            summary[filepath][1] += seconds
+            summary[filepath][2] += errors
+            if not args.quiet:
+                print('[{}/{}] {}{}: {} plots in {:.1f} s{}'.format(
+                    i + 1, len(tasks), filepath,
+                    '' if job is None else ' ({} {})'.format(*job), n_plots, seconds,
+                    '' if len(errors) == 0 else ', {} failed'.format(len(errors))),
+                    flush=True)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    total = time.perf_counter() - start
+
+    # === summary ===
+    print('\n{:>8} {:>6} {:>6}  {}'.format('seconds', 'plots', 'failed', 'file'))
+    for filepath, (n_plots, seconds, errors) in sorted(summary.items(),
+                                                       key=lambda s: -s[1][1]):
+        print('{:8.1f} {:6d} {:6d}  {}'.format(seconds, n_plots, len(errors), filepath))
+    failed = [(filepath, errors) for filepath, (_, _, errors) in summary.items()
+              if len(errors) > 0]
+    for filepath, errors in failed:
+        for job, tb in errors:
+            print('\nFailed: {}{}\n{}'.format(
+                filepath, '' if job is None else ' ({} {})'.format(*job), tb),
+                file=sys.stderr)
+    print('{} files, {} plots, {} files with failures, {:.1f} s with {} processes'.format(
+        len(summary), sum([s[0] for s in summary.values()]), len(failed), total, n_jobs))
+    return 1 if len(failed) > 0 else 0
+
+def run():
+    """ Entry point of the console script """
+    sys.exit(main(sys.argv[1:]))
+
+
+if __name__ == '__main__':
+    run()
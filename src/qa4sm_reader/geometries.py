@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide cache of NaturalEarth geometries for map plots.
+"""
+from qa4sm_reader import globals
+import numpy as np
+import pickle
+import cartopy.io.shapereader as shpreader
+from shapely.geometry import box
+from shapely import wkb
+
+_version = 1  # bump when the layout of the persisted file changes
+
+class GeometryCache(object):
+    """
+    NaturalEarth features are read from the shapefiles once per resolution.
+    For each extent and projection, the geometries are clipped to (a margin
+    around) the extent and projected once, and then reused for all maps.
+    """
+    def __init__(self, margin=globals.geometry_clip_margin):
+        """
+        Parameters
+        ----------
+        margin : float, optional (default: from globals)
+            Margin around the extent that geometries are clipped to, relative
+            to the larger side of the extent (in degrees).
+        """
+        self.margin = margin
+        self._raw = dict()
+        self._clipped = dict()
+
+    def __len__(self):
+        return len(self._clipped)
+
+    def raw(self, category, name, resolution) -> list:
+        """
+        Get all geometries of a NaturalEarth feature, in lat/lon.
+
+        Parameters
+        ----------
+        category : str
+            'physical' or 'cultural'
+        name : str
+            Name of the feature, e.g. 'coastline', 'land', 'admin_0_countries'
+        resolution : str
+            One of '10m', '50m' and '110m'.
+        """
+        k = (category, name, resolution)
+        if k not in self._raw.keys():
+            path = shpreader.natural_earth(resolution=resolution, category=category,
+                                           name=name)
+            self._raw[k] = list(shpreader.Reader(path).geometries())
+        return self._raw[k]
+
+    def _clip_box(self, extent):
+        """ Extent with margin, in lat/lon """
+        x_min, x_max, y_min, y_max = extent
+        pad = self.margin * max(x_max - x_min, y_max - y_min)
+        return box(max(x_min - pad, -180.), max(y_min - pad, -90.),
+                   min(x_max + pad, 180.), min(y_max + pad, 90.))
+
+    def geometries(self, category, name, resolution, extent, projection) -> list:
+        """
+        Get the geometries of a NaturalEarth feature within an extent, projected.
+
+        Parameters
+        ----------
+        category : str
+            'physical' or 'cultural'
+        name : str
+            Name of the feature, e.g. 'coastline', 'land', 'admin_0_countries'
+        resolution : str
+            One of '10m', '50m' and '110m'.
+        extent : tuple
+            (x_min, x_max, y_min, y_max) in lat/lon
+        projection : cartopy.crs.Projection
+            Projection to project the geometries to.
+
+        Returns
+        -------
+        geometries : list
+            Clipped geometries, in the coordinates of the projection.
+        """
+        k = (category, name, resolution, tuple(np.round(extent, 6)),
+             projection.proj4_init)
+        if k not in self._clipped.keys():
+            clip = self._clip_box(extent)
+            geoms = []
+            for geom in self.raw(category, name, resolution):
+                if not geom.intersects(clip):
+                    continue
+                try:
+                    geom = geom.intersection(clip)
+                except Exception:  # invalid geometries in the shapefile
+                    geom = geom.buffer(0).intersection(clip)
+                if geom.is_empty:
+                    continue
+                geom = projection.project_geometry(geom, globals.data_crs)
+                if not geom.is_empty:
+                    geoms.append(geom)
+            self._clipped[k] = geoms
+        return self._clipped[k]
+
+    def save(self, path, include_raw=True):
+        """
+        Write the cached geometries (as WKB) to a file.
+
+        Parameters
+        ----------
+        path : str
+            File to write.
+        include_raw : bool, optional (default: True)
+            Also store the unclipped features, to clip them for new extents
+            without reading the shapefiles.
+        """
+        dump = lambda geoms: [wkb.dumps(g) for g in geoms]
+        data = {'version': _version,
+                'raw': {k: dump(v) for k, v in self._raw.items()} if include_raw else {},
+                'clipped': {k: dump(v) for k, v in self._clipped.items()}}
+        with open(path, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load(self, path):
+        """
+        Add the geometries from a file written by save() to the cache.
+
+        Parameters
+        ----------
+        path : str
+            File to read.
+        """
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        if data.get('version') != _version:
+            raise ValueError('Unsupported geometry cache file: {}'.format(path))
+        load = lambda geoms: [wkb.loads(g) for g in geoms]
+        self._raw.update({k: load(v) for k, v in data['raw'].items()})
+        self._clipped.update({k: load(v) for k, v in data['clipped'].items()})
+
+    def clear(self):
+        """ Remove all geometries from the cache """
+        self._raw.clear()
+        self._clipped.clear()
+
+geometry_cache = GeometryCache()  # shared by all map plots of the process
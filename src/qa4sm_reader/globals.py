@@ -14,15 +14,43 @@ dpi = 100  # Resolution in which plots are going to be rendered.
 title_pad = 12.0  # Padding below the title in points. default padding is matplotlib.rcParams['axes.titlepad'] = 6.0
 data_crs = ccrs.PlateCarree()  # Default map projection. use one of
 
+# === reader defaults ===
+meta_chunk_size = 1000000  # Max. number of values read at once when checking variables for nans.
+max_read_gap = 1000  # Max. number of locations outside the extent, that are read to merge two slices into one read.
+quantile_bins = 16384  # Number of histogram bins used to approximate quantiles of values that are read in chunks.
+stats_quantiles = (0.025, 0.25, 0.5, 0.75, 0.975)  # Quantiles that are computed (and cached) for all variables of an image.
+stats_block_bytes = 256 * 1024 ** 2  # Max. size of the blocks of variables whose statistics are computed at once.
+quantile_method = 'exact'  # 'exact' quantiles of in-memory values, or 'sketch' for approximate, mergeable quantiles with bounded memory.
+sketch_rel_accuracy = 0.005  # Max. relative error of quantiles from a sketch.
+sketch_max_buckets = 2048  # Max. number of buckets of a sketch (of positive and negative values each).
+cache_max_size = 2 * 1024 ** 3  # Max. size of the on-disk cache of parsed images in bytes.
+cache_hash_bytes = 1024 ** 2  # Number of bytes at the start and end of a file that are hashed for the cache key.
+grid_step_resolution = 1e-6  # Grid steps are detected as multiples of this (in degrees), to ignore rounding errors of the coordinates.
+grid_max_step_ratio = 4  # An axis is irregular if its smallest step is more than this times its common (gcd) step.
+grid_max_cells = 2 ** 23  # Max. number of cells of gridded values, larger (or irregular) grids are binned to coarser cells.
+grid_default_step = 0.25  # Step of an axis with a single value, if the other axis has no step either.
+
 # === map plot defaults ===
 scattered_datasets = ['ISMN']  # dataset names which require scatterplots (values is scattered in lat/lon)
 map_figsize = [11.32, 6.10]  # size of the output figure in inches.
 naturalearth_resolution = '110m'  # One of '10m', '50m' and '110m'. Finer resolution slows down plotting. see https://www.naturalearthdata.com/
+geometry_clip_margin = 0.1  # NaturalEarth geometries are clipped to the map extent plus this margin (relative to the extent).
 crs = ccrs.PlateCarree()  # projection. Must be a class from cartopy.crs. Note, that plotting labels does not work for most projections.
 markersize = 4  # diameter of Marker in points.
 map_pad = 0.15  # padding relative to map height.
 grid_intervals = [2, 5, 10, 30]  # grid spacing in degree to choose from (plotter will try to make 5 gridlines in the smaller dimension)
 max_title_len = 8 * map_figsize[0]  # maximum length of plot title in chars. if longer, it will be broken in multiple lines.
+basemap_cache_size = 16  # Number of pre-rendered map backgrounds (per extent, projection and style) that are kept.
+basemap_oversample = 1  # Pre-rendered map backgrounds are rendered at this multiple of the plot resolution.
+
+# === raster (preview) map defaults ===
+raster_lut_size = 256  # Number of colors of the colormap lookup tables.
+raster_scale = 1  # Each grid cell is drawn as raster_scale x raster_scale pixels.
+raster_land_color = '#d9d9d9'  # Color of land without values.
+raster_mask_cache_size = 16  # Number of rasterized land masks (per extent and shape) that are kept.
+raster_png_compression = 1  # zlib compression level of the png files, 0 (none) to 9 (smallest, slowest).
+tile_size = 256  # Size of web map tiles in pixels.
+tile_max_zoom = 8  # Finest zoom level of web map tiles that is chosen automatically.
 
 # === boxplot_basic defaults ===
 boxplot_printnumbers = True  # Print 'median', 'nObs', 'stdDev' to the boxplot_basic.
@@ -30,6 +58,19 @@ boxplot_figsize = [6.30, 4.68]  # size of the output figure in inches. NO MORE U
 boxplot_height = 4.68
 boxplot_width = 1.7  # times (n+1), where n is the number of boxes.
 boxplot_title_len = 8 * boxplot_width  # times the number of boxes. maximum length of plot title in chars.
+boxplot_whis = 1.5  # Whiskers extend to the last value within this times the inter-quartile range.
+boxplot_box_width = 0.15  # width of the boxes, relative to their distance.
+boxplot_line_color = '#999999'  # color of the box edges, whiskers, caps and medians.
+boxplot_style = {  # matplotlib rc of the box plots (the 'whitegrid' style of seaborn).
+    'figure.facecolor': 'white', 'axes.facecolor': 'white', 'axes.edgecolor': '.8',
+    'axes.labelcolor': '.15', 'text.color': '.15', 'xtick.color': '.15', 'ytick.color': '.15',
+    'xtick.direction': 'out', 'ytick.direction': 'out', 'axes.axisbelow': True,
+    'axes.grid': True, 'grid.linestyle': '-', 'grid.color': '.8',
+    'font.family': ['sans-serif'],
+    'font.sans-serif': ['Arial', 'DejaVu Sans', 'Liberation Sans', 'Bitstream Vera Sans', 'sans-serif'],
+    'lines.solid_capstyle': 'round', 'patch.edgecolor': 'w', 'patch.force_edgecolor': True,
+    'xtick.top': False, 'ytick.right': False, 'xtick.bottom': False, 'ytick.left': False,
+    'axes.spines.top': False, 'axes.spines.right': False}
 
 # === watermark defaults ===
 watermark = u'made with QA4SM (qa4sm.eodc.eu)'  # Watermark string
@@ -2,8 +2,28 @@
 
 from qa4sm_reader import globals
 from parse import *
+from parse import compile as _compile_templ
+from functools import lru_cache
+import os
 import warnings
 
+@lru_cache(maxsize=None)
+def _templ(pattern:str):
+    """
+    Compile a template to parse, each template is only compiled once.
+
+    Parameters
+    ----------
+    pattern : str
+        The template, in the format of the parse package.
+
+    Returns
+    -------
+    parser : parse.Parser
+        The compiled template, use parser.parse(string) to parse.
+    """
+    return _compile_templ(pattern)
+
 def _build_fname_templ(n):
     """
     Create a template to parse for the file name, based on the dataset-__version
@@ -31,23 +51,120 @@ def _metr_grp(metric:str) -> int or None:
             return g
     return None
 
+def _parse_varname(varname:str) -> (str, int, dict):
+    """
+    Parse a variable name based on the templates from globals.
+
+    Parameters
+    ----------
+    varname : str
+        Name of the variable as in the results file.
+
+    Returns
+    -------
+    metric : str or None
+        The metric that the variable describes, None if it is not a metric variable.
+    g : int or None
+        The metric group (0, 2 or 3) of the variable.
+    parts : dict or None
+        The named parts (dataset ids and names) from the variable name.
+    """
+    for g in globals.metric_groups.keys():
+        templ_d = globals.var_name_ds_sep[g]
+        pattern = '{}{}'.format(globals.var_name_metric_sep[g],
+                                templ_d if templ_d is not None else '')
+        parts = _templ(pattern).parse(varname)
+
+        if parts is not None and parts['metric'] in globals.metric_groups[g]:
+            return parts['metric'], g, parts.named
+
+    return None, None, None
+
+def parse_varnames(varnames) -> list:
+    """
+    Parse multiple variable names based on the templates from globals.
+
+    Parameters
+    ----------
+    varnames : list
+        Names of the variables as in the results file(s). Names that are in
+        the list multiple times are only parsed once.
+
+    Returns
+    -------
+    parsed : list
+        (metric, group, parts) for each variable, as from parsing a single
+        variable name. (None, None, None) for variables that are not metric
+        variables.
+    """
+    cache = dict()
+    parsed = []
+    for varname in varnames:
+        if varname not in cache.keys():
+            cache[varname] = _parse_varname(varname)
+        metric, g, parts = cache[varname]
+        parsed.append((metric, g, dict(parts) if parts is not None else None))
+    return parsed
+
+def parse_filenames(filenames) -> list:
+    """
+    Parse multiple file names and derive the validation datasets, based on
+    the dataset-version separation rule from globals.
+
+    Parameters
+    ----------
+    filenames : list
+        File names or paths (only the file name is parsed) of results files.
+
+    Returns
+    -------
+    parsed : list
+        The parsed datasets and versions for each file, as a dictionary.
+        None for file names that do not match the template.
+    """
+    parsed = []
+    for filename in filenames:
+        filename = os.path.basename(filename)
+        n = len(filename.split(globals.ds_fn_sep))
+        parts = _templ(_build_fname_templ(n)).parse(filename)
+        parsed.append(parts.named if parts is not None else None)
+    return parsed
+
 class QA4SMAttributes(object):
-    """ Attribute handler for QA4SM results, only from meta values """
+    """
+    Attribute handler for QA4SM results, only from meta values. The global
+    attributes are scanned once, the names of each dataset are resolved on
+    first use and then kept in a table, that is shared by all handlers which
+    are created from this one.
+    """
+    __slots__ = ('meta', '_offset_id_dc', 'other_dcs', 'ref_dc', '_dc_table',
+                 '_named')
+
     def __init__(self, global_attrs):
         """
         Parameters
         ----------
-        global_attrs: dict
-            Global attributes of the QA4SM validation result
+        global_attrs: dict or QA4SMAttributes
+            Global attributes of the QA4SM validation result, or a handler
+            for them, whose parsed attributes are then reused.
         """
-        self.meta = global_attrs
-        self._get_offset()
-        self.other_dcs, self.ref_dc = self._dcs()
+        if isinstance(global_attrs, QA4SMAttributes):
+            self.meta = global_attrs.meta
+            self._offset_id_dc = global_attrs._offset_id_dc
+            self.other_dcs, self.ref_dc = global_attrs.other_dcs, global_attrs.ref_dc
+            self._dc_table = global_attrs._dc_table
+            self._named = global_attrs._named
+        else:
+            self.meta = global_attrs
+            self._get_offset()
+            self.other_dcs, self.ref_dc = self._dcs()
+            self._dc_table = dict()
+            self._named = dict()
 
     def _get_offset(self):
         self._offset_id_dc = 0
         if 'val_ref' in self.meta.keys():
-            id = int(parse('val_dc_dataset{id}', self.meta['val_ref'])['id'])
+            id = int(_templ('val_dc_dataset{id}').parse(self.meta['val_ref'])['id'])
             if id != 0:
                 self._offset_id_dc = -1
 
@@ -55,8 +172,9 @@ class QA4SMAttributes(object):
         """ Go through the metadata and find the dataset short names """
         ref_dc = self._ref_dc()
         dcs = dict()
+        templ = _templ(globals._ds_short_name_attr)
         for k in self.meta.keys():
-            parsed = parse(globals._ds_short_name_attr, k)
+            parsed = templ.parse(k)
             if parsed is not None and len(list(parsed)) == 1:
                 dc = list(parsed)[0]
                 if dc != ref_dc:
@@ -66,7 +184,7 @@ class QA4SMAttributes(object):
     def _ref_dc(self):
         """ Get the short name of the reference dataset """
         val_ref = self.meta[globals._ref_ds_attr]
-        ref_dc = parse(globals._ds_short_name_attr, val_ref)[0]
+        ref_dc = _templ(globals._ds_short_name_attr).parse(val_ref)[0]
         return ref_dc
 
     def _dc_names(self, dc):
@@ -84,13 +202,38 @@ class QA4SMAttributes(object):
             short name, pretty_name and short_version and pretty_version of the
             dc dataset.
         """
-        short_name = self.meta[globals._ds_short_name_attr.format(dc)]
-        pretty_name = self.meta[globals._ds_pretty_name_attr.format(dc)]
-        short_version = self.meta[globals._version_short_name_attr.format(dc)]
-        pretty_version = self.meta[globals._version_pretty_name_attr.format(dc)]
+        if dc not in self._dc_table.keys():
+            short_name = self.meta[globals._ds_short_name_attr.format(dc)]
+            pretty_name = self.meta[globals._ds_pretty_name_attr.format(dc)]
+            short_version = self.meta[globals._version_short_name_attr.format(dc)]
+            pretty_version = self.meta[globals._version_pretty_name_attr.format(dc)]
+            self._dc_table[dc] = dict(short_name=short_name, pretty_name=pretty_name,
+                                      short_version=short_version,
+                                      pretty_version=pretty_version)
+
+        return dict(self._dc_table[dc])
+
+    def named(self, id, short_name):
+        """
+        Get the handler for a dataset, as in a variable name. Handlers are
+        created once and shared.
 
-        return dict(short_name=short_name, pretty_name=pretty_name,
-                    short_version=short_version, pretty_version=pretty_version)
+        Parameters
+        ----------
+        id : int
+            Id of the dataset as in the VARIABLE NAME (not as in the attributes)
+        short_name : str
+            Short name of the dataset as in the variable name
+
+        Returns
+        -------
+        named_attrs : QA4SMNamedAttributes
+            The handler for the dataset.
+        """
+        k = (int(id), short_name)
+        if k not in self._named.keys():
+            self._named[k] = QA4SMNamedAttributes(id, short_name, self)
+        return self._named[k]
 
     def get_all_names(self) -> (dict, dict):
         """
@@ -112,6 +255,7 @@ class QA4SMAttributes(object):
 
 class QA4SMNamedAttributes(QA4SMAttributes):
     """ Attribute handler for named QA4SM datasets, based on global attributes."""
+    __slots__ = ('id', '__short_name', '__version')
 
     def __init__(self, id, short_name, global_attrs):
         """
@@ -123,8 +267,9 @@ class QA4SMNamedAttributes(QA4SMAttributes):
             Id of the dataset as in the VARIABLE NAME (not as in the attributes)
         short_name : str
             Short name of the dataset as in the variable name
-        global_attrs : dict
-            Global attributes of the results file, for lookup.
+        global_attrs : dict or QA4SMAttributes
+            Global attributes of the results file, for lookup, or the (shared)
+            handler for them.
         """
         super(QA4SMNamedAttributes, self).__init__(global_attrs)
 
@@ -215,8 +360,10 @@ class QA4SMNamedAttributes(QA4SMAttributes):
 
 
 class QA4SMMetricVariable(object):
+    __slots__ = ('varname', 'attrs', 'metric', 'g', 'ref_ds', 'other_dss',
+                 'metric_ds', '_store', '_values')
 
-    def __init__(self, varname, global_attrs, values=None):
+    def __init__(self, varname, global_attrs, values=None, store=None, parsed=None):
         """
         Validation results for a validation metric and a combination of datasets.
 
@@ -224,17 +371,40 @@ class QA4SMMetricVariable(object):
         ---------
         name : str
             Name of the variable
-        global_attrs : dict
-            Global attributes of the results.
+        global_attrs : dict or QA4SMAttributes
+            Global attributes of the results. Pass the same QA4SMAttributes
+            for all variables of a file, so that the attributes are only
+            parsed once.
         values : pd.DataFrame, optional (default: None)
             Values of the variable, to store together with the metadata.
+        store : QA4SMValueStore, optional (default: None)
+            Value store of the results image. If passed, values are taken
+            from the store when they are requested.
+        parsed : tuple, optional (default: None)
+            (metric, group, parts) of the variable name, as from
+            parse_varnames(). If None, the name is parsed here.
         """
 
         self.varname = varname
-        self.attrs = global_attrs
-        self.metric, self.g, parts = self._parse_varname()
+        if isinstance(global_attrs, QA4SMAttributes):
+            self.attrs = global_attrs
+        else:
+            self.attrs = QA4SMAttributes(global_attrs)
+        self.metric, self.g, parts = self._parse_varname() if parsed is None else parsed
         self.ref_ds, self.other_dss, self.metric_ds = self._named_attrs(parts)
-        self.values = values
+        self._store = store
+        self._values = values
+
+    @property
+    def values(self):
+        """ Values of the variable, from the value store if there is one """
+        if self._values is None and self._store is not None:
+            return self._store.frame([self.varname])
+        return self._values
+
+    @values.setter
+    def values(self, values):
+        self._values = values
 
     def _named_attrs(self, parts:dict) -> \
             (QA4SMNamedAttributes, list, QA4SMNamedAttributes):
@@ -243,20 +413,19 @@ class QA4SMMetricVariable(object):
         if not self.ismetr():
             raise IOError(self.varname, '{} is not in form of a QA4SM metric variable.')
 
+        a = self.attrs
         if self.g == 0:
-            a = QA4SMAttributes(self.attrs)
-            ref_ds = QA4SMNamedAttributes(a.ref_dc - a._offset_id_dc,
-                                          a.get_ref_names()['short_name'], self.attrs)
+            ref_ds = a.named(a.ref_dc - a._offset_id_dc, a.get_ref_names()['short_name'])
             return ref_ds, None, None
         else:
             dss = []
-            ref_ds = QA4SMNamedAttributes(parts['ref_id'], parts['ref_ds'], self.attrs)
-            ds = QA4SMNamedAttributes(parts['sat_id0'], parts['sat_ds0'], self.attrs)
+            ref_ds = a.named(parts['ref_id'], parts['ref_ds'])
+            ds = a.named(parts['sat_id0'], parts['sat_ds0'])
             dss.append(ds)
             if self.g == 3:
-                ds = QA4SMNamedAttributes(parts['sat_id1'], parts['sat_ds1'], self.attrs)
+                ds = a.named(parts['sat_id1'], parts['sat_ds1'])
                 dss.append(ds)
-                mds = QA4SMNamedAttributes(parts['mds_id'], parts['mds'], self.attrs)
+                mds = a.named(parts['mds_id'], parts['mds'])
             else:
                 mds = None
             return ref_ds, dss, mds
@@ -264,17 +433,7 @@ class QA4SMMetricVariable(object):
     def _parse_varname(self) -> (str, int, dict):
         """ parse the name to get the metric, group and  """
 
-        metr_groups = list(globals.metric_groups.keys())
-        for g in metr_groups:
-            templ_d = globals.var_name_ds_sep[g]
-            pattern = '{}{}'.format(globals.var_name_metric_sep[g],
-                                    templ_d if templ_d is not None else '')
-            parts = parse(pattern, self.varname)
-
-            if parts is not None and parts['metric'] in globals.metric_groups[g]:
-                return parts['metric'], g, parts.named
-
-        return None, None, None
+        return _parse_varname(self.varname)
 
     def ismetr(self) -> bool:
         """ Check whether this is a metric variable or not """
@@ -284,6 +443,8 @@ class QA4SMMetricVariable(object):
     def isempty(self):
         """ Check whether values are associated with the object or not """
 
+        if self._values is None and self._store is not None:
+            return self._store.count(self.varname) == 0
         if self.values is None or self.values.empty:
             return True
 
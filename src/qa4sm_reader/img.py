@@ -2,59 +2,74 @@
 
 import xarray as xr
 from qa4sm_reader import globals
-from parse import *
 import os
 import numpy as np
-from collections import OrderedDict
-from qa4sm_reader.handlers import _build_fname_templ
-from qa4sm_reader.handlers import QA4SMMetricVariable
 import pandas as pd
+from collections import OrderedDict
+from qa4sm_reader.handlers import parse_varnames, parse_filenames
+from qa4sm_reader.handlers import QA4SMAttributes, QA4SMMetricVariable
+from qa4sm_reader.store import QA4SMValueStore
+from qa4sm_reader.cache import QA4SMCache
+from qa4sm_reader.stats import describe, describe_columns, VarStats
+from qa4sm_reader.plot_utils import GeoGrid
 import itertools
+import copy
 
-class QA4SMImg(object):
+class QA4SMMeta(object):
     """
-    A QA4SM validation results netcdf image.
+    Metadata of a QA4SM validation results netcdf image. Only the global
+    attributes and variable names are read, no variable values are decoded
+    unless empty variables are filtered (ignore_empty).
     """
-    def __init__(self, filepath, extent=None, ignore_empty=True, metrics=None,
-                 index_names=globals.index_names):
+    def __init__(self, filepath, ignore_empty=False, metrics=None,
+                 chunk_size=globals.meta_chunk_size):
         """
-        Initialise a common QA4SM results image.
+        Initialise the metadata reader for a QA4SM results file.
 
         Parameters
         ----------
         filepath : str
             Path to the results netcdf file (as created by QA4SM)
-        extent : tuple, optional (default: None)
-            Area to subset the values for.
-            (min_lon, max_lon, min_lat, max_lat)
-        ignore_empty : bool, optional (default: True)
-            Ignore empty variables in the file.
+        ignore_empty : bool, optional (default: False)
+            Ignore empty variables in the file. This reads the values of the
+            variables, chunk by chunk, until the first valid value is found.
         metrics : list or None, optional (default: None)
             Subset of the metrics to load from file, if None are passed, all
             are loaded.
-        index_names : list, optional (default: ['lat', 'lon'] - as in globals.py)
-            Names of dimension variables in x and y direction (lat, lon).
+        chunk_size : int, optional (default: from globals)
+            Maximum number of values that are read at once when checking
+            whether a variable is empty.
         """
         self.filepath = filepath
         self.filename = os.path.basename(self.filepath)
 
-        self.extent = extent
-        self.index_names = index_names
-
         self.ignore_empty = ignore_empty
-        self.ds = xr.open_dataset(self.filepath)
+        self.chunk_size = chunk_size
+        self.ds = self._open_dataset()
 
+        self._attrs = QA4SMAttributes(self._file_attrs())
+        self._var_index = self._index_vars()
         self.common, self.double, self.triple = self._load_metrics_from_file(metrics)
+        self._index_groups()
 
-    def _load_metrics_from_file(self, metrics:list=None) -> (dict, dict, dict):
-        """ Load and group all metrics from file """
-        self.df = self._ds2df(None)
+    def _open_dataset(self) -> xr.Dataset:
+        """ Open the results file """
+        return xr.open_dataset(self.filepath)
+
+    def _file_attrs(self) -> dict:
+        """ Global attributes of the results file """
+        return self.ds.attrs
 
+    def _file_varnames(self) -> list:
+        """ Names of all variables in the results file """
+        return list(self.ds.variables.keys())
+
+    def _load_metrics_from_file(self, metrics:list=None) -> (dict, dict, dict):
+        """ Group all metric variables from file """
         common, double, triple = dict(), dict(), dict()
         if metrics is None:
             metrics = list(itertools.chain(*list(globals.metric_groups.values())))
         for metric in metrics:
-            # todo: loading every single variable is slow
             metr_vars = self._load_metric_from_file(metric)
             if len(metr_vars) > 0:
                 if metric in globals.metric_groups[2]:
@@ -66,105 +81,120 @@ class QA4SMImg(object):
 
         return common, double, triple
 
+    def _index_vars(self) -> OrderedDict:
+        """
+        Parse all variable names in the file once and index the metric
+        variables by metric.
+
+        Returns
+        -------
+        var_index : OrderedDict
+            Metric as the key, list of (varname, group, parts) as the values,
+            variables are sorted alphabetically.
+        """
+        var_index = OrderedDict()
+        varnames = np.sort(np.array(self._file_varnames())).tolist()
+        for var, (metric, g, parts) in zip(varnames, parse_varnames(varnames)):
+            if metric is None:
+                continue
+            if metric not in var_index.keys():
+                var_index[metric] = []
+            var_index[metric].append((var, g, parts))
+
+        return var_index
+
+    def _index_groups(self):
+        """
+        Index the loaded metrics and variables, to look up the group of a
+        metric and the variable object for a name directly.
+        """
+        self._metric_groups = dict()
+        self._vars = dict()
+        self._ref_meta = None
+        for metric_group in self._groups():
+            for metric, vars in metric_group.items():
+                self._metric_groups[metric] = metric_group
+                for Var in vars:
+                    self._vars[Var.varname] = Var
+
+    def _groups(self) -> (dict, dict, dict):
+        """ The common, double and triple metric groups """
+        return self.common, self.double, self.triple
+
     def _load_metric_from_file(self, metric:str) -> np.array:
-        """ Load all variables that describe the metric from file. """
+        """ Create all (not empty) variables that describe the metric. """
 
-        all_vars = np.sort(np.array(list(self.ds.variables.keys())))
         metr_vars = []
-        for var in all_vars:
-            Var = self._load_var(var, empty=True)
-            if Var is not None and (Var.metric == metric):
-                Var.values = self.df[[var]].dropna()
-                if self.ignore_empty:
-                    if not Var.isempty():
-                        metr_vars.append(Var)
-                else:
-                    metr_vars.append(Var)
+        for var, g, parts in self._var_index.get(metric, []):
+            Var = self._load_var(var, parsed=(metric, g, parts))
+            if Var is not None:
+                if self.ignore_empty and self.isempty(var):
+                    continue
+                metr_vars.append(Var)
 
         return np.array(metr_vars)
 
-    def _load_var(self, varname:str, empty=False) -> (QA4SMMetricVariable or None):
-        """ Create a common variable and fill it with values """
-        if empty:
-            values = None
-        else:
-            values = self.df[[varname]]
+    def _load_var(self, varname:str, store=None, parsed=None) -> (QA4SMMetricVariable or None):
+        """
+        Create a common variable, (optionally) linked to a value store. The
+        name is only parsed again if its (metric, group, parts) are not passed.
+        """
         try:
-            Var = QA4SMMetricVariable(varname, self.ds.attrs, values=values)
+            Var = QA4SMMetricVariable(varname, self._attrs, store=store, parsed=parsed)
             return Var
         except IOError:
             return None
 
+    def isempty(self, varname:str) -> bool:
+        """
+        Check whether a variable in the file contains only nans. The variable
+        is read in chunks along its first dimension, until a valid value is found.
 
-    def _ds2df(self, varnames:list=None) -> pd.DataFrame:
-        """ Cut a variable to extent and return it as a values frame """
-        try:
-            if varnames is None:
-                if globals.time_name in list(self.ds.variables.keys()):
-                    if len(self.ds[globals.time_name]) == 0:
-                        self.ds = self.ds.drop_vars('time')
-                df = self.ds.to_dataframe()
-            else:
-                df = self.ds[self.index_names + varnames].to_dataframe()
-                df.dropna(axis='index', subset=varnames, inplace=True)
-        except KeyError as e:
-            raise Exception(
-                'The given variable ' + ', '.join(varnames) +
-                ' do not match the names in the input values.' + str(e))
-
-        if isinstance(df.index, pd.MultiIndex):
-            lat, lon = globals.index_names
-            df[lat] = df.index.get_level_values(lat)
-            df[lon] = df.index.get_level_values(lon)
-
-        if self.extent:  # === geographical subset ===
-            lat, lon = globals.index_names
-            df = df[(df[lon] >= self.extent[0]) & (df[lon] <= self.extent[1]) &
-                    (df[lat] >= self.extent[2]) & (df[lat] <= self.extent[3])]
-
-        df.reset_index(drop=True, inplace=True)
-        df = df.set_index(self.index_names)
-
-        return df
+        Parameters
+        ----------
+        varname : str
+            Name of the variable in the file
 
-    def metric_df(self, metric):
+        Returns
+        -------
+        isempty : bool
+            True if there is no valid value for the variable in the file.
         """
-        Group all variables for the metric in a common data frame
+        da = self.ds[varname]
+        if da.ndim == 0:
+            return int(da.count()) == 0
+        dim = da.dims[0]
+        n = da.shape[0]
+        row_size = max(1, int(da.size / n)) if n > 0 else 1
+        step = max(1, int(self.chunk_size / row_size))
+        for i in range(0, n, step):
+            if int(da.isel({dim: slice(i, i + step)}).count()) > 0:
+                return False
+        return True
+
+    def empty_vars(self, as_groups=False):
+        """
+        Check all metric variables in the file for valid values.
 
         Parameters
-        ---------
-        metric : str
-            The name of a metric in the file, all variables for that metric are
-            combined into one values frame.
+        ----------
+        as_groups : bool, optional (default: False)
+            Return the result grouped by metric.
 
         Returns
         -------
-        df : pd.DataFrame
-            A dataframe that contains all variables that describe the metric
-            in the column
+        empty : OrderedDict
+            Variable names as keys (optionally grouped by metric), and whether
+            the variable is empty as the values.
         """
-        for g, metric_group in {0: self.common, 2: self.double, 3: self.triple}.items():
-            if metric in metric_group.keys():
-                if g != 3:
-                    conc = [Var.values for Var in metric_group[metric]]
-                    return pd.concat(conc, axis=1)
-                else:
-                    mds_df = {}
-                    for Var in metric_group[metric]:
-                        _, _, mds_meta = Var.get_varmeta()
-                        k = (mds_meta[0], mds_meta[1]['short_name'], mds_meta[1]['short_version'])
-                        if k not in mds_df.keys():
-                            mds_df[k] = [Var.values]
-                        else:
-                            mds_df[k].append(Var.values)
-                    ret = []
-                    for k, dflist in mds_df.items():
-                        try:
-                            r = pd.concat(dflist, sort=True, axis=1)
-                        except ValueError:
-                            r = pd.concat(dflist, sort=True, axis=0)
-                        ret.append(r)
-                    return ret
+        empty = OrderedDict()
+        for metric, vars in self._var_index.items():
+            metr_empty = OrderedDict([(var, self.isempty(var)) for var, _, _ in vars])
+            if as_groups:
+                empty[metric] = metr_empty
+            else:
+                empty.update(metr_empty)
+        return empty
 
     def find_group(self, src):
         """
@@ -180,26 +210,23 @@ class QA4SMImg(object):
         metric_group : dict
             A collection of metrics for 2, 3 or all datasets.
         """
-        for metric_group in [self.common, self.double, self.triple]:
-            if src in metric_group.keys():
-                return metric_group
-        for metric_group in [self.common, self.double, self.triple]:
-            for metric in metric_group.keys():
-                if src in [Var.varname for Var in metric_group[metric]]:
-                    return metric_group
+        if src in self._metric_groups.keys():
+            return self._metric_groups[src]
+        if src in self._vars.keys():
+            return self._metric_groups[self._vars[src].metric]
 
     def ref_meta(self) -> tuple:
         """ Go through all variables and check if the reference dataset is the same """
-        ref_meta = None
-        for metric_group in [self.common, self.double, self.triple]:
-            for metric, vars in metric_group.items():
-                for Var in vars:
-                    if ref_meta is None:
-                        ref_meta, _, _ = Var.get_varmeta()
-                    else:
-                        new_ref_meta, _, _ = Var.get_varmeta()
-                        assert new_ref_meta == ref_meta
-        return ref_meta
+        if self._ref_meta is None:
+            # variables share the handlers of their datasets, compare each once
+            ref_dss = OrderedDict([(id(Var.ref_ds), Var.ref_ds) for Var in self._vars.values()])
+            for ref_ds in ref_dss.values():
+                new_ref_meta = (ref_ds.id, ref_ds._names_from_attrs('all'))
+                if self._ref_meta is None:
+                    self._ref_meta = new_ref_meta
+                else:
+                    assert new_ref_meta == self._ref_meta
+        return self._ref_meta
 
     def var_meta(self, varname):
         """
@@ -217,11 +244,8 @@ class QA4SMImg(object):
             values.
         """
 
-        metr_group = self.find_group(varname)
-        for metric, vars in metr_group.items():
-            for Var in vars:
-                if Var.varname == varname:
-                    return {Var.metric: Var.get_varmeta()}
+        Var = self._vars[varname]
+        return {Var.metric: Var.get_varmeta()}
 
     def metric_meta(self, metric):
         """
@@ -259,10 +283,7 @@ class QA4SMImg(object):
         ds_and_vers : dict
             The parsed datasets and version from the file name.
         """
-        filename = os.path.basename(self.filepath)
-        parts = filename.split(globals.ds_fn_sep)
-        fname_templ = _build_fname_templ(len(parts))
-        return parse(fname_templ, filename).named
+        return parse_filenames([self.filepath])[0]
 
     def ls_metrics(self, as_groups=True):
         """
@@ -329,3 +350,515 @@ class QA4SMImg(object):
         else:
             return np.sort(np.array(common + double + triple))
 
+class QA4SMImg(QA4SMMeta):
+    """
+    A QA4SM validation results netcdf image.
+    """
+    def __init__(self, filepath, extent=None, ignore_empty=True, metrics=None,
+                 index_names=globals.index_names, lazy=False, chunks=None,
+                 cache_dir=None):
+        """
+        Initialise a common QA4SM results image.
+
+        Parameters
+        ----------
+        filepath : str
+            Path to the results netcdf file (as created by QA4SM)
+        extent : tuple, optional (default: None)
+            Area to subset the values for.
+            (min_lon, max_lon, min_lat, max_lat)
+        ignore_empty : bool, optional (default: True)
+            Ignore empty variables in the file.
+        metrics : list or None, optional (default: None)
+            Subset of the metrics to load from file, if None are passed, all
+            are loaded.
+        index_names : list, optional (default: ['lat', 'lon'] - as in globals.py)
+            Names of dimension variables in x and y direction (lat, lon).
+        lazy : bool, optional (default: False)
+            Only read the metadata and variable names on initialisation. The
+            values of a metric are read from file the first time they are
+            requested and then kept in memory. In lazy mode, empty variables
+            are detected over the whole file, not only over the extent, and
+            only when the variables of a metric are first listed.
+        chunks : int or dict, optional (default: None)
+            Open the file with dask chunks (as in xarray.open_dataset), for files
+            that do not fit into memory. Values are then only read chunk by
+            chunk, to compute statistics and map rasters. Requires dask.
+        cache_dir : str, optional (default: None)
+            Directory of a persistent cache of parsed images. The first time a
+            file is opened, the values of all metric variables are read and
+            stored there; when the same (unchanged) file is opened again, they
+            are memory-mapped from the cache and the file is not read at all.
+            In lazy mode or for a subset of the metrics, an existing entry is
+            used, but no new entry is created (the file is read as without
+            the cache). Cannot be used in chunked mode.
+        """
+        self.extent = extent
+        self.index_names = index_names
+        self.lazy = lazy
+        self.chunks = chunks
+
+        if cache_dir is not None and chunks is not None:
+            raise ValueError('The cache cannot be used in chunked mode')
+        self.cache = QA4SMCache(cache_dir) if cache_dir is not None else None
+        self._cached = self._load_cached(filepath)
+        self._grid = None
+        self._stats = dict()
+        self._unchecked = OrderedDict()  # metric: variables not checked for emptiness yet
+
+        super(QA4SMImg, self).__init__(filepath, ignore_empty=ignore_empty,
+                                       metrics=metrics)
+
+    @property
+    def common(self) -> dict:
+        self._check_empty()
+        return self._common
+
+    @common.setter
+    def common(self, group:dict):
+        self._common = group
+
+    @property
+    def double(self) -> dict:
+        self._check_empty()
+        return self._double
+
+    @double.setter
+    def double(self, group:dict):
+        self._double = group
+
+    @property
+    def triple(self) -> dict:
+        self._check_empty()
+        return self._triple
+
+    @triple.setter
+    def triple(self, group:dict):
+        self._triple = group
+
+    def _groups(self) -> (dict, dict, dict):
+        """ The metric groups, without checking variables for emptiness """
+        return self._common, self._double, self._triple
+
+    def _check_empty(self, metrics:list=None):
+        """
+        Drop the empty variables of metrics that were loaded without checking
+        them (in lazy mode), and the metrics without variables.
+
+        Parameters
+        ----------
+        metrics : list, optional (default: None)
+            Metrics to check, if None, all metrics that were not checked yet.
+        """
+        if len(self._unchecked) == 0:
+            return
+        if metrics is None:
+            metrics = list(self._unchecked.keys())
+        metrics = [metric for metric in metrics if metric in self._unchecked.keys()]
+        for metric in metrics:
+            empty = [var for var in self._unchecked.pop(metric) if self.isempty(var)]
+            if len(empty) == 0:
+                continue
+            group = self._metric_groups[metric]
+            vars = np.array([Var for Var in group[metric] if Var.varname not in empty])
+            if len(vars) > 0:
+                group[metric] = vars
+            else:
+                del group[metric]
+        if len(metrics) > 0:
+            self._index_groups()
+
+    def _load_cached(self, filepath) -> (dict or None):
+        """ Get the cache entry for the file, if there is a valid one """
+        if self.cache is None:
+            return None
+        entry = self.cache.load(filepath)
+        if entry is None or entry['meta']['index_names'] != list(self.index_names):
+            return None
+        return entry
+
+    def _cache_store(self) -> QA4SMValueStore:
+        """
+        Create the value store from the cache entry, or read all metric
+        variables from file and add them to the cache. The extent is applied
+        afterwards, the cache always covers the whole file.
+        """
+        if self._cached is not None:
+            meta, arrays = self._cached['meta'], self._cached['arrays']
+            store = QA4SMValueStore.from_arrays(
+                arrays['lat'], arrays['lon'], meta['dims'], meta['shape'],
+                values={var: arrays['values:' + var] for var in meta['columns']},
+                masks={var: arrays['mask:' + var] for var in meta['columns']},
+                index_names=self.index_names)
+        else:
+            store = QA4SMValueStore(self.ds, self.index_names)
+            columns = [var for vars in self._var_index.values() for var, _, _ in vars]
+            store.load(columns)
+            arrays = OrderedDict([('lat', store.lat), ('lon', store.lon)])
+            for var in columns:
+                arrays['values:' + var] = store.values(var)
+                arrays['mask:' + var] = store.mask(var)
+            meta = {'filename': self.filename, 'index_names': list(self.index_names),
+                    'dims': list(store.dims), 'shape': list(store.shape),
+                    'attrs': dict(self._file_attrs()),
+                    'varnames': self._file_varnames(), 'columns': columns}
+            self.cache.save(self.filepath, meta, arrays)
+        return store.subset(self.extent) if self.extent else store
+
+    def _file_attrs(self) -> dict:
+        """ Global attributes of the results file (or the cache entry) """
+        if self._cached is not None:
+            return self._cached['meta']['attrs']
+        return super(QA4SMImg, self)._file_attrs()
+
+    def _file_varnames(self) -> list:
+        """ Names of all variables in the results file (or the cache entry) """
+        if self._cached is not None:
+            return self._cached['meta']['varnames']
+        return super(QA4SMImg, self)._file_varnames()
+
+    def _load_metrics_from_file(self, metrics:list=None) -> (dict, dict, dict):
+        """ Load and group all metrics from file """
+        # a new cache entry is only created when all values are read anyway
+        if self._cached is not None or \
+                (self.cache is not None and not self.lazy and metrics is None):
+            self._store = self._cache_store()
+        else:
+            self._store = QA4SMValueStore(self.ds, self.index_names, self.extent,
+                                          chunked=self.chunks is not None)
+        common, double, triple = \
+            super(QA4SMImg, self)._load_metrics_from_file(metrics)
+        if not self.lazy:
+            for metric_group in (common, double, triple):
+                for vars in metric_group.values():
+                    self._store.load([Var.varname for Var in vars])
+        return common, double, triple
+
+    def _open_dataset(self) -> (xr.Dataset or None):
+        """
+        Open the results file, with dask chunks in chunked mode. The file
+        is not opened if the image is read from the cache.
+        """
+        if self._cached is not None:
+            return None
+        if self.chunks is None:
+            return xr.open_dataset(self.filepath)
+        return xr.open_dataset(self.filepath, chunks=self.chunks)
+
+    def _load_metric_from_file(self, metric:str) -> np.array:
+        """
+        Create all (not empty) variables that describe the metric. In lazy
+        mode, the variables are checked for emptiness when they are first listed.
+        """
+        if not (self.lazy and self.ignore_empty):
+            return super(QA4SMImg, self)._load_metric_from_file(metric)
+        metr_vars = [self._load_var(var, parsed=(metric, g, parts))
+                     for var, g, parts in self._var_index.get(metric, [])]
+        metr_vars = [Var for Var in metr_vars if Var is not None]
+        if len(metr_vars) > 0:
+            self._unchecked[metric] = [Var.varname for Var in metr_vars]
+        return np.array(metr_vars)
+
+    def find_group(self, src):
+        """ Search the element and get the variable group that it is in (see QA4SMMeta) """
+        if src in self._vars.keys():
+            self._check_empty([self._vars[src].metric])
+        else:
+            self._check_empty([src])
+        return super(QA4SMImg, self).find_group(src)
+
+    def _load_var(self, varname:str, store=None, parsed=None) -> (QA4SMMetricVariable or None):
+        """ Create a common variable, linked to the value store of the image """
+        return super(QA4SMImg, self)._load_var(varname, store=self._store, parsed=parsed)
+
+    def isempty(self, varname:str) -> bool:
+        """
+        Check whether a variable contains only nans (within the extent).
+        In lazy mode, the variable is checked in chunks over the whole file.
+        """
+        if self.lazy and self.ds is not None:
+            return super(QA4SMImg, self).isempty(varname)
+        return self._store.count(varname) == 0
+
+    def metric_varnames(self, metric) -> list:
+        """
+        Get the names of all variables for the metric, grouped as in metric_df.
+
+        Parameters
+        ---------
+        metric : str
+            The name of a metric in the file.
+
+        Returns
+        -------
+        varnames : list
+            The names of the variables that describe the metric. For TC metrics,
+            a list of names for each metric dataset.
+        """
+        for g, metric_group in {0: self.common, 2: self.double, 3: self.triple}.items():
+            if metric in metric_group.keys():
+                if g != 3:
+                    return [Var.varname for Var in metric_group[metric]]
+                else:
+                    mds_vars = OrderedDict()
+                    for Var in metric_group[metric]:
+                        _, _, mds_meta = Var.get_varmeta()
+                        k = (mds_meta[0], mds_meta[1]['short_name'], mds_meta[1]['short_version'])
+                        if k not in mds_vars.keys():
+                            mds_vars[k] = [Var.varname]
+                        else:
+                            mds_vars[k].append(Var.varname)
+                    return list(mds_vars.values())
+
+    def metric_df(self, metric):
+        """
+        Group all variables for the metric in a common data frame
+
+        Parameters
+        ---------
+        metric : str
+            The name of a metric in the file, all variables for that metric are
+            combined into one values frame.
+
+        Returns
+        -------
+        df : pd.DataFrame
+            A dataframe that contains all variables that describe the metric
+            in the column
+        """
+        varnames = self.metric_varnames(metric)
+        if varnames is None:
+            return None
+        if len(varnames) > 0 and isinstance(varnames[0], list):  # TC metric
+            return [self._store.frame(mds_varnames) for mds_varnames in varnames]
+        return self._store.frame(varnames)
+
+    def var_df(self, varname):
+        """
+        Get the values of a single variable in the file.
+
+        Parameters
+        ---------
+        varname : str
+            The name of a metric variable in the file.
+
+        Returns
+        -------
+        df : pd.DataFrame
+            A dataframe with the (non-nan) values of the variable in the column
+        """
+        return self._store.frame([varname])
+
+    def var_chunks(self, varname, keep=True):
+        """
+        Iterate over the values of a variable (within the extent) chunk by
+        chunk. Without chunks, all values are one chunk.
+
+        Parameters
+        ---------
+        varname : str
+            The name of a metric variable in the file.
+        keep : bool, optional (default: True)
+            Keep the values in memory afterwards. If False, values that were
+            not loaded before are dropped again, and read again when requested.
+
+        Yields
+        ------
+        rows : slice
+            The rows (locations) of the chunk.
+        values : np.array
+            The values (including nans) of the chunk.
+        """
+        loaded = self._store.isloaded(varname)
+        for rows, values in self._store.iter_chunks(varname):
+            yield rows, values
+        if not (keep or loaded):
+            self._store.unload(varname)
+
+    def var_stats(self, varname, quantiles=(0.5,)) -> VarStats:
+        """
+        Get summary statistics of a variable, from the statistics of all
+        variables (see stats). In lazy mode, only the variable is described.
+
+        Parameters
+        ---------
+        varname : str
+            The name of a metric variable in the file.
+        quantiles : tuple, optional (default: (0.5,))
+            Quantiles to compute, between 0 and 1.
+
+        Returns
+        -------
+        stats : VarStats
+            count, mean, std, min, max and the quantiles of the variable.
+        """
+        varnames = [varname] if self.lazy else None
+        return self.stats(varnames, quantiles)[varname]
+
+    def stats(self, varnames=None, quantiles=globals.stats_quantiles) -> OrderedDict:
+        """
+        Get summary statistics of variables. They are computed once for all
+        variables that are not cached yet, in one pass over the values, and
+        then kept. In chunked mode, each variable is described chunk by chunk.
+
+        Parameters
+        ---------
+        varnames : list, optional (default: None)
+            Names of metric variables in the file, if None, all metric variables.
+        quantiles : tuple, optional (default: from globals)
+            Quantiles to compute (in addition to globals.stats_quantiles),
+            between 0 and 1.
+
+        Returns
+        -------
+        stats : OrderedDict
+            Variable names as the keys, VarStats as the values.
+        """
+        if varnames is None:
+            varnames = self.ls_vars(False).tolist()
+        quantiles = set([float(q) for q in quantiles])
+        missing = [varname for varname in varnames if varname not in self._stats.keys()
+                   or not quantiles.issubset(self._stats[varname].quantiles.keys())]
+        if len(missing) > 0:
+            quantiles = sorted(quantiles.union(globals.stats_quantiles))
+            if self.chunks is not None:
+                for varname in missing:
+                    chunks = lambda: (values for _, values in
+                                      self._store.iter_chunks(varname))
+                    self._stats[varname] = describe(chunks, quantiles=quantiles)
+            else:
+                columns = [self._store.values(varname) for varname in missing]
+                for varname, stats in zip(missing, describe_columns(columns, quantiles)):
+                    self._stats[varname] = stats
+        return OrderedDict([(varname, self._stats[varname]) for varname in varnames])
+
+    def stats_df(self, varnames=None, quantiles=globals.stats_quantiles) -> pd.DataFrame:
+        """
+        Get the summary statistics of variables (see stats) as a table.
+
+        Returns
+        -------
+        df : pd.DataFrame
+            One row per variable with the count, mean, std, min, max and
+            the quantiles (as e.g. '50%') of the variable.
+        """
+        quantiles = sorted(set([float(q) for q in quantiles]))
+        rows, index = [], []
+        for varname, stats in self.stats(varnames, quantiles).items():
+            row = OrderedDict([('count', stats.count), ('mean', stats.mean),
+                               ('std', stats.std), ('min', stats.min)])
+            for q in quantiles:
+                row['{:g}%'.format(q * 100)] = stats.quantile(q)
+            row['max'] = stats.max
+            rows.append(row)
+            index.append(varname)
+        return pd.DataFrame(rows, index=pd.Index(index, name='varname'))
+
+    def var_geo2d(self, varname) -> (np.array, tuple):
+        """
+        Grid the values of a variable, chunk by chunk, on the regular grid
+        behind the locations of the image (see geo_grid).
+
+        Parameters
+        ---------
+        varname : str
+            The name of a metric variable in the file.
+
+        Returns
+        -------
+        zz : np.array
+            The gridded values, [0,0] is the lower left corner.
+        data_extent : tuple
+            (x_min, x_max, y_min, y_max) in Data coordinates.
+        """
+        grid = self.geo_grid()
+        acc = None
+        for rows, values in self._store.iter_chunks(varname):
+            acc = grid.bin(values, rows, acc)
+        return grid.to_grid(acc), grid.extent
+
+    def geo_grid(self) -> GeoGrid:
+        """
+        Get the regular grid behind the locations of the image, with the
+        position of each location on it. It is computed on the first request
+        and shared by all variables.
+        """
+        if self._grid is None:
+            self._grid = GeoGrid(np.asarray(self._store.lat), np.asarray(self._store.lon))
+        return self._grid
+
+    def share(self, dirname=None):
+        """
+        Publish the locations and values of all variables into a memory-mapped
+        file (in memory, where available). When the image is pickled afterwards,
+        e.g. to send it to worker processes, only the handle of the file
+        is pickled, and the copies attach to the values without reading the
+        results file again.
+
+        Parameters
+        ----------
+        dirname : str, optional (default: None)
+            Directory for the file, by default /dev/shm if available.
+
+        Returns
+        -------
+        shared : SharedArrays
+            The shared arrays, call unshare() once they are no longer needed.
+        """
+        self._store.load(list(self._vars.keys()))
+        return self._store.share(dirname=dirname)
+
+    def unshare(self):
+        """ Remove the shared values, see share() """
+        self._store.unshare()
+
+    def __getstate__(self):
+        """ The dataset is not pickled if the values are shared """
+        state = self.__dict__.copy()
+        if self._store._shared is not None:
+            state['ds'] = None
+            if self._cached is not None:
+                state['_cached'] = dict(self._cached, arrays=dict())
+        return state
+
+    def subset(self, extent):
+        """
+        Get the image for a (smaller) extent. The values are taken from the
+        values of this image, using a spatial index, the file is not read again.
+        Variables that are empty within the extent are not removed.
+
+        Parameters
+        ----------
+        extent : tuple
+            Area to subset the values for.
+            (min_lon, max_lon, min_lat, max_lat)
+
+        Returns
+        -------
+        img : QA4SMImg
+            The image for the extent.
+        """
+        img = copy.copy(self)
+        img.extent = extent
+        img._store = self._store.subset(extent)
+        img._grid = None
+        img._stats = dict()
+        img._unchecked = OrderedDict()
+        groups = []
+        for metric_group in (self.common, self.double, self.triple):
+            group = dict()
+            for metric, vars in metric_group.items():
+                group[metric] = np.array([self._relink_var(Var, img._store)
+                                          for Var in vars])
+            groups.append(group)
+        img.common, img.double, img.triple = groups
+        img._index_groups()
+        return img
+
+    @staticmethod
+    def _relink_var(Var:QA4SMMetricVariable, store:QA4SMValueStore) \
+            -> QA4SMMetricVariable:
+        """ Copy the variable and link it to another value store """
+        Var = copy.copy(Var)
+        Var._store = store
+        return Var
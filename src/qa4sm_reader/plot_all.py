@@ -4,9 +4,59 @@ from qa4sm_reader.plotter import QA4SMPlotter
 from qa4sm_reader.img import QA4SMImg
 from qa4sm_reader import globals
 import matplotlib.pyplot as plt
+import multiprocessing
+import traceback
+
+_worker = dict()  # state of a plot worker process, set by _init_worker
+
+def _plot_jobs(img, metrics) -> list:
+    """
+    Split the plots for the metrics into jobs, one per box plot (metric)
+    and one per map (variable).
+
+    Returns
+    -------
+    jobs : list
+        ('box', metric) and ('map', varname) tuples, in the order of plotting.
+    """
+    jobs = []
+    for metric in metrics:
+        jobs.append(('box', metric))
+        for varname in img.metric_meta(metric).keys():
+            jobs.append(('map', varname))
+    return jobs
+
+def _plot_job(plotter, job, out_type, boxplot_kwargs, mapplot_kwargs) -> list:
+    """ Create the plot(s) of a single job, returns the created files """
+    kind, name = job
+    if kind == 'box':
+        if name not in globals.metric_groups[3]:
+            fnames = plotter.boxplot_basic(name, out_type=out_type, **boxplot_kwargs)
+        else:
+            fnames = plotter.boxplot_tc(name, out_type=out_type, **boxplot_kwargs)
+    else:
+        fnames = plotter.mapplot_var(name, out_name=None, out_type=out_type,
+                                     **mapplot_kwargs)
+    plt.close('all')
+    return fnames
+
+def _init_worker(plotter, out_type, boxplot_kwargs, mapplot_kwargs):
+    """ Keep the plotter and options in the worker, for all its jobs """
+    plt.switch_backend('Agg')
+    _worker.update(plotter=plotter, out_type=out_type,
+                   boxplot_kwargs=boxplot_kwargs, mapplot_kwargs=mapplot_kwargs)
+
+def _run_job(job) -> (list, str or None):
+    """ Run a job in a worker, errors are returned and not raised """
+    try:
+        return _plot_job(_worker['plotter'], job, _worker['out_type'],
+                         _worker['boxplot_kwargs'], _worker['mapplot_kwargs']), None
+    except Exception as e:
+        return [], (e, traceback.format_exc())
 
 def plot_all(filepath, metrics=None, extent=None, out_dir=None, out_type='png',
-             boxplot_kwargs=dict(), mapplot_kwargs=dict()):
+             boxplot_kwargs=dict(), mapplot_kwargs=dict(), n_workers=1,
+             chunksize=1, errors=None, start_method=None, value_ranges=None):
     """
     Creates boxplots for all metrics and map plots for all variables. Saves the output in a folder-structure.
 
@@ -29,29 +79,88 @@ def plot_all(filepath, metrics=None, extent=None, out_dir=None, out_type='png',
         Additional keyword arguments that are passed to the boxplot function.
     **mapplot_kwargs : dict, optional
         Additional keyword arguments that are passed to the mapplot function.
+    n_workers : int or None, optional (default: 1)
+        Number of processes to create the plots in. The file is loaded once,
+        each box plot (per metric) and map (per variable) is a separate job.
+        If None, one process per CPU is used. If 1, all plots are created
+        in the current process.
+    chunksize : int, optional (default: 1)
+        Number of jobs that are sent to a worker process at once.
+    errors : list, optional (default: None)
+        If a list is passed, plots that fail are skipped and (job, traceback)
+        is appended to it for each of them, where job is ('box', metric) or
+        ('map', varname). Otherwise, the first error is raised (with parallel
+        workers, as a RuntimeError that contains the traceback of the worker).
+    start_method : str, optional (default: None)
+        How the worker processes are started (see multiprocessing). By
+        default, they are forked where possible and share the loaded image.
+        Otherwise, the values are shared via a memory-mapped file that the
+        workers attach to.
+    value_ranges : dict or str, optional (default: None)
+        Colour ranges of the maps per metric, or the file they were saved to,
+        see QA4SMPlotter and ranges.value_ranges.
+
+    Returns
+    -------
+    fnames_boxes : list
+        Files of the box plots, in the order of the metrics.
+    fnames_maps : list
+        Files of the maps, in the order of the metrics and variables.
     """
 
     if not out_dir:
         out_dir = os.path.join(os.getcwd(), os.path.basename(filepath))
     img = QA4SMImg(filepath, extent=extent, ignore_empty=True)
-    plotter = QA4SMPlotter(image=img, out_dir=out_dir)
+    plotter = QA4SMPlotter(image=img, out_dir=out_dir, value_ranges=value_ranges)
 
     # === Metadata ===
     if not metrics:
         metrics = img.ls_metrics(False)
-    fnames_maps, fnames_boxes = [], []
+    jobs = _plot_jobs(img, metrics)
 
-    for metric in metrics:
-    # === load values and metadata ===
-        if metric not in globals.metric_groups[3]:
-            fns_box = plotter.boxplot_basic(metric, out_type=out_type,
-                                            **boxplot_kwargs)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = min(n_workers, len(jobs))
+
+    if n_workers <= 1:
+        results = []
+        for job in jobs:
+            try:
+                fnames = _plot_job(plotter, job, out_type, boxplot_kwargs,
+                                   mapplot_kwargs)
+                results.append((fnames, None))
+            except Exception as e:
+                if errors is None:
+                    raise
+                results.append(([], (e, traceback.format_exc())))
+    else:
+        if start_method is None and 'fork' in multiprocessing.get_all_start_methods():
+            start_method = 'fork'
+        ctx = multiprocessing.get_context(start_method)
+        # forked workers share the loaded image with this process, others
+        # attach to the shared values
+        share = ctx.get_start_method() != 'fork'
+        if share:
+            img.share()
+        try:
+            with ctx.Pool(n_workers, initializer=_init_worker,
+                          initargs=(plotter, out_type, boxplot_kwargs,
+                                    mapplot_kwargs)) as pool:
+                results = pool.map(_run_job, jobs, chunksize=chunksize)
+        finally:
+            if share:
+                img.unshare()
+
+    fnames_maps, fnames_boxes = [], []
+    for job, (fnames, error) in zip(jobs, results):
+        if error is not None:
+            e, tb = error
+            if errors is None:  # only in parallel, the worker traceback is kept as text
+                raise RuntimeError('plot job {} failed:\n{}'.format(job, tb)) from e
+            errors.append((job, tb))
+        elif job[0] == 'box':
+            fnames_boxes += fnames
         else:
-            fns_box = plotter.boxplot_tc(metric, out_type=out_type,
-                                         **boxplot_kwargs)
-        fns_maps = plotter.mapplot(metric, out_type=out_type, **mapplot_kwargs)
-        plt.close('all')
-        for fn in fns_box: fnames_boxes.append(fn)
-        for fn in fns_maps: fnames_maps.append(fn)
+            fnames_maps += fnames
 
     return fnames_boxes, fnames_maps
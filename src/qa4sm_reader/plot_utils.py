@@ -3,6 +3,8 @@
 Contains helper functions for plotting qa4sm results.
 """
 from qa4sm_reader import globals
+from qa4sm_reader.stats import VarStats, QuantileSketch
+from qa4sm_reader.geometries import geometry_cache
 import numpy as np
 import pandas as pd
 import os.path
@@ -13,34 +15,162 @@ from cartopy import config as cconfig
 import cartopy.feature as cfeature
 from cartopy.mpl.gridliner import LONGITUDE_FORMATTER, LATITUDE_FORMATTER
 import warnings
+import io
+from PIL import Image
+from collections import OrderedDict
 cconfig['data_dir'] = os.path.join(os.path.dirname(__file__), 'cartopy')
 
-def _float_gcd(a, b, atol=1e-08):
-    "Greatest common divisor (=groesster gemeinsamer teiler)"
-    while abs(b) > atol:
-        a, b = b, a % b
-    return a
-
-def _get_grid(a):
-    "Find the stepsize of the grid behind a and return the parameters for that grid axis."
+def _get_grid(a, resolution=globals.grid_step_resolution,
+              default_step=globals.grid_default_step):
+    """
+    Find the stepsize of the grid behind a and return the parameters for that grid axis.
+    The stepsize is the greatest common divisor of all steps between the
+    (sorted, unique) values, which are rounded to multiples of resolution.
+    If there is only a single value, the stepsize is default_step, if there
+    are none, the axis has no cells.
+    """
     a = np.unique(a)  # get unique values and sort
-    das = np.unique(np.diff(a))  # get unique stepsizes and sort
-    da = das[0]  # get smallest stepsize
-    for d in das[1:]:  # make sure, all stepsizes are multiple of da
-        da = _float_gcd(d, da)
+    if a.size == 0:
+        return np.nan, np.nan, default_step, 0
+    steps = np.round(np.diff(a) / resolution).astype(np.int64)
+    steps = steps[steps > 0]
     a_min = a[0]
     a_max = a[-1]
-    len_a = int((a_max - a_min) / da + 1)
+    if steps.size == 0:
+        return a_min, a_max, default_step, 1
+    da = np.gcd.reduce(steps) * resolution
+    len_a = int(round((a_max - a_min) / da)) + 1
     return a_min, a_max, da, len_a
 
 def _value2index(a, a_min, da):
     "Return the indexes corresponding to a. a and the returned index is a numpy array."
-    return ((a - a_min) / da).astype('int')
+    return np.round((np.asarray(a) - a_min) / da).astype('int')
+
+def _grid_axis(a, default_step=globals.grid_default_step) -> (float, float, float, int, bool):
+    """
+    Grid parameters of an axis, as from _get_grid. If the steps between the
+    values are not multiples of a common step (irregular axes, e.g. latitudes
+    of EASE2 grids), the largest step that is not a gap (more than twice the
+    median step) is used instead, so that the cells have no holes. Then
+    regular is False.
+    """
+    a = np.unique(a)
+    a_min, a_max, da, len_a = _get_grid(a, default_step=default_step)
+    regular = True
+    if len(a) > 1:
+        steps = np.diff(a)
+        if da * globals.grid_max_step_ratio < steps.min():  # common step is tiny
+            da = steps[steps <= 2 * np.median(steps)].max()
+            len_a = int(np.floor((a_max - a_min) / da + 0.5)) + 1
+            regular = False
+    return a_min, a_max, da, len_a, regular
+
+class GeoGrid(object):
+    """
+    The lat/lon grid behind a set of locations, and the cell of each location
+    on it. Computed once per image and shared by all variables.
+    For regular grids, each location is in its own cell. Irregular grids,
+    and grids with more than globals.grid_max_cells cells, are binned to
+    coarser cells that hold the mean of their locations, so that the memory
+    of the gridded values is bounded.
+    """
+    def __init__(self, lat, lon, max_cells=globals.grid_max_cells):
+        """
+        Parameters
+        ----------
+        lat, lon : np.array
+            Latitudes and longitudes of the locations.
+        max_cells : int, optional (default: from globals)
+            Maximum number of cells of the grid.
+        """
+        self.x_min, self.x_max, self.dx, self.len_x, regular_x = _grid_axis(lon, None)
+        self.y_min, self.y_max, self.dy, self.len_y, regular_y = _grid_axis(lat, None)
+        # an axis with a single value (a single row or column) gets the step of the other
+        self.dx = self.dx or self.dy or globals.grid_default_step
+        self.dy = self.dy or self.dx
+        self.binned = not (regular_x and regular_y)
+        if self.len_x * self.len_y > max_cells:
+            # cells of at least d x d degrees, only the finer axes are coarsened
+            dx, dy = self.dx, self.dy
+            d = np.sqrt((self.len_x * dx) * (self.len_y * dy) / max_cells)
+            while self.len_x * self.len_y > max_cells:
+                self.dx, self.dy = max(dx, d), max(dy, d)
+                self.len_x = int(np.floor((self.x_max - self.x_min) / self.dx + 0.5)) + 1
+                self.len_y = int(np.floor((self.y_max - self.y_min) / self.dy + 0.5)) + 1
+                d *= np.sqrt(self.len_x * self.len_y / max_cells)
+            self.binned = True
+        self.ii = np.clip(_value2index(lat, self.y_min, self.dy), 0, self.len_y - 1)  # row of each location
+        self.jj = np.clip(_value2index(lon, self.x_min, self.dx), 0, self.len_x - 1)  # column of each location
+
+    @property
+    def shape(self) -> tuple:
+        return self.len_y, self.len_x
+
+    @property
+    def extent(self) -> tuple:
+        """ (x_min, x_max, y_min, y_max) of the grid cells, in Data coordinates """
+        return (self.x_min - self.dx / 2, self.x_min + (self.len_x - 0.5) * self.dx,
+                self.y_min - self.dy / 2, self.y_min + (self.len_y - 0.5) * self.dy)
+
+    def bin(self, values, rows=None, acc=None) -> (np.ndarray, np.ndarray):
+        """
+        Add the values of (some of) the locations to their cells.
+
+        Parameters
+        ----------
+        values : np.array
+            Values of the locations, nan values are skipped.
+        rows : np.array or slice, optional (default: None)
+            Index or mask of the locations of the values, if None, the values
+            are for all locations.
+        acc : tuple, optional (default: None)
+            (sums, counts) from a previous call, to add the values to.
+
+        Returns
+        -------
+        acc : tuple
+            Sum and number of the values of each (flattened) cell.
+        """
+        ii, jj = (self.ii, self.jj) if rows is None else (self.ii[rows], self.jj[rows])
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        cells = ii[valid] * self.len_x + jj[valid]
+        n_cells = self.len_x * self.len_y
+        sums = np.bincount(cells, weights=values[valid], minlength=n_cells)
+        counts = np.bincount(cells, minlength=n_cells)
+        if acc is not None:
+            sums += acc[0]
+            counts += acc[1]
+        return sums, counts
+
+    def to_grid(self, acc=None) -> np.ndarray:
+        """
+        Get the gridded values (mean per cell) from the sums and counts of bin().
+        [0, 0] is the lower left corner.
+        """
+        if acc is None:
+            return np.full(self.shape, np.nan, dtype=np.float64)
+        sums, counts = acc
+        with np.errstate(invalid='ignore', divide='ignore'):
+            zz = sums / counts
+        return zz.reshape(self.shape)
+
+    def grid(self, values, rows=None) -> np.ndarray:
+        """
+        Put values of (some of) the locations on the grid, see bin().
+
+        Returns
+        -------
+        zz : np.ndarray
+            The gridded values, [0, 0] is the lower left corner.
+        """
+        return self.to_grid(self.bin(values, rows))
 
 def geotraj_to_geo2d(df, var, index=globals.index_names):
     """
     Converts geotraj (list of lat, lon, value) to a regular grid over lon, lat.
     The values in df needs to be sampled from a regular grid, the order does not matter.
+    Values on irregular (or very large) grids are binned, see GeoGrid.
     When used with plt.imshow(), specify data_extent to make sure, 
     the pixels are exactly where they are expected.
     
@@ -63,22 +193,9 @@ def geotraj_to_geo2d(df, var, index=globals.index_names):
     data_extent : tuple
         (x_min, x_max, y_min, y_max) in Data coordinates.
     """
-    xx = df.index.get_level_values(index[1])  # lon
-    yy = df.index.get_level_values(index[0])   # lat
-    data = df[var]
-
-    x_min, x_max, dx, len_x = _get_grid(xx)
-    y_min, y_max, dy, len_y = _get_grid(yy)
-
-    ii = _value2index(yy, y_min, dy)
-    jj = _value2index(xx, x_min, dx)
-
-    zz = np.full((len_y, len_x), np.nan, dtype=np.float64)
-    zz[ii, jj] = data
-
-    data_extent = (x_min - dx / 2, x_max + dx / 2, y_min - dy / 2, y_max + dy / 2)
-
-    return zz, data_extent
+    grid = GeoGrid(df.index.get_level_values(index[0]),  # lat
+                   df.index.get_level_values(index[1]))  # lon
+    return grid.grid(df[var].values), grid.extent
 
 def get_value_range(ds, metric=None, force_quantile=False, quantiles=[0.025, 0.975]):
     """
@@ -89,8 +206,8 @@ def get_value_range(ds, metric=None, force_quantile=False, quantiles=[0.025, 0.9
 
     Parameters
     ----------
-    ds : pd.DataFrame or pd.Series
-        Series holding the values
+    ds : pd.DataFrame or pd.Series or VarStats or QuantileSketch
+        Series holding the values, or their (precomputed) statistics
     metric : str , optional (default: None)
         name of the metric (e.g. 'R'). None equals to force_quantile=True.
     force_quantile : bool, optional
@@ -143,8 +260,8 @@ def get_quantiles(ds, quantiles):
 
     Parameters
     ----------
-    ds : (pandas.Series | pandas.DataFrame)
-        Input values.
+    ds : (pandas.Series | pandas.DataFrame | VarStats | QuantileSketch)
+        Input values, or their statistics (that contain the quantiles).
     quantiles : list
         quantile of values to include in the range
 
@@ -156,13 +273,15 @@ def get_quantiles(ds, quantiles):
         upper quantile.
 
     """
+    if isinstance(ds, (VarStats, QuantileSketch)):
+        return ds.quantile(quantiles[0]), ds.quantile(quantiles[1])
     q = ds.quantile(quantiles)
     if isinstance(ds, pd.Series):
         return q.iloc[0], q.iloc[1]
     elif isinstance(ds, pd.DataFrame):
         return min(q.iloc[0]), max(q.iloc[1])
     else:
-        raise TypeError("Inappropriate argument type. 'ds' must be pandas.Series or pandas.DataFrame.")
+        raise TypeError("Inappropriate argument type. 'ds' must be pandas.Series, pandas.DataFrame, VarStats or QuantileSketch.")
 
 def get_plot_extent(df, grid=False):
     """
@@ -184,12 +303,16 @@ def get_plot_extent(df, grid=False):
     """
     lat, lon = globals.index_names
     if grid:
-        x_min, x_max, dx, len_x = _get_grid(df.index.get_level_values(lon))
-        y_min, y_max, dy, len_y = _get_grid(df.index.get_level_values(lat))
-        extent = [x_min-dx/2., x_max+dx/2., y_min-dx/2., y_max+dx/2.]
+        extent = list(GeoGrid(df.index.get_level_values(lat),
+                              df.index.get_level_values(lon)).extent)
     else:
         extent = [df.index.get_level_values(lon).min(), df.index.get_level_values(lon).max(),
                   df.index.get_level_values(lat).min(), df.index.get_level_values(lat).max()]
+    return _pad_extent(extent)
+
+def _pad_extent(extent):
+    "Add padding of globals.map_pad around the extent and limit it to the globe."
+    extent = list(extent)
     dx = extent[1] - extent[0]
     dy = extent[3] - extent[2]
     # set map-padding around values to be globals.map_pad percent of the smaller dimension
@@ -248,11 +371,28 @@ def get_extend_cbar(metric):
         else:
             return 'neither'
 
+def _naturalearth_feature(ax, plot_extent, category, name, resolution, **kwargs) \
+        -> cfeature.ShapelyFeature:
+    """
+    Create a NaturalEarth feature for the map, from the geometries that
+    are clipped to the extent and projected to the axes projection once
+    per process (see geometries.GeometryCache).
+    """
+    geoms = geometry_cache.geometries(category, name, resolution, plot_extent,
+                                      ax.projection)
+    return cfeature.ShapelyFeature(geoms, ax.projection, **kwargs)
+
+def _geo_outline(ax):
+    """ The outline of a GeoAxes: ax.spines['geo'] (cartopy>=0.18) or ax.outline_patch """
+    if 'geo' in ax.spines:
+        return ax.spines['geo']
+    return ax.outline_patch
+
 def style_map(ax, plot_extent, add_grid=True, map_resolution=globals.naturalearth_resolution,
               add_topo=False, add_coastline=True,
               add_land=True, add_borders=True, add_us_states=False):
     ax.set_extent(plot_extent, crs=globals.data_crs)
-    ax.outline_patch.set_linewidth(0.4)
+    _geo_outline(ax).set_linewidth(0.4)
     if add_grid:
         # add gridlines. Bcs a bug in cartopy, draw girdlines first and then grid labels.
         # https://github.com/SciTools/cartopy/issues/1342
@@ -291,25 +431,225 @@ def style_map(ax, plot_extent, add_grid=True, map_resolution=globals.naturaleart
     if add_topo:
         ax.stock_img()
     if add_coastline:
-        coastline = cfeature.NaturalEarthFeature('physical', 'coastline',
-                                                 map_resolution,
-                                                 edgecolor='black', facecolor='none')
+        coastline = _naturalearth_feature(ax, plot_extent, 'physical', 'coastline',
+                                          map_resolution,
+                                          edgecolor='black', facecolor='none')
         ax.add_feature(coastline, linewidth=0.4, zorder=3)
     if add_land:
-        land = cfeature.NaturalEarthFeature('physical', 'land',
-                                            map_resolution,
-                                            edgecolor='none', facecolor='white')
+        land = _naturalearth_feature(ax, plot_extent, 'physical', 'land',
+                                     map_resolution,
+                                     edgecolor='none', facecolor='white')
         ax.add_feature(land, zorder=1)
     if add_borders:
-        borders = cfeature.NaturalEarthFeature('cultural', 'admin_0_countries',
-                                               map_resolution,
-                                               edgecolor='black', facecolor='none')
+        borders = _naturalearth_feature(ax, plot_extent, 'cultural', 'admin_0_countries',
+                                        map_resolution,
+                                        edgecolor='black', facecolor='none')
         ax.add_feature(borders, linewidth=0.2, zorder=3)
     if add_us_states:
         ax.add_feature(cfeature.STATES, linewidth=0.1, zorder=3)
 
     return ax
 
+class Basemap(object):
+    """
+    Pre-rendered map background. The styled map (see style_map) is rendered
+    once without values, as a raster of the features below the values (land,
+    topography) and a transparent raster of the features above them
+    (coastlines, borders, grid lines). The grid labels are kept as text.
+    The background can then be drawn into any axes with the same extent,
+    projection and figure layout, much faster than styling the map again.
+    """
+    def __init__(self, plot_extent, figsize, dpi, add_cbar=True, projection=None,
+                 oversample=globals.basemap_oversample, **style_kwargs):
+        """
+        Parameters
+        ----------
+        plot_extent : tuple
+            (x_min, x_max, y_min, y_max) in Data coordinates.
+        figsize : tuple
+            Figure size in inches, as for the plots that the background is used in.
+        dpi : int
+            Resolution of the plots that the background is used in.
+        add_cbar : bool, optional (default: True)
+            Whether the plots have a colorbar, which changes the layout.
+        projection : cartopy.crs, optional (default: None)
+            Projection of the map, if None, defaults to globals.crs.
+        oversample : int, optional (default: from globals)
+            Render the rasters at a multiple of dpi.
+        **style_kwargs :
+            Keyword arguments for style_map().
+        """
+        fig, ax, _ = init_plot(figsize, dpi * oversample, add_cbar, projection)
+        fig.patch.set_alpha(0.)
+        style_map(ax, plot_extent, **style_kwargs)
+        fig.canvas.draw()
+        self.xlim, self.ylim = ax.get_xlim(), ax.get_ylim()
+
+        # === grid labels, in axes coordinates ===
+        self.labels = []
+        to_axes = ax.transAxes.inverted()
+        for text in self._label_artists(ax):
+            if not text.get_visible() or not text.get_text():
+                continue
+            x, y = to_axes.transform(text.get_transform().transform(text.get_position()))
+            self.labels.append(dict(x=x, y=y, s=text.get_text(),
+                                    fontsize=text.get_fontsize(), color=text.get_color(),
+                                    ha=text.get_ha(), va=text.get_va(),
+                                    rotation=text.get_rotation()))
+            text.set_visible(False)
+
+        # === rasters below and above the values ===
+        _geo_outline(ax).set_visible(False)
+        artists = [a for a in ax.get_children() if a is not ax.patch
+                   and a is not _geo_outline(ax) and a not in ax.spines.values()]
+        visible = [a.get_visible() for a in artists]
+        for a, v in zip(artists, visible):
+            a.set_visible(v and a.get_zorder() < 2)
+        self.under = self._grab(fig, ax)
+        ax.patch.set_visible(False)
+        for a, v in zip(artists, visible):
+            a.set_visible(v and a.get_zorder() >= 2)
+        self.over = self._grab(fig, ax)
+        plt.close(fig)
+
+    @staticmethod
+    def _label_artists(ax) -> list:
+        """ Get the text artists of all grid labels in the axes """
+        gridliners = list(getattr(ax, '_gridliners', []))  # older cartopy versions
+        gridliners += [a for a in ax.get_children() if hasattr(a, 'label_artists')]
+        texts = []
+        for gl in gridliners:
+            for label in gl.label_artists:
+                texts.append(getattr(label, 'artist', label))
+        return texts
+
+    @staticmethod
+    def _grab(fig, ax) -> np.array:
+        """ Render the figure and cut out the RGBA pixels of the axes """
+        fig.canvas.draw()
+        buf = np.asarray(fig.canvas.buffer_rgba())
+        x0, y0, x1, y1 = np.round(ax.bbox.extents).astype(int)
+        height = buf.shape[0]
+        return buf[height - y1:height - y0, x0:x1].copy()
+
+    def draw(self, ax, plot_extent):
+        """
+        Draw the background into the passed axes.
+
+        Parameters
+        ----------
+        ax : cartopy.mpl.geoaxes.GeoAxes
+            Axes to draw the background in, with the same projection and layout
+            that the background was rendered for.
+        plot_extent : tuple
+            (x_min, x_max, y_min, y_max) in Data coordinates.
+        """
+        ax.set_extent(plot_extent, crs=globals.data_crs)
+        _geo_outline(ax).set_linewidth(0.4)
+        extent = self.xlim + self.ylim
+        ax.imshow(self.under, extent=extent, origin='upper', transform=ax.projection,
+                  interpolation='nearest', zorder=0.5)
+        ax.imshow(self.over, extent=extent, origin='upper', transform=ax.projection,
+                  interpolation='nearest', zorder=3)
+        ax.set_xlim(self.xlim)
+        ax.set_ylim(self.ylim)
+        for label in self.labels:
+            ax.text(transform=ax.transAxes, clip_on=False, **label)
+        return ax
+
+_basemaps = OrderedDict()  # pre-rendered backgrounds, most recently used last
+
+def _hashable(value):
+    """ Convert a (keyword argument) value to a hashable cache key """
+    if isinstance(value, dict):
+        return tuple(sorted([(k, _hashable(v)) for k, v in value.items()]))
+    if isinstance(value, (list, tuple, set)):
+        return tuple([_hashable(v) for v in value])
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+def get_basemap(plot_extent, figsize, dpi, add_cbar=True, projection=None,
+                **style_kwargs) -> Basemap:
+    """
+    Get the pre-rendered background for a map, it is rendered on the first
+    request and then kept (up to globals.basemap_cache_size backgrounds).
+    See Basemap for the parameters.
+    """
+    if not projection:
+        projection = globals.crs
+    k = (tuple(np.round(plot_extent, 8)), tuple(figsize), dpi, bool(add_cbar),
+         projection.proj4_init, _hashable(style_kwargs))
+    if k in _basemaps.keys():
+        _basemaps.move_to_end(k)
+    else:
+        _basemaps[k] = Basemap(plot_extent, figsize, dpi, add_cbar, projection,
+                               **style_kwargs)
+        while len(_basemaps) > globals.basemap_cache_size:
+            _basemaps.popitem(last=False)
+    return _basemaps[k]
+
+_raster_types = {'.png': 'PNG', '.jpg': 'JPEG', '.jpeg': 'JPEG', '.tif': 'TIFF',
+                 '.tiff': 'TIFF', '.webp': 'WEBP'}  # formats written from one render
+
+def save_figure(fig, out_dir, out_name, out_type, dpi='figure') -> list:
+    """
+    Save a figure in several formats. The layout and the tight bounding box
+    are computed once for all formats, raster formats are written from a
+    single rendered image and vector formats from the same layout.
+
+    Parameters
+    ----------
+    fig : matplotlib.figure.Figure
+        Figure to save.
+    out_dir : str
+        Directory to save the files in.
+    out_name : str
+        File name without extension.
+    out_type : set
+        File extensions (starting with a '.'), as from get_dir_name_type.
+    dpi : float or 'figure', optional (default: 'figure')
+        Resolution of the raster formats.
+
+    Returns
+    -------
+    fnames : list
+        The files that were written.
+    """
+    if dpi == 'figure':
+        dpi = fig.dpi
+    if hasattr(fig, 'draw_without_rendering'):  # layout only
+        fig.draw_without_rendering()
+    else:
+        fig.canvas.draw()
+    bbox = fig.get_tightbbox(fig.canvas.get_renderer()).padded(
+        plt.rcParams['savefig.pad_inches'])
+
+    fnames, png = [], None
+    for ending in sorted(out_type):
+        fname = os.path.join(out_dir, out_name + ending)
+        fmt = _raster_types.get(ending.lower())
+        if fmt is None:  # vector format
+            fig.savefig(fname, dpi=dpi, bbox_inches=bbox)
+        else:
+            if png is None:  # render once for all raster formats
+                buf = io.BytesIO()
+                fig.savefig(buf, format='png', dpi=dpi, bbox_inches=bbox)
+                png = buf.getvalue()
+            if fmt == 'PNG':
+                with open(fname, 'wb') as f:
+                    f.write(png)
+            else:
+                image = Image.open(io.BytesIO(png)).convert('RGBA')
+                if fmt == 'JPEG':  # no transparency, flatten onto white
+                    image = Image.alpha_composite(
+                        Image.new('RGBA', image.size, 'white'), image).convert('RGB')
+                image.save(fname, format=fmt, dpi=(dpi, dpi))
+        fnames.append(fname)
+    return fnames
+
 def make_watermark(fig, placement=globals.watermark_pos, for_map=False, offset=0.02):
     """
     Adds a watermark to fig and adjusts the current axis to make sure there
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 
 from qa4sm_reader.img import QA4SMImg
+from qa4sm_reader.stats import VarStats, describe_columns
 import os
-import seaborn as sns
 from qa4sm_reader.plot_utils import *
+from qa4sm_reader.plot_utils import _pad_extent
+from qa4sm_reader.raster import grid_var, render_grid, write_png
+from qa4sm_reader.ranges import load_value_ranges
 
 def _make_cbar(fig, im, cax, ref_short, metric):
     try:
@@ -21,9 +24,37 @@ def _make_cbar(fig, im, cax, ref_short, metric):
 
     return fig, im, cax
 
-def boxplot(df, label=None, figsize=None, dpi=100):
+def box_stats(df, labels=None) -> list:
     """
-    Create a boxplot_basic from the variables in df.
+    Compute the statistics of the boxes of the variables in df with NumPy
+    (see stats.describe_columns), as matplotlib's Axes.bxp takes them.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        DataFrame containing (multiple) 'var' Series.
+    labels : list, optional (default: None)
+        Caption of each box. If None, the column names are used.
+
+    Returns
+    -------
+    boxes : list
+        Statistics of each box (see stats.VarStats.box), with its 'label'.
+    """
+    labels = df.columns if labels is None else labels
+    columns = [df[col].values for col in df.columns]
+    boxes = []
+    for label, stats in zip(labels, describe_columns(columns, quantiles=(0.25, 0.5, 0.75))):
+        box = stats.box()
+        box['label'] = label
+        boxes.append(box)
+    return boxes
+
+def boxplot(df=None, label=None, figsize=None, dpi=100, boxes=None, title=None,
+            title_pad=globals.title_pad):
+    """
+    Create a boxplot_basic from the variables in df, or from precomputed
+    statistics of the boxes.
     The box shows the quartiles of the dataset while the whiskers extend
     to show the rest of the distribution, except for points that are
     determined to be “outliers” using a method that is a function of
@@ -31,44 +62,63 @@ def boxplot(df, label=None, figsize=None, dpi=100):
 
     Parameters
     ----------
-    df : pandas.DataFrame
-        DataFrame containing 'lat', 'lon' and (multiple) 'var' Series.
-    title : str, optional (default: None)
-        Title of the plot. If None, no title is added.
+    df : pandas.DataFrame, optional (default: None)
+        DataFrame containing (multiple) 'var' Series. Not needed if boxes are passed.
     label : str, optional
-        Label of the y axis, describing the metric. If None, a label is autogenerated from metadata.
+        Label of the y axis, describing the metric. If None, no label is added.
         The default is None.
     figsize : tuple, optional
         Figure size in inches. The default is globals.map_figsize.
     dpi : int, optional
         Resolution for raster graphic output. The default is globals.dpi.
+    boxes : list, optional (default: None)
+        Statistics of each box, as from box_stats or stats.VarStats.box with
+        a 'label'. If None, they are computed from df.
+    title : str, optional (default: None)
+        Title of the plot. If None, no title is added.
     title_pad : float, optional
         pad the title by title_pad pt. The default is globals.title_pad.
 
     Returns
     -------
-    fig : TYPE
-        DESCRIPTION.
-    ax : TYPE
-        DESCRIPTION.
-
+    fig : matplotlib.figure.Figure
+        The figure.
+    ax : matplotlib.axes.Axes
+        Axes containing the boxes.
     """
-    df = df.copy()
+    if boxes is None:
+        boxes = box_stats(df)
     # === plot ===
-    sns.set_style("whitegrid")
-    fig, ax = plt.subplots(figsize=figsize, dpi=dpi)
-    ax = sns.boxplot(data=df, ax=ax, width=0.15, showfliers=False, color='white')
-    sns.despine()  # remove ugly spines (=border around plot) right and top.
-
-    if label is not None:
-        ax.set_ylabel(label, weight='normal')  # TODO: Bug: If a circumflex ('^') is in the string, it becomes bold.)
+    with plt.rc_context(globals.boxplot_style):
+        fig, ax = plt.subplots(figsize=figsize, dpi=dpi)
+        positions = [i for i, box in enumerate(boxes) if box['count'] > 0]
+        if len(positions) > 0:
+            artists = ax.bxp([boxes[i] for i in positions], positions=positions,
+                             widths=globals.boxplot_box_width, showfliers=False,
+                             patch_artist=True, manage_ticks=False)
+            line = dict(color=globals.boxplot_line_color,
+                        linewidth=plt.rcParams['lines.linewidth'])
+            for box in artists['boxes']:
+                box.update(dict(facecolor='white', edgecolor=globals.boxplot_line_color,
+                                linewidth=line['linewidth'], zorder=.9))
+            for artist in artists['whiskers'] + artists['caps'] + artists['medians']:
+                artist.update(line)
+        ax.set_xticks(np.arange(len(boxes)))
+        ax.set_xticklabels([box.get('label', '') for box in boxes])
+        ax.xaxis.grid(False)
+        ax.set_xlim(-.5, len(boxes) - .5)
+
+        if label is not None:
+            ax.set_ylabel(label, weight='normal')  # TODO: Bug: If a circumflex ('^') is in the string, it becomes bold.)
+        if title is not None:
+            ax.set_title(title, pad=title_pad)
 
     return fig, ax
 
 
-
 def mapplot(df, var, metric, ref_short, plot_extent=None, colormap=None, projection=None,
                 add_cbar=True, figsize=globals.map_figsize, dpi=globals.dpi,
+                stats=None, geo2d=None, cache_basemap=False, value_range=None,
                 **style_kwargs):
         """
         Create an overview map from df using df[var] as color.
@@ -100,6 +150,20 @@ def mapplot(df, var, metric, ref_short, plot_extent=None, colormap=None, project
             The default is True.
         add_cbar : bool, optional
             Add a colorbar. The default is True.
+        stats : VarStats, optional
+            Precomputed statistics of var, used for the value range instead of df.
+            The default is None.
+        geo2d : tuple, optional
+            Precomputed (zz, zz_extent) as from geotraj_to_geo2d, used for the
+            image plot instead of df. The default is None.
+        cache_basemap : bool, optional
+            Draw the styled map background from a pre-rendered raster, that is
+            rendered once per extent, projection and style (see get_basemap).
+            Much faster for multiple maps, but the background is then a
+            raster also in vector output. The default is False.
+        value_range : tuple, optional
+            (v_min, v_max) of the colormap, instead of the range from
+            get_value_range. The default is None.
         **style_kwargs :
             Keyword arguments for plotter.style_map().
         Returns
@@ -111,7 +175,10 @@ def mapplot(df, var, metric, ref_short, plot_extent=None, colormap=None, project
         """
         # === value range ===
 
-        v_min, v_max = get_value_range(df[var], metric)
+        if value_range is not None:
+            v_min, v_max = value_range
+        else:
+            v_min, v_max = get_value_range(df[var] if stats is None else stats, metric)
 
         # === init plot ===
         fig, ax, cax = init_plot(figsize, dpi, add_cbar, projection)
@@ -138,12 +205,18 @@ def mapplot(df, var, metric, ref_short, plot_extent=None, colormap=None, project
                             c=df[var], cmap=cmap, s=markersize, vmin=v_min, vmax=v_max, edgecolors='black',
                             linewidths=0.1, zorder=2, transform=globals.data_crs)
         else:  # === mapplot ===
+            # === prepare values ===
+            if geo2d is None:
+                zz, zz_extent = geotraj_to_geo2d(df, var)
+            else:
+                zz, zz_extent = geo2d
+
             # === coordiniate range ===
             if not plot_extent:
-                plot_extent = get_plot_extent(df, grid=True)
-
-            # === prepare values ===
-            zz, zz_extent = geotraj_to_geo2d(df, var)
+                if geo2d is None:
+                    plot_extent = get_plot_extent(df, grid=True)
+                else:
+                    plot_extent = _pad_extent(zz_extent)
 
             # === plot ===
             im = ax.imshow(zz, cmap=cmap, vmin=v_min, vmax=v_max,
@@ -155,10 +228,15 @@ def mapplot(df, var, metric, ref_short, plot_extent=None, colormap=None, project
         if add_cbar:
             _make_cbar(fig, im, cax, ref_short, metric)
 
-        style_map(ax, plot_extent, **style_kwargs)
+        if cache_basemap:
+            basemap = get_basemap(plot_extent, figsize, dpi, add_cbar, projection,
+                                  **style_kwargs)
+            basemap.draw(ax, plot_extent)
+        else:
+            style_map(ax, plot_extent, **style_kwargs)
 
-        # === layout ===
-        fig.canvas.draw()  # very slow. necessary bcs of a bug in cartopy: https://github.com/SciTools/cartopy/issues/1207
+            # === layout ===
+            fig.canvas.draw()  # very slow. necessary bcs of a bug in cartopy: https://github.com/SciTools/cartopy/issues/1207
         # plt.tight_layout()  # pad=1)  # pad=0.5,h_pad=1,w_pad=1,rect=(0, 0, 1, 1))
         return fig, ax
 
@@ -211,7 +289,7 @@ def get_dir_name_type(out_name, out_type='png', out_dir=None):
 
 class QA4SMPlotter(object):
 
-    def __init__(self, image, out_dir=None):
+    def __init__(self, image, out_dir=None, value_ranges=None):
         """
         Create box plots from results in a qa4sm output file.
 
@@ -223,24 +301,34 @@ class QA4SMPlotter(object):
             Path to output generated plot.
             If None, defaults to the current working directory.
             The default is None.
+        value_ranges : dict or str, optional (default: None)
+            Colour ranges of the maps, metric as the key and (v_min, v_max)
+            as the value, or the path to a file from ranges.save_value_ranges.
+            Used for the maps of these metrics instead of the range of the
+            values in the image, e.g. to compare maps of different files.
         """
         self.img = image
         self.out_dir = out_dir
+        if isinstance(value_ranges, str):
+            value_ranges = load_value_ranges(value_ranges)
+        self.value_ranges = value_ranges or dict()
 
-    def _box_stats(self, ds:pd.Series, med:bool=True, std:bool=True,
+    def _box_stats(self, ds, med:bool=True, std:bool=True,
                    count:bool=True) -> str:
         """ Create the metric part with stats of the box caption """
 
-        std = ds.std() if std else None
-        count = ds.count() if count else None
+        if isinstance(ds, VarStats):
+            ds_med, ds_std, ds_count = ds.median, ds.std, ds.count
+        else:
+            ds_med, ds_std, ds_count = ds.median(), ds.std(), ds.count()
 
         met_str = []
         if med:
-            met_str.append('median: {:.3g}'.format(ds.median()))
+            met_str.append('median: {:.3g}'.format(ds_med))
         if std:
-            met_str.append('std. dev.: {:.3g}'.format(ds.std()))
+            met_str.append('std. dev.: {:.3g}'.format(ds_std))
         if count:
-            met_str.append('N: {:d}'.format(ds.count()))
+            met_str.append('N: {:d}'.format(int(ds_count)))
 
         return '\n'.join(met_str)
 
@@ -337,6 +425,24 @@ class QA4SMPlotter(object):
         return self._comb_title_parts(title_parts, max_len)
 
 
+    def _map_out_name(self, varname, var_meta:dict, metric:str) -> str:
+        """ Default file name (without extension) of the map of a variable """
+        ref_num = var_meta[metric][0][0]
+        ref_short = var_meta[metric][0][1]['short_name']
+        if metric in globals.metric_groups[0]:
+            return 'overview_{}'.format(varname)
+        elif metric in globals.metric_groups[2]:
+            ds_meta = var_meta[metric][1][0]
+            return 'overview_{}-{}_and_{}-{}_{}'.format(
+                ref_num, ref_short, ds_meta[0], ds_meta[1]['short_name'], metric)
+        else:
+            ds_meta = var_meta[metric][1][0]
+            ds2_meta = var_meta[metric][1][1]
+            met_meta = var_meta[metric][2]
+            return 'overview_{}-{}_and_{}-{}_and_{}-{}_{}_for_{}-{}'.format(
+                ref_num, ref_short, ds_meta[0], ds_meta[1]['short_name'], ds2_meta[0],
+                ds2_meta[1]['short_name'], metric, met_meta[0], met_meta[1]['short_name'])
+
     def boxplot_tc(self, metric, out_type=None,
                       add_stats=globals.boxplot_printnumbers):
         """
@@ -344,11 +450,11 @@ class QA4SMPlotter(object):
         """
         fnames = list()  # list to store all filenames.
 
-        # === load values and metadata ===
-        dfs = self.img.metric_df(metric)
-        for i, df in enumerate(dfs):
-            tcvars = df.columns.values
+        # === load statistics and metadata ===
+        for i, tcvars in enumerate(self.img.metric_varnames(metric)):
             REF_META, _, MDS_META = self.img.var_meta(tcvars[0])[metric]
+            var_stats = self.img.stats(tcvars, quantiles=(0.25, 0.5, 0.75))
+            boxes = []
             for tcvar in tcvars:
                 ref_meta, dss_meta, mds_meta = self.img.var_meta(tcvar)[metric]
                 assert mds_meta == MDS_META
@@ -359,14 +465,16 @@ class QA4SMPlotter(object):
                     caption_header='Other Data:')
 
                 if add_stats:
-                    box_stats = self._box_stats(df[tcvar])
+                    box_stats = self._box_stats(var_stats[tcvar])
                     box_cap = '{}\n{}'.format(box_cap_ds, box_stats)
                 else:
                     box_cap = box_cap_ds
 
-                df = df.rename(columns={tcvar: box_cap})
+                box = var_stats[tcvar].box()
+                box['label'] = box_cap
+                boxes.append(box)
 
-            max_title_len = globals.boxplot_title_len * len(df.columns)
+            max_title_len = globals.boxplot_title_len * len(boxes)
             title = self._box_title_tc(REF_META[1], MDS_META[1], metric, max_title_len)
 
             # === create label ===
@@ -377,17 +485,15 @@ class QA4SMPlotter(object):
                          globals._metric_units[REF_META[1]['short_name']]))
 
             # === plot values ===
-            figwidth = globals.boxplot_width * (1 + len(df.columns))
+            figwidth = globals.boxplot_width * (1 + len(boxes))
             figsize = [figwidth, globals.boxplot_height]
 
-            fig, ax = boxplot(df=df, label=label, figsize=figsize, dpi=globals.dpi)
+            fig, ax = boxplot(boxes=boxes, label=label, figsize=figsize, dpi=globals.dpi,
+                              title=title)
 
             # === set limits ===
             ##ax.set_ylim(get_value_range(df, metric))
 
-            # === add title ===
-            ax.set_title(title, pad=globals.title_pad)
-
             # === add watermark ===
             if globals.watermark_pos not in [None, False]:
                 make_watermark(fig, globals.watermark_pos, offset=0.1)
@@ -402,8 +508,7 @@ class QA4SMPlotter(object):
                 fname = os.path.join(out_dir, out_name+ending)
                 if os.path.isfile(fname):
                     warnings.warn('Overwriting file {}'.format(fname))
-                plt.savefig(fname, dpi='figure', bbox_inches='tight')
-                fnames.append(fname)
+            fnames += save_figure(fig, out_dir, out_name, out_type)
             plt.close()
         return fnames
 
@@ -439,29 +544,33 @@ class QA4SMPlotter(object):
         """
         fnames = list()  # list to store all filenames.
 
-        # === load values and metadata ===
-        df = self.img.metric_df(metric)
+        # === load statistics and metadata ===
+        varnames = self.img.metric_varnames(metric)
+        var_stats = self.img.stats(varnames, quantiles=(0.25, 0.5, 0.75))
         metric_meta = self.img.metric_meta(metric)
         ref_meta = self.img.ref_meta()[1]
 
-        # === rename columns = label of boxes ===
-        for var, meta in metric_meta.items():
-            dss_meta = meta[1]
+        # === caption = label of boxes ===
+        boxes = []
+        for var in varnames:
+            dss_meta = metric_meta[var][1]
 
-            if var in self.img.ls_vars(True)['common']:
+            if metric in globals.metric_groups[0]:
                 box_cap_ds = 'All datasets'
             else:
                 box_cap_ds = self._box_caption(dss_meta)
             if add_stats:
-                box_stats = self._box_stats(df[var])
+                box_stats = self._box_stats(var_stats[var])
                 box_cap = '{}\n{}'.format(box_cap_ds, box_stats)
             else:
                 box_cap = box_cap_ds
 
-            df = df.rename(columns={var: box_cap})
+            box = var_stats[var].box()
+            box['label'] = box_cap
+            boxes.append(box)
 
         # === create title ===
-        max_title_len = globals.boxplot_title_len * len(df.columns)
+        max_title_len = globals.boxplot_title_len * len(boxes)
         title = self._box_title_basic(ref_meta, metric, max_title_len)
 
         # === create label ===
@@ -470,17 +579,15 @@ class QA4SMPlotter(object):
                      globals._metric_units[ref_meta['short_name']]))
 
         # === plot values ===
-        figwidth = globals.boxplot_width * (1 + len(df.columns))
+        figwidth = globals.boxplot_width * (1 + len(boxes))
         figsize = [figwidth, globals.boxplot_height]
 
-        fig, ax = boxplot(df=df, label=label, figsize=figsize, dpi=globals.dpi)
+        fig, ax = boxplot(boxes=boxes, label=label, figsize=figsize, dpi=globals.dpi,
+                          title=title)
 
         # === set limits ===
         #ax.set_ylim(get_value_range(df, metric))
 
-        # === add title ===
-        ax.set_title(title, pad=globals.title_pad)
-
         # === add watermark ===
         if globals.watermark_pos not in [None, False]:
             make_watermark(fig, globals.watermark_pos)
@@ -495,10 +602,7 @@ class QA4SMPlotter(object):
             out_dir, out_name, out_type = get_dir_name_type(out_name, out_type, self.out_dir)
             if not os.path.exists(out_dir):
                 os.makedirs(out_dir)
-            for ending in out_type:
-                fname = os.path.join(out_dir, out_name+ending)
-                plt.savefig(fname, dpi='figure', bbox_inches='tight')
-                fnames.append(fname)
+            fnames += save_figure(fig, out_dir, out_name, out_type)
             plt.close('all')
             return fnames
 
@@ -534,7 +638,6 @@ class QA4SMPlotter(object):
             Axes or list of axes containing the plot.
 
         """
-        df = self.img._ds2df([varname])
         var_meta = self.img.var_meta(varname)
 
         assert len(list(var_meta.keys())) == 1
@@ -542,6 +645,19 @@ class QA4SMPlotter(object):
 
         ref_short = var_meta[metric][0][1]['short_name']
 
+        # === load values ===
+        # the value range is taken from the (cached) statistics of the image
+        if metric in self.value_ranges.keys():
+            plot_kwargs.setdefault('value_range', self.value_ranges[metric])
+        else:
+            plot_kwargs['stats'] = self.img.var_stats(varname, quantiles=(0.025, 0.975))
+        if ref_short in globals.scattered_datasets:
+            df = self.img.var_df(varname)
+        else:
+            # on the grid of the image, that is shared by all variables
+            df = None
+            plot_kwargs['geo2d'] = self.img.var_geo2d(varname)
+
         # === plot values ===
         fig, ax = mapplot(df=df, var=varname, metric=metric, ref_short=ref_short,
                           plot_extent=self.img.extent, **plot_kwargs)
@@ -570,21 +686,7 @@ class QA4SMPlotter(object):
             make_watermark(fig, globals.watermark_pos, for_map=True)
         # === save ===
         if not out_name:
-            ref_num = var_meta[metric][0][0]
-            if metric in globals.metric_groups[0]:
-                out_name = 'overview_{}'.format(varname)
-            elif metric in globals.metric_groups[2]:
-                ds_meta = var_meta[metric][1][0]
-                out_name = 'overview_{}-{}_and_{}-{}_{}'.format(
-                    ref_num, ref_short, ds_meta[0], ds_meta[1]['short_name'], metric)
-            else:
-                ds_meta = var_meta[metric][1][0]
-                ds2_meta = var_meta[metric][1][1]
-                met_meta = var_meta[metric][2]
-                out_name = 'overview_{}-{}_and_{}-{}_and_{}-{}_{}_for_{}-{}'.format(
-                    ref_num, ref_short, ds_meta[0], ds_meta[1]['short_name'], ds2_meta[0],
-                    ds2_meta[1]['short_name'], metric, met_meta[0], met_meta[1]['short_name'])
-
+            out_name = self._map_out_name(varname, var_meta, metric)
 
         if self.out_dir is None:
             return fig, ax
@@ -594,13 +696,56 @@ class QA4SMPlotter(object):
                 get_dir_name_type(out_name, out_type, self.out_dir)
             if not os.path.exists(out_dir):
                 os.makedirs(out_dir)
-            for ending in out_type:
-                fname = os.path.join(out_dir, out_name+ending)
-                plt.savefig(fname, dpi='figure', bbox_inches='tight')
-                fnames.append(fname)
+            fnames += save_figure(fig, out_dir, out_name, out_type)
             plt.close('all')
             return fnames
 
+    def mapplot_raster(self, varname, out_name=None, colormap=None,
+                       scale=globals.raster_scale, land=True) -> str or np.ndarray:
+        """
+        Render the map of a (gridded) variable directly to a png file, without
+        a matplotlib figure, title, colorbar or map features. Much faster than
+        mapplot_var, for thumbnails and previews.
+
+        Parameters
+        ----------
+        varname : str
+            Name of the variable to plot.
+        out_name : str, optional (default: None)
+            Name of output file (without extension).
+            If None, defaults to the name of the map from mapplot_var.
+        colormap : str or Colormap, optional (default: None)
+            If None, defaults to globals._colormaps.
+        scale : int, optional (default: from globals)
+            Each grid cell is drawn as scale x scale pixels.
+        land : bool, optional (default: True)
+            Draw grid cells without values on land in globals.raster_land_color.
+
+        Returns
+        -------
+        fname : str or np.ndarray
+            The png file that was written, or the (rows, cols, 4) uint8 image
+            if the plotter has no out_dir.
+        """
+        var_meta = self.img.var_meta(varname)
+        metric = list(var_meta.keys())[0]
+        zz, zz_extent, v_min, v_max = grid_var(self.img, varname,
+                                               self.value_ranges.get(metric))
+
+        rgba = render_grid(zz, colormap or globals._colormaps[metric], v_min, v_max,
+                           extent=zz_extent, scale=scale, land=land)
+        if self.out_dir is None:
+            return rgba
+
+        if not out_name:
+            out_name = self._map_out_name(varname, var_meta, metric)
+        out_dir = os.path.abspath(self.out_dir)
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        fname = os.path.join(out_dir, out_name + '.png')
+        write_png(fname, rgba)
+        return fname
+
     def mapplot(self, metric, out_type=None, **plot_kwargs):
         """
         Plot ALL variables for a given metric in the loaded file.
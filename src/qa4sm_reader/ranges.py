@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Common colour (value) ranges of the metrics over many results files, so that
+maps of different validation runs are comparable.
+"""
+from qa4sm_reader.img import QA4SMImg
+from qa4sm_reader.stats import QuantileSketch
+from qa4sm_reader.plot_utils import get_value_range
+import json
+
+_version = 1  # bump when the layout of the persisted file changes
+
+def metric_sketches(filepaths, metrics=None, sketches=None, extent=None) -> dict:
+    """
+    Stream over results files and collect the distribution of the values of
+    each metric (over all its variables) in mergeable sketches. Only one file,
+    and within it one variable, is held in memory at a time.
+
+    Parameters
+    ----------
+    filepaths : list
+        Paths to the results files.
+    metrics : list, optional (default: None)
+        Metrics to collect, if None, all metrics in the files.
+    sketches : dict, optional (default: None)
+        Sketches from a previous call, that the values are added to.
+    extent : tuple, optional (default: None)
+        Only collect the values in this area, (min_lon, max_lon, min_lat, max_lat).
+
+    Returns
+    -------
+    sketches : dict
+        Metric as the key, QuantileSketch of its values as the value.
+    """
+    sketches = dict() if sketches is None else sketches
+    for filepath in filepaths:
+        img = QA4SMImg(filepath, extent=extent, ignore_empty=False, metrics=metrics,
+                       lazy=True)
+        for metric in img.ls_metrics(False):
+            sketch = sketches.setdefault(metric, QuantileSketch())
+            for varname in img.metric_meta(metric).keys():
+                for _, values in img.var_chunks(varname, keep=False):
+                    sketch.update(values)
+        if img.ds is not None:
+            img.ds.close()
+    return sketches
+
+def value_ranges(filepaths, metrics=None, quantiles=(0.025, 0.975), extent=None) -> dict:
+    """
+    Compute the value range of each metric over many results files, as
+    get_value_range does for a single map: ranges from
+    globals._metric_value_ranges are kept, open limits are taken from the
+    quantiles of the values of all files.
+
+    Parameters
+    ----------
+    filepaths : list
+        Paths to the results files.
+    metrics : list, optional (default: None)
+        Metrics to compute the ranges for, if None, all metrics in the files.
+    quantiles : tuple, optional (default: (0.025, 0.975))
+        Quantiles of the values that open limits are set to.
+    extent : tuple, optional (default: None)
+        Only use the values in this area, (min_lon, max_lon, min_lat, max_lat).
+
+    Returns
+    -------
+    ranges : dict
+        Metric as the key, (v_min, v_max) as the value.
+    """
+    sketches = metric_sketches(filepaths, metrics, extent=extent)
+    return {metric: tuple(float(v) for v in
+                          get_value_range(sketch, metric, quantiles=list(quantiles)))
+            for metric, sketch in sketches.items() if sketch.count > 0}
+
+def save_value_ranges(ranges:dict, path):
+    """ Write value ranges (from value_ranges) to a json file """
+    with open(path, 'w') as f:
+        json.dump({'version': _version,
+                   'ranges': {metric: list(r) for metric, r in ranges.items()}},
+                  f, indent=2)
+
+def load_value_ranges(path) -> dict:
+    """ Read value ranges from a json file written by save_value_ranges """
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if data.get('version') != _version:
+        raise ValueError('Unsupported value ranges file: {}'.format(path))
+    return {metric: tuple(r) for metric, r in data['ranges'].items()}
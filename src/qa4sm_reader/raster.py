@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Fast rendering of gridded values directly to images, without a matplotlib
+figure. Used for thumbnails and previews of maps.
+"""
+from qa4sm_reader import globals
+from qa4sm_reader.geometries import geometry_cache
+from qa4sm_reader.plot_utils import get_value_range
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.colors import to_rgba
+from matplotlib.path import Path
+from PIL import Image
+from collections import OrderedDict
+
+_luts = dict()  # lookup tables per colormap name and size
+_land_masks = OrderedDict()  # rasterized land per extent and shape, most recently used last
+
+def _rgba_bytes(color) -> list:
+    return [int(round(c * 255)) for c in to_rgba(color)]
+
+def grid_var(img, varname, value_range=None) -> (np.ndarray, tuple, float, float):
+    """
+    Grid the values of a variable of an image and get their value range,
+    as for the map plots.
+
+    Parameters
+    ----------
+    img : QA4SMImg
+        The image.
+    varname : str
+        Name of a (gridded) metric variable of the image.
+    value_range : tuple, optional (default: None)
+        (v_min, v_max) to use instead of the range of the values.
+
+    Returns
+    -------
+    zz : np.ndarray
+        Gridded values, [0, 0] is the lower left corner.
+    extent : tuple
+        (x_min, x_max, y_min, y_max) of zz.
+    v_min, v_max : float
+        Value range of the colormap, from get_value_range or value_range.
+    """
+    var_meta = img.var_meta(varname)
+    metric = list(var_meta.keys())[0]
+    ref_short = var_meta[metric][0][1]['short_name']
+    if ref_short in globals.scattered_datasets:
+        raise ValueError('Values of {} are not gridded.'.format(ref_short))
+
+    zz, extent = img.var_geo2d(varname)
+    if value_range is not None:
+        v_min, v_max = value_range
+    else:
+        v_min, v_max = get_value_range(img.var_stats(varname, quantiles=(0.025, 0.975)),
+                                       metric)
+    return zz, extent, v_min, v_max
+
+def colormap_lut(cmap, n=globals.raster_lut_size) -> np.ndarray:
+    """
+    Get the lookup table of a colormap.
+
+    Parameters
+    ----------
+    cmap : str or matplotlib.colors.Colormap
+        The colormap.
+    n : int, optional (default: from globals)
+        Number of colors between v_min and v_max.
+
+    Returns
+    -------
+    lut : np.ndarray
+        (n + 3, 4) RGBA values as uint8. The colors for values below v_min,
+        above v_max and for nan are at the indexes n, n + 1 and n + 2.
+    """
+    cmap = plt.get_cmap(cmap)
+    k = (cmap.name, n)
+    if k not in _luts.keys():
+        lut = cmap(np.linspace(0., 1., n), bytes=True)
+        extra = np.array([_rgba_bytes(cmap.get_under()), _rgba_bytes(cmap.get_over()),
+                          _rgba_bytes(cmap.get_bad())], dtype=np.uint8)
+        _luts[k] = np.vstack([lut, extra])
+    return _luts[k]
+
+def color_index(zz, v_min, v_max, n=globals.raster_lut_size) -> np.ndarray:
+    """
+    Map values to the indexes of a lookup table from colormap_lut, like
+    matplotlib does with a linear norm.
+    """
+    zz = np.asarray(zz, dtype=np.float64)
+    scale = n / (v_max - v_min) if v_max > v_min else 0.
+    with np.errstate(invalid='ignore'):
+        idx = np.clip((zz - v_min) * scale, 0, n - 1).astype(np.intp)
+        idx[zz < v_min] = n
+        idx[zz > v_max] = n + 1
+    idx[np.isnan(zz)] = n + 2
+    return idx
+
+def _contains(geom, points) -> np.ndarray:
+    """
+    Check which points are inside of a (multi)polygon, with matplotlib paths
+    of its rings (points in holes are outside).
+
+    Parameters
+    ----------
+    geom : shapely.geometry.Polygon or MultiPolygon
+        The polygon(s).
+    points : np.ndarray
+        (n, 2) x and y of the points.
+
+    Returns
+    -------
+    inside : np.ndarray
+        True for the points inside of the polygon(s).
+    """
+    points = np.asarray(points, dtype=np.float64)
+    inside = np.zeros(len(points), dtype=bool)
+    for polygon in getattr(geom, 'geoms', [geom]):
+        if polygon.geom_type != 'Polygon' or polygon.is_empty:
+            continue
+        in_polygon = Path(np.asarray(polygon.exterior.coords), closed=True) \
+            .contains_points(points)
+        for ring in polygon.interiors:
+            in_polygon &= ~Path(np.asarray(ring.coords), closed=True).contains_points(points)
+        inside |= in_polygon
+    return inside
+
+def land_mask(extent, shape, map_resolution=globals.naturalearth_resolution) -> np.ndarray:
+    """
+    Rasterize the NaturalEarth land areas on a regular grid. The masks are
+    cached (up to globals.raster_mask_cache_size).
+
+    Parameters
+    ----------
+    extent : tuple
+        (x_min, x_max, y_min, y_max) of the grid, in lat/lon.
+    shape : tuple
+        (n_rows, n_cols) of the grid, the first row is the northernmost.
+    map_resolution : str, optional (default: from globals)
+        One of '10m', '50m' and '110m'.
+
+    Returns
+    -------
+    mask : np.ndarray
+        True for the pixels (centers) on land.
+    """
+    k = (tuple(np.round(extent, 8)), tuple(shape), map_resolution)
+    if k in _land_masks.keys():
+        _land_masks.move_to_end(k)
+        return _land_masks[k]
+
+    x_min, x_max, y_min, y_max = extent
+    n_rows, n_cols = shape
+    dx, dy = (x_max - x_min) / n_cols, (y_max - y_min) / n_rows
+    xx = x_min + dx * (np.arange(n_cols) + 0.5)
+    yy = y_max - dy * (np.arange(n_rows) + 0.5)
+    mask = np.zeros(shape, dtype=bool)
+    for geom in geometry_cache.geometries('physical', 'land', map_resolution, extent,
+                                          globals.data_crs):
+        g_x_min, g_y_min, g_x_max, g_y_max = geom.bounds
+        cols = np.flatnonzero((xx >= g_x_min) & (xx <= g_x_max))
+        rows = np.flatnonzero((yy >= g_y_min) & (yy <= g_y_max))
+        if cols.size == 0 or rows.size == 0:
+            continue
+        gx, gy = np.meshgrid(xx[cols], yy[rows])
+        inside = _contains(geom, np.column_stack([gx.ravel(), gy.ravel()]))
+        mask[np.ix_(rows, cols)] |= inside.reshape(gx.shape)
+
+    _land_masks[k] = mask
+    while len(_land_masks) > globals.raster_mask_cache_size:
+        _land_masks.popitem(last=False)
+    return mask
+
+def render_grid(zz, cmap, v_min, v_max, extent=None, scale=1, land=False,
+                land_color=globals.raster_land_color,
+                map_resolution=globals.naturalearth_resolution) -> np.ndarray:
+    """
+    Render gridded values to an image through the lookup table of a colormap.
+
+    Parameters
+    ----------
+    zz : np.ndarray
+        Gridded values, as from geotraj_to_geo2d ([0, 0] is the lower left corner).
+    cmap : str or matplotlib.colors.Colormap
+        Colormap of the values.
+    v_min, v_max : float
+        Value range of the colormap.
+    extent : tuple, optional (default: None)
+        (x_min, x_max, y_min, y_max) of zz, as from geotraj_to_geo2d.
+        Required for land.
+    scale : int, optional (default: 1)
+        Each value is drawn as scale x scale pixels.
+    land : bool, optional (default: False)
+        Draw the pixels without values on land in land_color.
+    land_color : str or tuple, optional (default: from globals)
+        Matplotlib color of land.
+    map_resolution : str, optional (default: from globals)
+        Resolution of the NaturalEarth land areas.
+
+    Returns
+    -------
+    rgba : np.ndarray
+        (n_rows, n_cols, 4) uint8 image, the first row is the northernmost.
+    """
+    lut = colormap_lut(cmap)
+    n = lut.shape[0] - 3
+    idx = color_index(zz, v_min, v_max, n)[::-1]  # first row on top
+    if scale > 1:
+        idx = np.repeat(np.repeat(idx, scale, axis=0), scale, axis=1)
+    rgba = lut[idx]
+    if land:
+        if extent is None:
+            raise ValueError('The extent of the grid is required to draw land.')
+        mask = land_mask(extent, idx.shape, map_resolution) & (idx == n + 2)
+        rgba[mask] = _rgba_bytes(land_color)
+    return rgba
+
+def write_png(fname, rgba, compress_level=globals.raster_png_compression):
+    """
+    Write an image from render_grid to a png file.
+
+    Parameters
+    ----------
+    fname : str
+        Path of the file.
+    rgba : np.ndarray
+        (n_rows, n_cols, 4) uint8 image.
+    compress_level : int, optional (default: from globals)
+        zlib compression level, 0 (none) to 9 (smallest, slowest).
+    """
+    Image.fromarray(rgba, 'RGBA').save(fname, format='PNG',
+                                       compress_level=compress_level)
@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+"""
+Summary statistics of metric variables, computed over (chunks of) values.
+"""
+from qa4sm_reader import globals
+import numpy as np
+import copy
+
+class MomentStats(object):
+    """
+    Count, mean, variance, min and max of a stream of values. Stats of
+    different chunks can be merged (Chan et al.'s parallel algorithm).
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.min = np.nan
+        self.max = np.nan
+
+    def update(self, values):
+        """ Add the (non-nan) values of a chunk """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        chunk = MomentStats()
+        chunk.count = len(values)
+        chunk.mean = float(values.mean())
+        chunk.m2 = float(((values - chunk.mean) ** 2).sum())
+        chunk.min, chunk.max = float(values.min()), float(values.max())
+        return self.merge(chunk)
+
+    def merge(self, other):
+        """ Merge the stats of another chunk into these stats """
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+        return self
+
+    @property
+    def std(self) -> float:
+        """ Sample standard deviation (ddof=1, as in pandas) """
+        if self.count < 2:
+            return np.nan
+        return float(np.sqrt(self.m2 / (self.count - 1)))
+
+
+class QuantileSketch(object):
+    """
+    Mergeable sketch of the distribution of a stream of values, with bounded
+    memory (DDSketch). Values are counted in logarithmic buckets, so that each
+    quantile is approximated with a relative error of at most rel_accuracy
+    (unless buckets had to be collapsed, which only affects the values of
+    the smallest magnitude). Sketches of different chunks, partitions or
+    files can be merged.
+    """
+    def __init__(self, rel_accuracy=globals.sketch_rel_accuracy,
+                 max_buckets=globals.sketch_max_buckets):
+        """
+        Parameters
+        ----------
+        rel_accuracy : float, optional (default: from globals)
+            Maximum relative error of the quantiles.
+        max_buckets : int, optional (default: from globals)
+            Maximum number of buckets (of positive and negative values each).
+        """
+        self.rel_accuracy = rel_accuracy
+        self.max_buckets = max_buckets
+        self._gamma = (1. + rel_accuracy) / (1. - rel_accuracy)
+        self._log_gamma = np.log(self._gamma)
+        self._pos, self._neg = dict(), dict()  # bucket key: count
+        self.zeros = 0
+        self.count = 0
+        self.min = np.nan
+        self.max = np.nan
+        self._sorted = None
+
+    def _keys(self, values) -> np.array:
+        return np.ceil(np.log(values) / self._log_gamma).astype(np.int64)
+
+    def _value(self, key) -> float:
+        """ Representative value (with the smallest relative error) of a bucket """
+        return 2. * self._gamma ** key / (self._gamma + 1.)
+
+    @staticmethod
+    def _add(store:dict, keys, counts):
+        for k, n in zip(keys.tolist(), counts.tolist()):
+            store[k] = store.get(k, 0) + n
+
+    def _collapse(self, store:dict):
+        """ Merge the buckets of the smallest magnitude until the store fits """
+        if len(store) <= self.max_buckets:
+            return
+        keys = sorted(store.keys())
+        n_drop = len(keys) - self.max_buckets + 1
+        store[keys[n_drop]] += sum([store.pop(k) for k in keys[:n_drop]])
+
+    def update(self, values):
+        """ Add the (non-nan) values of a chunk """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        for store, v in ((self._pos, values[values > 0]), (self._neg, -values[values < 0])):
+            if len(v) > 0:
+                self._add(store, *np.unique(self._keys(v), return_counts=True))
+                self._collapse(store)
+        self.zeros += int(np.count_nonzero(values == 0))
+        self.count += len(values)
+        self.min = float(np.nanmin([self.min, values.min()]))
+        self.max = float(np.nanmax([self.max, values.max()]))
+        self._sorted = None
+        return self
+
+    def merge(self, other):
+        """ Merge the sketch of another chunk into this sketch """
+        if other.count == 0:
+            return self
+        if other._gamma != self._gamma:
+            raise ValueError('Only sketches with the same accuracy can be merged')
+        for store, o in ((self._pos, other._pos), (self._neg, other._neg)):
+            self._add(store, np.array(list(o.keys())), np.array(list(o.values())))
+            self._collapse(store)
+        self.zeros += other.zeros
+        self.count += other.count
+        self.min = float(np.nanmin([self.min, other.min]))
+        self.max = float(np.nanmax([self.max, other.max]))
+        self._sorted = None
+        return self
+
+    def _buckets(self) -> (np.array, np.array):
+        """ Representative values (ascending) and cumulative counts of all buckets """
+        if self._sorted is None:
+            neg = sorted(self._neg.keys(), reverse=True)
+            pos = sorted(self._pos.keys())
+            values = [-self._value(k) for k in neg] + [0.] + [self._value(k) for k in pos]
+            counts = [self._neg[k] for k in neg] + [self.zeros] + [self._pos[k] for k in pos]
+            self._sorted = (np.array(values), np.cumsum(counts))
+        return self._sorted
+
+    def _order_stat(self, k) -> float:
+        """ Approximation of the k-th smallest value (exact for the min and max) """
+        if k <= 0:
+            return self.min
+        if k >= self.count - 1:
+            return self.max
+        values, cum = self._buckets()
+        v = values[min(int(np.searchsorted(cum, k, side='right')), len(values) - 1)]
+        return float(min(max(v, self.min), self.max))
+
+    def quantile(self, q) -> float:
+        """ Get an (approximate) quantile, interpolated linearly as in pandas """
+        if self.count == 0:
+            return np.nan
+        pos = float(q) * (self.count - 1)
+        k = int(np.floor(pos))
+        lower, upper = self._order_stat(k), self._order_stat(min(k + 1, self.count - 1))
+        return float(lower + (pos - k) * (upper - lower))
+
+    def lowest_above(self, threshold) -> float:
+        """ Approximation of the smallest value that is >= threshold """
+        values, _ = self._buckets()
+        values = values[values >= threshold]
+        return self.min if len(values) == 0 else float(max(values[0], self.min))
+
+    def highest_below(self, threshold) -> float:
+        """ Approximation of the largest value that is <= threshold """
+        values, _ = self._buckets()
+        values = values[values <= threshold]
+        return self.max if len(values) == 0 else float(min(values[-1], self.max))
+
+
+class VarStats(object):
+    """ Summary statistics of a single variable """
+    def __init__(self, moments, quantiles, sketch=None, whiskers=None):
+        """
+        Parameters
+        ----------
+        moments : MomentStats
+            count, mean, std, min and max of the variable
+        quantiles : dict
+            Quantile (between 0 and 1) as the key, value of the quantile as values.
+        sketch : QuantileSketch, optional (default: None)
+            Sketch of the distribution, for further quantiles and for merging.
+        whiskers : dict, optional (default: None)
+            Exact (lowest, highest) values within whis times the inter-quartile
+            range, with whis as the key.
+        """
+        self.moments = moments
+        self.count = moments.count
+        self.mean = moments.mean if moments.count > 0 else np.nan
+        self.std = moments.std
+        self.min = moments.min
+        self.max = moments.max
+        self.quantiles = quantiles
+        self.sketch = sketch
+        self.whiskers = whiskers or dict()
+
+    @property
+    def median(self) -> float:
+        return self.quantile(0.5)
+
+    def quantile(self, q) -> float:
+        """ Get a quantile of the variable, it must have been computed before """
+        try:
+            return self.quantiles[float(q)]
+        except KeyError:
+            if self.sketch is not None:
+                return self.sketch.quantile(q)
+            raise KeyError('Quantile {} was not computed, available are {}'.format(
+                q, ', '.join([str(k) for k in self.quantiles.keys()])))
+
+    def merge(self, other):
+        """
+        Get the stats of the values of both, e.g. of two partitions or files.
+        Both must have a sketch, the quantiles are taken from the merged sketch.
+        """
+        if self.sketch is None or other.sketch is None:
+            raise ValueError('Only stats with a sketch (quantile_method "sketch") can be merged')
+        moments = copy.copy(self.moments).merge(other.moments)
+        sketch = copy.deepcopy(self.sketch).merge(other.sketch)
+        quantiles = {q: sketch.quantile(q) for q in self.quantiles.keys()}
+        return VarStats(moments, quantiles, sketch)
+
+    def box(self, whis=globals.boxplot_whis) -> dict:
+        """
+        Get the statistics of a box plot (as for matplotlib's Axes.bxp).
+        Whiskers are at the lowest and highest values within whis times the
+        inter-quartile range from the box. If they were not computed exactly,
+        they are taken from the sketch or clipped to the value range.
+
+        Returns
+        -------
+        box : dict
+            med, q1, q3, whislo, whishi, mean and count of the variable.
+        """
+        q1, q3 = self.quantile(0.25), self.quantile(0.75)
+        lo, hi = q1 - whis * (q3 - q1), q3 + whis * (q3 - q1)
+        if float(whis) in self.whiskers.keys():
+            whislo, whishi = self.whiskers[float(whis)]
+        elif self.sketch is not None:
+            whislo, whishi = self.sketch.lowest_above(lo), self.sketch.highest_below(hi)
+        else:
+            whislo, whishi = max(lo, self.min), min(hi, self.max)
+        return {'med': self.median, 'q1': q1, 'q3': q3, 'whislo': whislo,
+                'whishi': whishi, 'mean': self.mean, 'count': self.count}
+
+
+def _whiskers(sorted_values, q1, q3, whis=globals.boxplot_whis) -> dict:
+    """ Exact whiskers from the sorted (non-nan) values """
+    lo, hi = q1 - whis * (q3 - q1), q3 + whis * (q3 - q1)
+    i = int(np.searchsorted(sorted_values, lo, side='left'))
+    j = int(np.searchsorted(sorted_values, hi, side='right')) - 1
+    return {float(whis): (float(sorted_values[min(i, len(sorted_values) - 1)]),
+                          float(sorted_values[max(j, 0)]))}
+
+def _hist_quantiles(chunks, quantiles, moments, n_bins) -> dict:
+    """
+    Approximate quantiles from a histogram over the value range. The error
+    is at most one bin width, (max - min) / n_bins.
+    """
+    edges = np.linspace(moments.min, moments.max, n_bins + 1)
+    hist = np.zeros(n_bins, dtype=np.int64)
+    for values in chunks():
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        hist += np.histogram(values, bins=edges)[0]
+    cdf = np.cumsum(hist)
+
+    def order_stat(k):
+        # position of the k-th smallest value within its bin
+        b = min(int(np.searchsorted(cdf, k, side='right')), n_bins - 1)
+        before = cdf[b - 1] if b > 0 else 0
+        frac = (k - before + 0.5) / hist[b] if hist[b] > 0 else 0.5
+        return edges[b] + min(max(frac, 0.), 1.) * (edges[b + 1] - edges[b])
+
+    ret = dict()
+    for q in quantiles:
+        pos = q * (moments.count - 1)  # linear interpolation, as in pandas
+        k = int(np.floor(pos))
+        lower, upper = order_stat(k), order_stat(min(k + 1, moments.count - 1))
+        ret[float(q)] = float(lower + (pos - k) * (upper - lower))
+    return ret
+
+def _describe_sketch(chunks, quantiles) -> VarStats:
+    """ Moments and a sketch of the values, in one pass over the chunks """
+    moments, sketch = MomentStats(), QuantileSketch()
+    for values in chunks():
+        moments.update(values)
+        sketch.update(values)
+    return VarStats(moments, {q: sketch.quantile(q) for q in quantiles}, sketch)
+
+def describe(chunks, quantiles=(0.5,), n_bins=globals.quantile_bins,
+             method=None) -> VarStats:
+    """
+    Compute summary statistics over the chunks of a variable.
+
+    Parameters
+    ----------
+    chunks : callable
+        Returns an iterable over the chunks (np.arrays) of values. Called once
+        for in-memory values or sketches, twice if the values come in
+        multiple chunks.
+    quantiles : tuple, optional (default: (0.5,))
+        Quantiles to compute, between 0 and 1.
+    n_bins : int, optional (default: from globals)
+        Number of histogram bins used to approximate the quantiles of
+        chunked values.
+    method : str, optional (default: None)
+        'exact' for exact quantiles of in-memory values (and histogram
+        quantiles of chunked values), 'sketch' for (mergeable) approximate
+        quantiles from a QuantileSketch. If None, globals.quantile_method.
+
+    Returns
+    -------
+    stats : VarStats
+        The summary statistics of the variable.
+    """
+    quantiles = sorted(set([float(q) for q in quantiles]))
+    if (method or globals.quantile_method) == 'sketch':
+        return _describe_sketch(chunks, quantiles)
+
+    moments = MomentStats()
+    n_chunks, last = 0, None
+    for values in chunks():
+        moments.update(values)
+        n_chunks, last = n_chunks + 1, values
+
+    if moments.count == 0:
+        return VarStats(moments, {q: np.nan for q in quantiles})
+    if n_chunks == 1:  # all values are in memory, exact quantiles
+        values = np.sort(np.asarray(last, dtype=np.float64).ravel())
+        values = values[:moments.count]  # nans are sorted last
+        q1, q3 = np.quantile(values, (0.25, 0.75))
+        return VarStats(moments, {q: float(v) for q, v in
+                                  zip(quantiles, np.quantile(values, quantiles))},
+                        whiskers=_whiskers(values, q1, q3))
+    else:
+        return VarStats(moments, _hist_quantiles(chunks, quantiles, moments, n_bins))
+
+def _sorted_quantile(block, last, q) -> np.array:
+    """ Quantile of each column of a sorted block, with last the index of the last value """
+    pos = q * last
+    k = np.floor(pos).astype(np.intp)
+    cols = np.arange(block.shape[1])
+    lower = block[k, cols]
+    upper = block[np.minimum(k + 1, last), cols]
+    return lower + (pos - k) * (upper - lower)  # linear interpolation, as in numpy and pandas
+
+def describe_columns(columns, quantiles=(0.5,), block_bytes=globals.stats_block_bytes,
+                     method=None) -> list:
+    """
+    Compute summary statistics of multiple in-memory variables at once.
+    The variables are stacked into a matrix (in blocks of columns of at most
+    block_bytes) and each block is sorted once, all statistics are then
+    computed column-wise from the sorted block.
+
+    Parameters
+    ----------
+    columns : list
+        Values (np.arrays of the same length, nan is missing) of the variables.
+    quantiles : tuple, optional (default: (0.5,))
+        Quantiles to compute, between 0 and 1.
+    block_bytes : int, optional (default: from globals)
+        Maximum size of a block of stacked columns.
+    method : str, optional (default: None)
+        'exact' or 'sketch', see describe().
+
+    Returns
+    -------
+    stats : list
+        VarStats of each variable, as from describe().
+    """
+    quantiles = sorted(set([float(q) for q in quantiles]))
+    if (method or globals.quantile_method) == 'sketch':
+        return [_describe_sketch(lambda: [c], quantiles) for c in columns]
+    if len(columns) == 0:
+        return []
+    n = len(columns[0])
+    if n == 0:
+        return [VarStats(MomentStats(), {q: np.nan for q in quantiles}) for _ in columns]
+    per_block = max(1, int(block_bytes // max(8 * n, 1)))
+    ret = []
+    for start in range(0, len(columns), per_block):
+        block = np.stack([np.asarray(c, dtype=np.float64) for c in
+                          columns[start:start + per_block]], axis=1)
+        block.sort(axis=0)  # nans last
+        count = np.count_nonzero(~np.isnan(block), axis=0)
+        last = np.maximum(count - 1, 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.nansum(block, axis=0) / count
+            m2 = np.nansum((block - mean) ** 2, axis=0)
+        qs = [_sorted_quantile(block, last, q) for q in quantiles]
+        q1, q3 = _sorted_quantile(block, last, 0.25), _sorted_quantile(block, last, 0.75)
+        for i in range(block.shape[1]):
+            moments = MomentStats()
+            if count[i] > 0:
+                moments.count, moments.mean, moments.m2 = int(count[i]), float(mean[i]), float(m2[i])
+                moments.min, moments.max = float(block[0, i]), float(block[last[i], i])
+                ret.append(VarStats(moments, {q: float(v[i]) for q, v in zip(quantiles, qs)},
+                                    whiskers=_whiskers(block[:count[i], i], q1[i], q3[i])))
+            else:
+                ret.append(VarStats(moments, {q: np.nan for q in quantiles}))
+    return ret
@@ -0,0 +1,557 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar storage of the values in a qa4sm results file.
+"""
+from qa4sm_reader import globals
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+import copy
+import os
+import tempfile
+
+class SpatialIndex(object):
+    """
+    Bucket grid index over a list of locations. Locations are sorted by the
+    grid cell they are in, so that the locations of a range of cells in
+    one column of the bucket grid are a contiguous block in the sorted order.
+    """
+    def __init__(self, lat, lon, points_per_cell=16):
+        """
+        Parameters
+        ----------
+        lat : np.array
+            Latitude of the locations
+        lon : np.array
+            Longitude of the locations
+        points_per_cell : int, optional (default: 16)
+            Average number of locations in a bucket, used to derive the cell size.
+        """
+        self.lat = np.asarray(lat)
+        self.lon = np.asarray(lon)
+
+        if len(self.lat) > 0:
+            self.lat_min, self.lon_min = np.nanmin(self.lat), np.nanmin(self.lon)
+            lat_span = np.nanmax(self.lat) - self.lat_min
+            lon_span = np.nanmax(self.lon) - self.lon_min
+        else:
+            self.lat_min, self.lon_min, lat_span, lon_span = 0., 0., 0., 0.
+        n_cells = max(1., len(self.lat) / float(points_per_cell))
+        self.cell = max(max(lat_span, lon_span) / np.sqrt(n_cells), 1e-6)
+        self.n_rows = int(np.floor(lat_span / self.cell)) + 1  # cells in lat direction
+        self.n_cols = int(np.floor(lon_span / self.cell)) + 1  # cells in lon direction
+
+        cells = self._cell_ids(*self._cell_idx(self.lat, self.lon))
+        self.order = np.argsort(cells, kind='stable')
+        self.sorted_cells = cells[self.order]
+
+    def _cell_idx(self, lat, lon) -> (np.array, np.array):
+        """ Get the bucket row and column of the passed coordinates """
+        row = np.floor((np.asarray(lat) - self.lat_min) / self.cell).astype(np.int64)
+        col = np.floor((np.asarray(lon) - self.lon_min) / self.cell).astype(np.int64)
+        return row, col
+
+    def _cell_ids(self, row, col) -> np.array:
+        return col * self.n_rows + row
+
+    def query(self, extent) -> np.array:
+        """
+        Find the locations within the extent.
+
+        Parameters
+        ----------
+        extent : tuple
+            (min_lon, max_lon, min_lat, max_lat)
+
+        Returns
+        -------
+        rows : np.array
+            Sorted indices of the locations within the extent.
+        """
+        min_lon, max_lon, min_lat, max_lat = extent
+        (row0, row1), (col0, col1) = self._cell_idx([min_lat, max_lat],
+                                                    [min_lon, max_lon])
+        row0, row1 = max(row0, 0), min(row1, self.n_rows - 1)
+        col0, col1 = max(col0, 0), min(col1, self.n_cols - 1)
+        if row0 > row1 or col0 > col1:
+            return np.array([], dtype=np.int64)
+
+        # the cells row0..row1 of each column are a contiguous block
+        cols = np.arange(col0, col1 + 1)
+        starts = np.searchsorted(self.sorted_cells, self._cell_ids(row0, cols), side='left')
+        ends = np.searchsorted(self.sorted_cells, self._cell_ids(row1, cols), side='right')
+        candidates = [self.order[start:end] for start, end in zip(starts, ends) if end > start]
+        if len(candidates) == 0:
+            return np.array([], dtype=np.int64)
+
+        rows = np.concatenate(candidates)
+        lat, lon = self.lat[rows], self.lon[rows]
+        rows = rows[(lon >= min_lon) & (lon <= max_lon) &
+                    (lat >= min_lat) & (lat <= max_lat)]
+        return np.sort(rows)
+
+
+def _shared_dir() -> str:
+    """ Directory for shared arrays, in memory (/dev/shm) where available """
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+class SharedArrays(object):
+    """
+    Arrays that are published once into a memory-mapped file, to hand them
+    to other processes. Pickling only transfers the path and the layout of the
+    file, the arrays are then attached as read-only, zero-copy views.
+    The process that created the file is its owner and removes it on release.
+    """
+    def __init__(self, arrays:dict, dirname=None, align=64):
+        """
+        Parameters
+        ----------
+        arrays : dict
+            Names as the keys, np.arrays as the values.
+        dirname : str, optional (default: None)
+            Directory to create the file in, by default /dev/shm where
+            available, else the temporary directory.
+        align : int, optional (default: 64)
+            Alignment of the arrays in the file, in bytes.
+        """
+        self.layout, offset = [], 0
+        for name, values in arrays.items():
+            offset = -(-offset // align) * align
+            self.layout.append((name, values.dtype.str, tuple(values.shape), offset))
+            offset += values.nbytes
+
+        fd, self.path = tempfile.mkstemp(prefix='qa4sm-', suffix='.bin',
+                                         dir=dirname if dirname else _shared_dir())
+        os.close(fd)
+        buf = np.memmap(self.path, dtype=np.uint8, mode='w+', shape=(max(offset, 1),))
+        for (_, _, _, start), values in zip(self.layout, arrays.values()):
+            values = np.ascontiguousarray(values)
+            buf[start:start + values.nbytes] = values.reshape(-1).view(np.uint8)
+        buf.flush()
+        del buf
+
+        self.owner = True
+        self._arrays = None
+
+    def __getstate__(self):
+        return {'path': self.path, 'layout': self.layout, 'owner': False,
+                '_arrays': None}
+
+    @property
+    def arrays(self) -> OrderedDict:
+        """ The arrays, as views on the file (attached on first use) """
+        if self._arrays is None:
+            buf = np.memmap(self.path, dtype=np.uint8, mode='r')
+            self._arrays = OrderedDict()
+            for name, dtype, shape, start in self.layout:
+                nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+                self._arrays[name] = np.ndarray(shape, dtype=dtype, buffer=buf,
+                                                offset=start) if nbytes > 0 \
+                    else np.empty(shape, dtype=dtype)
+        return self._arrays
+
+    def release(self):
+        """ Remove the file, if this is the owner. Attached views stay valid. """
+        if self.owner and os.path.isfile(self.path):
+            os.remove(self.path)
+        self.owner = False
+
+
+class QA4SMValueStore(object):
+    """
+    Columnar value store for a QA4SM results image. All variables share one
+    array of locations, the values of each variable are kept in a contiguous
+    array of the same length, together with a mask of the valid values.
+    Values are read from the dataset when first requested.
+    In chunked mode, the columns are kept as dask arrays and only
+    computed chunk by chunk, or when a frame is requested.
+    """
+    def __init__(self, ds, index_names=globals.index_names, extent=None,
+                 chunked=False):
+        """
+        Parameters
+        ----------
+        ds : xr.Dataset
+            The opened results file.
+        index_names : list, optional (default: ['lat', 'lon'] - as in globals.py)
+            Names of the coordinate variables in y and x direction (lat, lon).
+        extent : tuple, optional (default: None)
+            Area to subset the values for.
+            (min_lon, max_lon, min_lat, max_lat)
+        chunked : bool, optional (default: False)
+            The dataset was opened with dask chunks, keep the values out of
+            memory.
+        """
+        self.ds = ds
+        self.index_names = index_names
+        self.extent = extent
+        self.chunked = chunked
+
+        lat, lon, self.dims = self._read_locations()
+        self.shape = tuple(self.ds.dims[dim] for dim in self.dims)
+        self.rows = self._rows_in_extent(lat, lon)
+        if self.rows is None:
+            self.lat, self.lon = lat, lon
+        else:
+            self.lat, self.lon = lat[self.rows], lon[self.rows]
+            self._slabs, self._slab_rows = self._plan_reads()
+
+        self._parent = None
+        self._reset()
+
+    @classmethod
+    def from_arrays(cls, lat, lon, dims, shape, values:dict, masks:dict,
+                    index_names=globals.index_names):
+        """
+        Create a store from values that were read before (e.g. from a cache),
+        without a dataset.
+
+        Parameters
+        ----------
+        lat, lon : np.array
+            Coordinates of all locations.
+        dims : tuple
+            Dimensions of the variables in the file.
+        shape : tuple
+            Size of the dimensions.
+        values : dict
+            Variable names as the keys, values over all locations as the values.
+        masks : dict
+            Variable names as the keys, masks of the valid values as the values.
+        index_names : list, optional (default: ['lat', 'lon'] - as in globals.py)
+            Names of the coordinate variables in y and x direction (lat, lon).
+        """
+        store = cls.__new__(cls)
+        store.ds = None
+        store.index_names = index_names
+        store.extent = None
+        store.chunked = False
+        store.lat, store.lon = lat, lon
+        store.dims, store.shape = tuple(dims), tuple(shape)
+        store.rows = None
+        store._parent = None
+        store._reset()
+        store._values.update(values)
+        store._masks.update(masks)
+        return store
+
+    def _reset(self):
+        """ Drop all values and indices derived from the locations """
+        self._index = None
+        self._sindex = None
+        self._extent_rows = dict()
+        self._values = dict()
+        self._masks = dict()
+        self._shared = None
+
+    def __getstate__(self):
+        """
+        If the store was shared, only the handle of the shared arrays is
+        pickled, instead of the dataset and the values.
+        """
+        state = self.__dict__.copy()
+        if self._shared is not None:
+            state.update(ds=None, lat=None, lon=None, _parent=None, _index=None,
+                         _sindex=None, _values=dict(), _masks=dict())
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._shared is not None:
+            arrays = self._shared.arrays
+            self.lat, self.lon = arrays['lat'], arrays['lon']
+            for name, values in arrays.items():
+                kind, _, varname = name.partition(':')
+                if kind == 'values':
+                    self._values[varname] = values
+                elif kind == 'mask':
+                    self._masks[varname] = values
+
+    def share(self, dirname=None) -> SharedArrays:
+        """
+        Publish the coordinates and all loaded values into a memory-mapped file,
+        so that copies of the store in other processes attach to them instead
+        of reading the file again or receiving the pickled values.
+
+        Parameters
+        ----------
+        dirname : str, optional (default: None)
+            Directory for the file, by default in memory (/dev/shm) if available.
+
+        Returns
+        -------
+        shared : SharedArrays
+            The shared arrays, call release() to remove the file once the
+            other processes are done.
+        """
+        if self.chunked:
+            raise ValueError('Chunked values cannot be shared')
+        if self._shared is None:
+            arrays = OrderedDict([('lat', self.lat), ('lon', self.lon)])
+            for varname in self._values.keys():
+                arrays['values:' + varname] = self._values[varname]
+                arrays['mask:' + varname] = self._masks[varname]
+            self._shared = SharedArrays(arrays, dirname=dirname)
+        return self._shared
+
+    def unshare(self):
+        """ Release the shared arrays of the store """
+        if self._shared is not None:
+            self._shared.release()
+            self._shared = None
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _read_locations(self) -> (np.array, np.array, tuple):
+        """ Read the coordinates of all locations in the file """
+        lat_name, lon_name = self.index_names
+        lat, lon = self.ds[lat_name], self.ds[lon_name]
+        if lat.dims == lon.dims:  # list of locations (e.g. ISMN stations)
+            return lat.values.ravel(), lon.values.ravel(), lat.dims
+        elif lat.ndim == lon.ndim == 1:  # lat, lon axes of a regular grid
+            lats, lons = np.meshgrid(lat.values, lon.values, indexing='ij')
+            return lats.ravel(), lons.ravel(), (lat.dims[0], lon.dims[0])
+        else:
+            raise ValueError('Cannot derive locations from the coordinates '
+                             '{} and {}'.format(lat_name, lon_name))
+
+    def _rows_in_extent(self, lat, lon) -> np.array or None:
+        """ Get the row indices of locations within the extent """
+        if not self.extent:
+            return None
+        return np.flatnonzero((lon >= self.extent[0]) & (lon <= self.extent[1]) &
+                              (lat >= self.extent[2]) & (lat <= self.extent[3]))
+
+    def _plan_reads(self, max_gap=globals.max_read_gap) -> (list, np.array):
+        """
+        Find the hyperslabs of the file that contain the locations in the extent.
+        For a list of locations, the selected rows are split into ranges,
+        ranges that are less than max_gap apart are read together. For a grid,
+        the bounding box of the selected cells is read.
+
+        Returns
+        -------
+        slabs : list
+            One dictionary per read, with the slice for each dimension.
+        slab_rows : np.array
+            Indices of the selected rows in the concatenated, flattened slabs.
+        """
+        if len(self.rows) == 0:
+            return [], np.array([], dtype=np.int64)
+
+        if len(self.dims) == 1:
+            breaks = np.flatnonzero(np.diff(self.rows) > max_gap)
+            starts = self.rows[np.concatenate([[0], breaks + 1])]
+            stops = self.rows[np.concatenate([breaks, [len(self.rows) - 1]])] + 1
+            offsets = np.concatenate([[0], np.cumsum(stops - starts)[:-1]])
+            run = np.searchsorted(starts, self.rows, side='right') - 1
+            slab_rows = offsets[run] + (self.rows - starts[run])
+            slabs = [{self.dims[0]: slice(int(a), int(b))} for a, b in zip(starts, stops)]
+        else:
+            idx = np.unravel_index(self.rows, self.shape)
+            mins = [int(i.min()) for i in idx]
+            slab_shape = [int(i.max()) - m + 1 for i, m in zip(idx, mins)]
+            slab_rows = np.ravel_multi_index([i - m for i, m in zip(idx, mins)],
+                                             slab_shape)
+            slabs = [{dim: slice(m, m + n) for dim, m, n
+                      in zip(self.dims, mins, slab_shape)}]
+
+        return slabs, slab_rows
+
+    def _read_column(self, varname:str) -> np.array:
+        """
+        Read a variable from the dataset as a flat array over all locations.
+        If an extent is set, only the parts of the file that contain the
+        extent are read.
+        """
+        if self._parent is not None:
+            self._parent.load([varname])
+            return self._parent._values[varname][self.rows]
+        da = self.ds[varname]
+        if set(da.dims) != set(self.dims):
+            raise ValueError('Variable {} is not defined over the dimensions '
+                             '{}'.format(varname, ', '.join(self.dims)))
+        da = da.transpose(*self.dims)
+        if self.chunked:
+            import dask.array as dsa
+            concatenate = dsa.concatenate
+        else:
+            concatenate = np.concatenate
+        if self.rows is None:
+            values = da.data.ravel()
+        elif len(self.rows) == 0:
+            values = np.array([], dtype=da.dtype)
+            if self.chunked:  # a single, empty chunk
+                values = dsa.from_array(values, chunks=(0,))
+        else:
+            values = concatenate([da.isel(slab).data.ravel()
+                                  for slab in self._slabs])[self._slab_rows]
+        return values if self.chunked else np.ascontiguousarray(values)
+
+    @staticmethod
+    def _valid(values:np.array) -> np.array:
+        """ Mask of the valid (non-nan) values """
+        if np.issubdtype(values.dtype, np.floating):
+            return ~np.isnan(values)
+        else:
+            return np.ones(values.shape, dtype=bool)
+
+    @property
+    def index(self) -> pd.MultiIndex:
+        """ The (lat, lon) index of all locations, shared by all frames """
+        if self._index is None:
+            self._index = pd.MultiIndex.from_arrays([self.lat, self.lon],
+                                                    names=self.index_names)
+        return self._index
+
+    @property
+    def sindex(self) -> SpatialIndex:
+        """ Spatial index over all locations, built on first use """
+        if self._sindex is None:
+            self._sindex = SpatialIndex(self.lat, self.lon)
+        return self._sindex
+
+    def rows_in(self, extent) -> np.array:
+        """
+        Get the (sorted) row indices of all locations within the extent.
+
+        Parameters
+        ----------
+        extent : tuple
+            (min_lon, max_lon, min_lat, max_lat)
+        """
+        key = tuple(float(e) for e in extent)
+        if key not in self._extent_rows.keys():
+            self._extent_rows[key] = self.sindex.query(key)
+        return self._extent_rows[key]
+
+    def subset(self, extent):
+        """
+        Create a store for the locations within the extent. Values are taken
+        from this store, only the values within the extent are copied.
+
+        Parameters
+        ----------
+        extent : tuple
+            (min_lon, max_lon, min_lat, max_lat)
+
+        Returns
+        -------
+        store : QA4SMValueStore
+            Store with the locations and values within the extent.
+        """
+        store = copy.copy(self)
+        store._parent = self
+        store.extent = extent
+        store.rows = self.rows_in(extent)
+        store.lat, store.lon = self.lat[store.rows], self.lon[store.rows]
+        store._reset()
+        return store
+
+    def isloaded(self, varname:str) -> bool:
+        """ Check whether the values of a variable are in the store """
+        return varname in self._values.keys()
+
+    def load(self, varnames:list):
+        """ Read the values of the passed variables, if not done yet """
+        for varname in varnames:
+            if self.isloaded(varname):
+                continue
+            values = self._read_column(varname)
+            self._values[varname] = values
+            if not self.chunked:
+                self._masks[varname] = self._valid(values)
+
+    def unload(self, varname:str):
+        """ Drop the values of a variable, they are read again when requested """
+        if self._shared is not None:
+            return  # the values are in the shared file
+        self._values.pop(varname, None)
+        self._masks.pop(varname, None)
+
+    def values(self, varname:str) -> np.array:
+        """
+        Get the values of a variable (including nans) over all locations.
+        In chunked mode, the values are computed and not kept in memory.
+        """
+        self.load([varname])
+        if self.chunked:
+            return np.asarray(self._values[varname].compute())
+        return self._values[varname]
+
+    def mask(self, varname:str) -> np.array:
+        """ Get the mask of valid values of a variable """
+        self.load([varname])
+        if self.chunked:
+            return self._valid(self.values(varname))
+        return self._masks[varname]
+
+    def iter_chunks(self, varname:str):
+        """
+        Iterate over the values of a variable chunk by chunk.
+
+        Parameters
+        ----------
+        varname : str
+            Name of the variable
+
+        Yields
+        ------
+        rows : slice
+            The rows (locations) of the chunk in the store.
+        values : np.array
+            The values (including nans) of the chunk.
+        """
+        self.load([varname])
+        values = self._values[varname]
+        if not self.chunked:
+            yield slice(0, len(values)), values
+            return
+        start = 0
+        for i, n in enumerate(values.chunks[0]):
+            yield slice(start, start + n), np.asarray(values.blocks[i].compute())
+            start += n
+
+    def count(self, varname:str) -> int:
+        """ Get the number of valid values of a variable """
+        if self.chunked:
+            return int(sum([np.count_nonzero(self._valid(values))
+                            for _, values in self.iter_chunks(varname)]))
+        return int(np.count_nonzero(self.mask(varname)))
+
+    def frame(self, varnames:list) -> pd.DataFrame:
+        """
+        Create a data frame for the passed variables from the store.
+
+        Parameters
+        ----------
+        varnames : list or str
+            Variables to include in the frame.
+
+        Returns
+        -------
+        df : pd.DataFrame
+            Frame with the (lat, lon) index and one column per variable. Only
+            locations where at least one of the variables is valid are included.
+            If no location is dropped, the columns are views on the store.
+        """
+        if isinstance(varnames, str):
+            varnames = [varnames]
+        columns = {varname: self.values(varname) for varname in varnames}
+
+        valid = np.zeros(len(self), dtype=bool)
+        for varname in varnames:
+            valid |= self._masks[varname] if not self.chunked \
+                else self._valid(columns[varname])
+
+        if valid.all():
+            rows, index = slice(None), self.index
+        else:
+            rows = np.flatnonzero(valid)
+            index = self.index[rows]
+
+        data = {varname: columns[varname][rows] for varname in varnames}
+        return pd.DataFrame(data, index=index, columns=varnames, copy=False)
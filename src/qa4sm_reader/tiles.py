@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Export of gridded metric variables as Web-Mercator (XYZ) tile pyramids
+for web maps. Tiles are written to <out_dir>/<z>/<x>/<y>.png.
+"""
+from qa4sm_reader import globals
+from qa4sm_reader.raster import grid_var, colormap_lut, color_index, write_png
+import numpy as np
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+_max_lat = 85.0511287798  # limit of the Web-Mercator projection
+
+def _lon(px, n_px) -> np.ndarray:
+    """ Longitude of pixel centers """
+    return (np.asarray(px) + 0.5) / n_px * 360. - 180.
+
+def _lat(py, n_px) -> np.ndarray:
+    """ Latitude of pixel centers """
+    y = np.pi * (1. - 2. * (np.asarray(py) + 0.5) / n_px)
+    return np.degrees(np.arctan(np.sinh(y)))
+
+def _tile_range(extent, zoom) -> (int, int, int, int):
+    """ First and last + 1 tile (x and y) that cover the extent at a zoom level """
+    x_min, x_max, y_min, y_max = extent
+    n = 2 ** zoom
+    def ty(lat):
+        lat = np.radians(np.clip(lat, -_max_lat, _max_lat))
+        return (1. - np.log(np.tan(lat) + 1. / np.cos(lat)) / np.pi) / 2. * n
+    tx0 = int(np.floor((max(x_min, -180.) + 180.) / 360. * n))
+    tx1 = int(np.ceil((min(x_max, 180.) + 180.) / 360. * n))
+    ty0 = int(np.floor(ty(y_max)))
+    ty1 = int(np.ceil(ty(y_min)))
+    return max(tx0, 0), min(max(tx1, tx0 + 1), n), max(ty0, 0), min(max(ty1, ty0 + 1), n)
+
+def zoom_for_grid(extent, shape, tile_size=globals.tile_size) -> int:
+    """
+    Finest zoom level at which the pixels are not larger than the cells of
+    a grid (at the equator), limited to globals.tile_max_zoom.
+    """
+    dx = (extent[1] - extent[0]) / shape[1]
+    zoom = int(np.ceil(np.log2(360. / (tile_size * dx))))
+    return int(np.clip(zoom, 0, globals.tile_max_zoom))
+
+def _resample_px(zz, extent, n_px, px0, px1, py0, py1) -> np.ndarray:
+    """ Nearest neighbour values of the pixels px0 to px1 (x) and py0 to py1 (y) """
+    x_min, x_max, y_min, y_max = extent
+    n_rows, n_cols = zz.shape
+    lon = _lon(np.arange(px0, px1), n_px)
+    lat = _lat(np.arange(py0, py1), n_px)
+    cols = np.floor((lon - x_min) / (x_max - x_min) * n_cols).astype(np.intp)
+    rows = np.floor((lat - y_min) / (y_max - y_min) * n_rows).astype(np.intp)
+    valid_cols = (cols >= 0) & (cols < n_cols)
+    valid_rows = (rows >= 0) & (rows < n_rows)
+    values = zz[np.clip(rows, 0, n_rows - 1)][:, np.clip(cols, 0, n_cols - 1)]
+    values[~valid_rows, :] = np.nan
+    values[:, ~valid_cols] = np.nan
+    return values
+
+def resample(zz, extent, zoom, tile_size=globals.tile_size) -> (np.ndarray, int, int):
+    """
+    Resample gridded values (nearest neighbour) to the Web-Mercator pixels
+    of all tiles at a zoom level that cover the extent.
+
+    Parameters
+    ----------
+    zz : np.ndarray
+        Gridded values, [0, 0] is the lower left corner.
+    extent : tuple
+        (x_min, x_max, y_min, y_max) of zz.
+    zoom : int
+        Zoom level.
+    tile_size : int, optional (default: from globals)
+        Size of the tiles in pixels.
+
+    Returns
+    -------
+    values : np.ndarray
+        Resampled values, the first row is the northernmost.
+    tx0, ty0 : int
+        Tile (x and y) of values[0, 0].
+    """
+    tx0, tx1, ty0, ty1 = _tile_range(extent, zoom)
+    values = _resample_px(zz, extent, tile_size * 2 ** zoom, tx0 * tile_size,
+                          tx1 * tile_size, ty0 * tile_size, ty1 * tile_size)
+    return values, tx0, ty0
+
+def resample_tile(zz, extent, zoom, x, y, tile_size=globals.tile_size) -> np.ndarray:
+    """
+    Resample gridded values (nearest neighbour) to the pixels of a single
+    tile, as resample() does for all tiles of a zoom level.
+
+    Returns
+    -------
+    values : np.ndarray
+        (tile_size, tile_size) values, the first row is the northernmost.
+    """
+    return _resample_px(zz, extent, tile_size * 2 ** zoom, x * tile_size,
+                        (x + 1) * tile_size, y * tile_size, (y + 1) * tile_size)
+
+def downsample(values, tx0, ty0, tile_size=globals.tile_size) -> (np.ndarray, int, int):
+    """
+    Build the next coarser zoom level from the pixels of a level, as the
+    mean of each 2 x 2 pixels that have values.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Pixels of the tiles, the first row is the northernmost.
+    tx0, ty0 : int
+        Tile (x and y) of values[0, 0].
+    tile_size : int, optional (default: from globals)
+        Size of the tiles in pixels.
+
+    Returns
+    -------
+    values : np.ndarray
+        Pixels of the tiles at the coarser level.
+    tx0, ty0 : int
+        Tile (x and y) of values[0, 0] at the coarser level.
+    """
+    # align to an even number of tiles, starting at an even tile
+    pad_y = (ty0 % 2 * tile_size, (ty0 + values.shape[0] // tile_size) % 2 * tile_size)
+    pad_x = (tx0 % 2 * tile_size, (tx0 + values.shape[1] // tile_size) % 2 * tile_size)
+    values = np.pad(values, (pad_y, pad_x), constant_values=np.nan)
+    n_rows, n_cols = values.shape[0] // 2, values.shape[1] // 2
+    blocks = values.reshape(n_rows, 2, n_cols, 2)
+    valid = ~np.isnan(blocks)
+    count = valid.sum(axis=(1, 3))
+    total = np.where(valid, blocks, 0.).sum(axis=(1, 3))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        values = total / count
+    return values, tx0 // 2, ty0 // 2
+
+def export_tiles(img, varname, out_dir, min_zoom=0, max_zoom=None, colormap=None,
+                 tile_size=globals.tile_size, n_workers=None, value_range=None) -> list:
+    """
+    Write the tile pyramid of a gridded variable. The tiles are built depth
+    first, one at a time: tiles at the finest zoom level are resampled from
+    the grid, each coarser tile is downsampled from its four finer tiles.
+    Memory is therefore bounded by the tile size and the number of levels.
+    Tiles without values are not written.
+
+    Parameters
+    ----------
+    img : QA4SMImg
+        The image.
+    varname : str
+        Name of a (gridded) metric variable of the image.
+    out_dir : str
+        Directory to write the tiles to, as <out_dir>/<z>/<x>/<y>.png.
+    min_zoom : int, optional (default: 0)
+        Coarsest zoom level.
+    max_zoom : int, optional (default: None)
+        Finest zoom level. If None, the level that resolves the grid cells
+        (see zoom_for_grid()) is used.
+    colormap : str or Colormap, optional (default: None)
+        If None, defaults to globals._colormaps.
+    tile_size : int, optional (default: from globals)
+        Size of the tiles in pixels.
+    n_workers : int, optional (default: None)
+        Number of threads that color and write tiles. If None, one per CPU.
+    value_range : tuple, optional (default: None)
+        (v_min, v_max) of the colormap, e.g. from ranges.value_ranges, instead
+        of the range of the values of the image.
+
+    Returns
+    -------
+    fnames : list
+        The tiles that were written.
+    """
+    metric = list(img.var_meta(varname).keys())[0]
+    zz, extent, v_min, v_max = grid_var(img, varname, value_range)
+    if max_zoom is None:
+        max_zoom = zoom_for_grid(extent, zz.shape, tile_size)
+    lut = colormap_lut(colormap or globals._colormaps[metric])
+    n = lut.shape[0] - 3
+    tile_ranges = {z: _tile_range(extent, z) for z in range(min_zoom, max_zoom + 1)}
+    n_workers = n_workers or os.cpu_count() or 1
+
+    def write_tile(tile, z, x, y):
+        fname = os.path.join(out_dir, str(z), str(x), '{}.png'.format(y))
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        write_png(fname, lut[color_index(tile, v_min, v_max, n)])
+        return fname
+
+    fnames, pending = [], set()
+
+    def build(pool, z, x, y):
+        """ Build a tile (and its finer tiles), None if it has no values """
+        tx0, tx1, ty0, ty1 = tile_ranges[z]
+        if not (tx0 <= x < tx1 and ty0 <= y < ty1):
+            return None
+        if z == max_zoom:
+            tile = resample_tile(zz, extent, z, x, y, tile_size)
+        else:
+            block = np.full((2 * tile_size, 2 * tile_size), np.nan)
+            for j in range(2):
+                for i in range(2):
+                    child = build(pool, z + 1, 2 * x + i, 2 * y + j)
+                    if child is not None:
+                        block[j * tile_size:(j + 1) * tile_size,
+                              i * tile_size:(i + 1) * tile_size] = child
+            tile = downsample(block, 2 * x, 2 * y, tile_size)[0]
+        if np.isnan(tile).all():
+            return None
+        # limit the tiles that wait to be written
+        if len(pending) >= 4 * n_workers:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            pending.difference_update(done)
+            fnames.extend([f.result() for f in done])
+        pending.add(pool.submit(write_tile, tile, z, x, y))
+        return tile
+
+    with ThreadPoolExecutor(n_workers) as pool:
+        tx0, tx1, ty0, ty1 = tile_ranges[min_zoom]
+        for y in range(ty0, ty1):
+            for x in range(tx0, tx1):
+                build(pool, min_zoom, x, y)
+        fnames.extend([f.result() for f in pending])
+    return fnames
@@ -61,6 +61,22 @@ class TestQA4SMAttributes(unittest.TestCase):
 
         return other_names
 
+    def test_shared(self):
+        c3s = self.meta.named(2, 'C3S')
+        assert self.meta.named(2, 'C3S') is c3s
+        assert c3s.version == 'C3S_V201812'
+        # variables created from the same handler share the dataset handlers
+        r = QA4SMMetricVariable('R_between_6-ISMN_and_2-C3S', self.meta)
+        rho = QA4SMMetricVariable('rho_between_6-ISMN_and_2-C3S', self.meta)
+        assert r.attrs is rho.attrs is self.meta
+        assert r.other_dss[0] is rho.other_dss[0] is c3s
+        assert r.ref_ds is rho.ref_ds
+        assert not hasattr(r, '__dict__')
+        # table is shared, but returned names can be changed safely
+        names = c3s._names_from_attrs('all')
+        names['short_name'] = 'other'
+        assert c3s._names_from_attrs('short_name') == 'C3S'
+
 if __name__ == '__main__':
     suite = unittest.TestSuite()
     suite.addTest(TestQA4SMAttributes("test_get_ref_name"))
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+from qa4sm_reader.cache import QA4SMCache
+from qa4sm_reader.img import QA4SMImg
+import os
+import unittest
+import tempfile
+import shutil
+import numpy as np
+
+class TestQA4SMCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.testfile = '3-ERA5_LAND.swvl1_with_1-C3S.sm_with_2-ASCAT.sm.nc'
+        testfile_path = os.path.join(os.path.dirname(__file__), '..','tests',
+                                     'test_data', 'tc', self.testfile)
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        # work on a copy, so that the file can be modified
+        self.testfile_path = os.path.join(self.tmpdir, self.testfile)
+        shutil.copy(testfile_path, self.testfile_path)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmpdir)
+
+    def test_img_from_cache(self):
+        img = QA4SMImg(self.testfile_path, cache_dir=self.cache_dir)
+        assert img.ds is not None
+        cached = QA4SMImg(self.testfile_path, cache_dir=self.cache_dir)
+        assert cached.ds is None  # file is not opened
+        assert cached.ls_vars(False).tolist() == img.ls_vars(False).tolist()
+        assert cached.ref_meta() == img.ref_meta()
+        assert cached.metric_df('R').equals(img.metric_df('R'))
+        for df, should in zip(cached.metric_df('snr'), img.metric_df('snr')):
+            assert df.equals(should)
+
+        extent = (np.median(img._store.lon), img._store.lon.max(),
+                  img._store.lat.min(), img._store.lat.max())
+        sub = QA4SMImg(self.testfile_path, cache_dir=self.cache_dir, extent=extent)
+        assert sub.var_df('n_obs').equals(QA4SMImg(self.testfile_path,
+                                                   extent=extent).var_df('n_obs'))
+        assert len(QA4SMCache(self.cache_dir).entries()) == 1
+
+    def test_lazy_and_metrics(self):
+        # no entry is created that would need all values of the file
+        img = QA4SMImg(self.testfile_path, cache_dir=self.cache_dir, lazy=True)
+        assert not any(img._store.isloaded(var) for var in img._vars.keys())
+        img = QA4SMImg(self.testfile_path, cache_dir=self.cache_dir, metrics=['R'])
+        assert img.ls_metrics(False).tolist() == ['R']
+        assert len(QA4SMCache(self.cache_dir).entries()) == 0
+
+        # but an existing entry is used
+        full = QA4SMImg(self.testfile_path, cache_dir=self.cache_dir)
+        cached = QA4SMImg(self.testfile_path, cache_dir=self.cache_dir, lazy=True,
+                          metrics=['R'])
+        assert cached.ds is None
+        assert cached.ls_metrics(False).tolist() == ['R']
+        assert cached.metric_df('R').equals(full.metric_df('R'))
+
+    def test_key(self):
+        cache = QA4SMCache(self.cache_dir)
+        key = cache.key(self.testfile_path)
+        assert cache.key(self.testfile_path) == key
+        stat = os.stat(self.testfile_path)
+        os.utime(self.testfile_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        assert cache.key(self.testfile_path) != key
+        assert cache.load(self.testfile_path) is None
+
+    def test_evict(self):
+        cache = QA4SMCache(self.cache_dir, max_size=1)
+        for i in range(3):
+            path = os.path.join(self.tmpdir, 'file{}.nc'.format(i))
+            with open(path, 'w') as f:
+                f.write(str(i))
+            cache.save(path, {'i': i}, {'values': np.arange(10) * i})
+            # only the entry that was written last is kept
+            assert len(cache.entries()) == 1
+            entry = cache.load(path)
+            assert entry['meta']['i'] == i
+            np.testing.assert_array_equal(entry['arrays']['values'], np.arange(10) * i)
+
+        cache = QA4SMCache(self.cache_dir)
+        cache.clear()
+        assert cache.entries() == []
+
+
+if __name__ == '__main__':
+    unittest.main()
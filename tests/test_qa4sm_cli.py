@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+from qa4sm_reader.cli import main, find_files, schedule
+import os
+import unittest
+from unittest import mock
+import tempfile
+import shutil
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.testdir = os.path.join(os.path.dirname(__file__), '..', 'tests',
+                                    'test_data', 'basic')
+        self.testfile = '0-GLDAS.SoilMoi0_10cm_inst_with_1-C3S.sm_with_2-SMOS.Soil_Moisture.nc'
+        self.testfile_path = os.path.join(self.testdir, self.testfile)
+        self.plotdir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.plotdir)
+
+    def test_find_files(self):
+        filepaths = find_files([os.path.join(self.testdir, '*.nc'), self.testfile_path])
+        assert len(filepaths) == len(set(filepaths)) > 1
+        sizes = [os.path.getsize(f) for f in filepaths]
+        assert sizes == sorted(sizes, reverse=True)  # largest first
+        with self.assertRaises(FileNotFoundError):
+            find_files([os.path.join(self.testdir, '*.missing')])
+
+    def test_schedule(self):
+        filepaths = find_files([os.path.join(self.testdir, '*.nc')])
+        assert schedule(filepaths, 1) == [(f, None) for f in filepaths]
+        # fewer files than processes: one task per plot
+        tasks = schedule([self.testfile_path], 2, metrics=['R'])
+        assert tasks == [(self.testfile_path, ('box', 'R')),
+                         (self.testfile_path, ('map', 'R_between_0-GLDAS_and_1-C3S')),
+                         (self.testfile_path, ('map', 'R_between_0-GLDAS_and_2-SMOS'))]
+        # with an extent, the files are not split
+        assert schedule([self.testfile_path], 2, metrics=['R'], extent=(-156, -155, 19, 20)) == \
+               [(self.testfile_path, None)]
+
+    def test_main(self):
+        broken = os.path.join(self.plotdir, 'broken.nc')
+        with open(broken, 'w') as f:
+            f.write('not a netcdf file')
+        args = [self.testfile_path, broken, '--metrics', 'R', '--out-dir', self.plotdir,
+                '--jobs', '1', '--quiet']
+        with mock.patch('qa4sm_reader.cli.plt') as plt:
+            assert main(args) == 1  # the broken file fails, the other is plotted
+            assert not plt.switch_backend.called  # only in pool workers
+        assert sorted(os.listdir(os.path.join(self.plotdir, self.testfile))) == \
+               ['boxplot_R.png', 'overview_0-GLDAS_and_1-C3S_R.png',
+                'overview_0-GLDAS_and_2-SMOS_R.png']
+        assert main(args[:1] + args[2:]) == 0
+
+
+if __name__ == '__main__':
+    unittest.main()
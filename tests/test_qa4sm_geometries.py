@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+from qa4sm_reader.geometries import GeometryCache
+import os
+import unittest
+import tempfile
+import shutil
+import cartopy.crs as ccrs
+
+class TestGeometryCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.cache = GeometryCache()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmpdir)
+
+    def test_geometries(self):
+        extent = (-20, 30, -10, 50)
+        geoms = self.cache.geometries('physical', 'land', '110m', extent, ccrs.PlateCarree())
+        assert len(geoms) > 0
+        # clipped to the extent with the margin
+        pad = self.cache.margin * 60
+        for geom in geoms:
+            x_min, y_min, x_max, y_max = geom.bounds
+            assert x_min >= extent[0] - pad and x_max <= extent[1] + pad
+            assert y_min >= extent[2] - pad and y_max <= extent[3] + pad
+        assert self.cache.geometries('physical', 'land', '110m', extent,
+                                     ccrs.PlateCarree()) is geoms
+
+        # projected
+        robinson = self.cache.geometries('physical', 'land', '110m', extent, ccrs.Robinson())
+        assert len(robinson) == len(geoms)
+        assert robinson[0].bounds != geoms[0].bounds
+        assert len(self.cache) == 2
+
+    def test_save_load(self):
+        extent = (-20, 30, -10, 50)
+        geoms = self.cache.geometries('physical', 'land', '110m', extent, ccrs.PlateCarree())
+        path = os.path.join(self.tmpdir, 'geometries.pkl')
+        self.cache.save(path)
+
+        cache = GeometryCache()
+        cache.load(path)
+        loaded = cache.geometries('physical', 'land', '110m', extent, ccrs.PlateCarree())
+        assert [g.wkb for g in loaded] == [g.wkb for g in geoms]
+        # unclipped features were stored as well
+        assert len(cache.raw('physical', 'land', '110m')) == \
+               len(self.cache.raw('physical', 'land', '110m'))
+
+
+if __name__ == '__main__':
+    unittest.main()
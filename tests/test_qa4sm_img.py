@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 
-from qa4sm_reader.img import QA4SMImg
+from qa4sm_reader.img import QA4SMImg, QA4SMMeta
+from qa4sm_reader.handlers import QA4SMMetricVariable
 import os
 import numpy as np
 import unittest
+from unittest import mock
 from qa4sm_reader import globals
+from qa4sm_reader.plot_utils import geotraj_to_geo2d, GeoGrid, _get_grid, _value2index
 
 class TestQA4SMImgBasicIntercomp(unittest.TestCase):
 
@@ -108,6 +111,236 @@ class TestQA4SMImgBasicIntercomp(unittest.TestCase):
         assert ds_meta['pretty_version'] == 'v201812'
 
 
+class TestQA4SMImgTC(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.testfile = '3-GLDAS.SoilMoi0_10cm_inst_with_1-C3S.sm_with_2-SMOS.Soil_Moisture.nc'
+        self.testfile_path = os.path.join(os.path.dirname(__file__), '..','tests',
+                                          'test_data', 'tc', self.testfile)
+        self.img = QA4SMImg(self.testfile_path, ignore_empty=False)
+
+    def test_var_index(self):
+        var_index = self.img._var_index
+        for vars in var_index.values():
+            varnames = [v for v, _, _ in vars]
+            assert varnames == sorted(varnames)
+        assert [v for v, _, _ in var_index['n_obs']] == ['n_obs']
+        assert len(var_index['R']) == 2
+        for var, g, parts in var_index['snr']:
+            assert g == 3
+            assert parts['ref_ds'] == 'GLDAS'
+            assert parts['mds'] == parts['sat_ds0'] or parts['mds'] == parts['sat_ds1']
+        for metric, vars in var_index.items():
+            assert all(metric in globals.metric_groups[g] for _, g, _ in vars)
+
+        # the variables take the parsed names from the index
+        with mock.patch.object(QA4SMMetricVariable, '_parse_varname') as parse:
+            img = QA4SMImg(self.testfile_path, ignore_empty=False)
+            assert not parse.called
+        assert img.ls_vars(False).tolist() == self.img.ls_vars(False).tolist()
+
+    def test_metrics_in_file(self):
+        m_groups = self.img.ls_metrics(as_groups=True)
+        assert m_groups['common'] == ['n_obs']
+        assert 'R' in m_groups['double']
+        assert sorted(m_groups['triple']) == ['beta', 'err_std', 'snr']
+        assert len(self.img.metric_df('R').columns) == 2
+        assert len(self.img.metric_df('snr')) == 2
+
+    def test_lazy_loading(self):
+        img = QA4SMImg(self.testfile_path, ignore_empty=False, lazy=True)
+        assert not any(img._store.isloaded(var) for var in img.ls_vars(False))
+        assert img.ls_vars(False).tolist() == self.img.ls_vars(False).tolist()
+
+        df = img.metric_df('R')
+        assert all(img._store.isloaded(Var.varname) for Var in img.find_group('R')['R'])
+        assert not any(img._store.isloaded(Var.varname) for Var in img.find_group('BIAS')['BIAS'])
+        assert df.equals(self.img.metric_df('R'))
+
+        varname = 'BIAS_between_3-GLDAS_and_2-SMOS'
+        assert img.var_df(varname).equals(self.img.var_df(varname))
+
+    def test_lazy_no_read(self):
+        # no values are read to find empty variables on initialisation
+        with mock.patch.object(QA4SMMeta, 'isempty') as isempty, \
+                mock.patch.object(QA4SMImg, 'isempty') as img_isempty:
+            img = QA4SMImg(self.testfile_path, lazy=True)
+            assert not isempty.called and not img_isempty.called
+        assert not any(img._store.isloaded(var) for var in img._vars.keys())
+
+        # they are found when the variables of a metric are listed
+        eager = QA4SMImg(self.testfile_path)
+        assert list(img.metric_meta('R').keys()) == list(eager.metric_meta('R').keys())
+        assert img.ls_vars(False).tolist() == eager.ls_vars(False).tolist()
+        assert not any(img._store.isloaded(var) for var in img._vars.keys())
+
+    def test_value_store(self):
+        store = self.img._store
+        assert len(store) == len(store.index) == 16
+        for Var in self.img.find_group('R')['R']:
+            df = Var.values
+            assert list(df.columns) == [Var.varname]
+            assert len(df) == store.count(Var.varname)
+            assert df.index.names == globals.index_names
+        df = self.img.metric_df('R')
+        assert len(df.columns) == 2
+        assert df.notnull().any(axis=1).all()
+
+    def test_extent(self):
+        lat, lon = self.img._store.lat, self.img._store.lon
+        extent = (lon.min(), np.median(lon), lat.min(), lat.max())
+        img = QA4SMImg(self.testfile_path, extent=extent, ignore_empty=False)
+        n = np.count_nonzero(lon <= extent[1])
+        assert len(img._store) == n
+        df = img.var_df('n_obs')
+        assert df.index.get_level_values('lon').max() <= extent[1]
+
+        sub = self.img.subset(extent)
+        assert sub.extent == extent
+        assert sub.var_df('n_obs').equals(df)
+        assert sub.metric_df('R').equals(img.metric_df('R'))
+        assert len(self.img.var_df('n_obs')) == len(self.img._store)
+
+    def test_lookup(self):
+        for metric in self.img.ls_metrics(False):
+            group = self.img.find_group(metric)
+            assert metric in group.keys()
+            for Var in group[metric]:
+                assert self.img.find_group(Var.varname) is group
+                assert self.img.var_meta(Var.varname) == {metric: Var.get_varmeta()}
+        assert self.img.find_group('not_in_file') is None
+        assert self.img.ref_meta()[1]['short_name'] == 'GLDAS'
+
+        lat, lon = self.img._store.lat, self.img._store.lon
+        sub = self.img.subset((lon.min(), np.median(lon), lat.min(), lat.max()))
+        assert sub._vars['n_obs']._store is sub._store
+        assert self.img._vars['n_obs']._store is self.img._store
+
+    def test_stats(self):
+        df = self.img.stats_df(quantiles=(0.1, 0.5))
+        assert df.index.tolist() == self.img.ls_vars(False).tolist()
+        for varname in df.index:
+            should = self.img.var_df(varname)[varname].astype(float)
+            assert df.loc[varname, 'count'] == should.count()
+            for col, v in [('mean', should.mean()), ('std', should.std()),
+                           ('min', should.min()), ('max', should.max()),
+                           ('10%', should.quantile(0.1)), ('50%', should.median())]:
+                np.testing.assert_almost_equal(df.loc[varname, col], v)
+        # computed once and cached, also the default quantiles
+        stats = self.img.var_stats('n_obs')
+        assert stats is self.img.stats()['n_obs']
+        assert self.img.var_stats('n_obs', quantiles=(0.25, 0.75)) is stats
+        assert self.img.var_stats('n_obs', quantiles=(0.3,)) is not stats
+
+    def test_geo_grid(self):
+        grid = self.img.geo_grid()
+        assert self.img.geo_grid() is grid  # computed once
+        for varname in ['n_obs', self.img._var_index['R'][0][0]]:
+            zz, zz_extent = self.img.var_geo2d(varname)
+            should_zz, should_extent = geotraj_to_geo2d(self.img.var_df(varname), varname)
+            np.testing.assert_array_equal(zz, should_zz)
+            np.testing.assert_almost_equal(zz_extent, should_extent)
+
+        # steps that are multiples of the grid step, with rounding errors
+        lon = np.array([0., 0.75, 1.25, 3.]) + 1e-9
+        x_min, x_max, dx, len_x = _get_grid(lon)
+        np.testing.assert_almost_equal(dx, 0.25)
+        assert len_x == 13
+        np.testing.assert_array_equal(_value2index(lon, x_min, dx), [0, 3, 5, 12])
+
+        # a single row, column or location
+        assert _get_grid(np.array([5., 5.]))[2:] == (globals.grid_default_step, 1)
+        row = GeoGrid(np.full(4, 10.), np.array([0., 0.5, 1., 2.]))
+        assert row.shape == (1, 5) and row.dy == row.dx == 0.5
+        np.testing.assert_array_equal(row.grid(np.arange(4.))[0], [0., 1., 2., np.nan, 3.])
+        column = GeoGrid(np.array([0., 1., 3.]), np.full(3, 20.))
+        assert column.shape == (4, 1) and column.dx == 1.
+        point = GeoGrid(np.array([1.]), np.array([2.]))
+        assert point.shape == (1, 1) and point.dx == point.dy == globals.grid_default_step
+        np.testing.assert_almost_equal(point.extent, (1.875, 2.125, 0.875, 1.125))
+
+        # irregular latitudes (as EASE2) and too many cells are binned
+        lon, lat = np.meshgrid(np.arange(0., 10., 0.5),
+                               np.degrees(np.arcsin(np.linspace(-0.5, 0.5, 30))))
+        lon, lat = lon.ravel(), lat.ravel()
+        binned = GeoGrid(lat, lon)
+        assert binned.binned and binned.len_y < 30 and binned.len_x == 20
+        zz = binned.grid(np.ones(lat.size))
+        assert not np.isnan(zz).any()
+        np.testing.assert_array_equal(zz, 1.)
+        coarse = GeoGrid(lat, lon, max_cells=50)
+        assert coarse.binned and coarse.len_x * coarse.len_y <= 50
+        np.testing.assert_almost_equal(np.nansum(coarse.bin(np.ones(lat.size))[1]), lat.size)
+
+        lat, lon = self.img._store.lat, self.img._store.lon
+        sub = self.img.subset((lon.min(), np.median(lon), lat.min(), lat.max()))
+        assert sub.geo_grid() is not grid
+        assert sub.geo_grid().len_x <= grid.len_x
+
+    def test_chunked(self):
+        img = QA4SMImg(self.testfile_path, ignore_empty=False, chunks={'dim': 5})
+        assert len(list(img._store.iter_chunks('n_obs'))) == 4
+        for varname in ['n_obs', img._var_index['R'][0][0]]:
+            should = self.img.var_df(varname)[varname]
+            stats = img.var_stats(varname, quantiles=(0.025, 0.5, 0.975))
+            assert stats.count == should.count()
+            np.testing.assert_almost_equal(stats.mean, should.mean())
+            np.testing.assert_almost_equal(stats.std, should.std())
+            bin_width = (should.max() - should.min()) / globals.quantile_bins
+            for q in (0.025, 0.5, 0.975):
+                assert abs(stats.quantile(q) - should.quantile(q)) <= bin_width
+            # in-memory values give exact quantiles
+            np.testing.assert_almost_equal(self.img.var_stats(varname).median,
+                                           should.median(), decimal=6)
+
+            zz, zz_extent = img.var_geo2d(varname)
+            should_zz, should_extent = geotraj_to_geo2d(self.img.var_df(varname), varname)
+            np.testing.assert_array_equal(zz, should_zz)
+            np.testing.assert_almost_equal(zz_extent, should_extent)
+
+        # an extent without locations
+        for chunks in [{'dim': 5}, None]:
+            empty = QA4SMImg(self.testfile_path, ignore_empty=False, chunks=chunks,
+                             extent=(100., 101., -80., -79.))
+            assert sum([len(v) for _, v in empty._store.iter_chunks('n_obs')]) == 0
+            assert empty.var_stats('n_obs').count == 0
+            assert np.isnan(empty.var_stats('n_obs').median)
+            zz, zz_extent = empty.var_geo2d('n_obs')
+            assert zz.size == 0
+
+
+class TestQA4SMMeta(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.testfile = '0-ISMN.soil moisture_with_1-C3S.sm.nc'
+        self.testfile_path = os.path.join(os.path.dirname(__file__), '..','tests',
+                                          'test_data', 'basic', self.testfile)
+        self.meta = QA4SMMeta(self.testfile_path, ignore_empty=True, chunk_size=2)
+
+    def test_empty_vars(self):
+        empty = self.meta.empty_vars()
+        assert [v for v, e in empty.items() if e] == \
+               ['p_tau_between_0-ISMN_and_1-C3S', 'tau_between_0-ISMN_and_1-C3S']
+        assert 'tau' not in self.meta.ls_metrics(False)
+        empty = self.meta.empty_vars(as_groups=True)
+        assert empty['tau'] == {'tau_between_0-ISMN_and_1-C3S': True}
+
+    def test_no_values_read(self):
+        # by default, empty variables are kept and no values are read
+        with mock.patch.object(QA4SMMeta, 'isempty') as isempty:
+            meta = QA4SMMeta(self.testfile_path)
+            assert not isempty.called
+        assert 'tau' in meta.ls_metrics(False)
+
+    def test_same_as_img(self):
+        img = QA4SMImg(self.testfile_path)
+        assert self.meta.ls_metrics() == img.ls_metrics()
+        assert self.meta.ls_vars() == img.ls_vars()
+        assert self.meta.ref_meta() == img.ref_meta()
+        assert self.meta.metric_meta('R') == img.metric_meta('R')
+        assert self.meta.parse_filename() == img.parse_filename()
+
+
 
 if __name__ == '__main__':
     suite = unittest.TestSuite()
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from qa4sm_reader.handlers import QA4SMMetricVariable
+from qa4sm_reader.handlers import QA4SMMetricVariable, parse_varnames, parse_filenames
 import unittest
 from tests.test_qa4sm_attrs import test_tc_attributes, test_attributes
 import pandas as pd
@@ -119,6 +119,31 @@ class TestMetricVariableBasic(unittest.TestCase):
         assert ds_meta['pretty_version'] == 'H113'
         assert mds is None
 
+class TestParseNames(unittest.TestCase):
+
+    def test_parse_varnames(self):
+        varnames = ['n_obs', 'lat', 'R_between_6-ISMN_and_2-C3S', 'n_obs',
+                    'snr_1-C3S_between_3-ERA5_LAND_and_1-C3S_and_2-ASCAT']
+        parsed = parse_varnames(varnames)
+        assert parsed[0] == parsed[3] == ('n_obs', 0, {'metric': 'n_obs'})
+        assert parsed[1] == (None, None, None)
+        assert parsed[2] == ('R', 2, {'metric': 'R', 'ref_id': 6, 'ref_ds': 'ISMN',
+                                      'sat_id0': 2, 'sat_ds0': 'C3S'})
+        metric, g, parts = parsed[4]
+        assert (metric, g) == ('snr', 3)
+        assert (parts['mds_id'], parts['mds']) == (1, 'C3S')
+        assert (parts['sat_id1'], parts['sat_ds1']) == (2, 'ASCAT')
+
+    def test_parse_filenames(self):
+        parsed = parse_filenames(['/some/path/0-ISMN.soil moisture_with_1-C3S.sm.nc',
+                                  '3-ERA5_LAND.swvl1_with_1-C3S.sm_with_2-ASCAT.sm.nc',
+                                  'other.nc'])
+        assert parsed[0] == {'i_ref': 0, 'ref': 'ISMN', 'ref_var': 'soil moisture',
+                             'i_ds1': 1, 'ds1': 'C3S', 'var1': 'sm'}
+        assert (parsed[1]['i_ds2'], parsed[1]['ds2'], parsed[1]['var2']) == \
+               (2, 'ASCAT', 'sm')
+        assert parsed[2] is None
+
 if __name__ == '__main__':
     unittest.main()
     # suite = unittest.TestSuite()
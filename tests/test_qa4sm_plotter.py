@@ -1,7 +1,14 @@
 # -*- coding: utf-8 -*-
 
-from qa4sm_reader.plotter import QA4SMPlotter
+from qa4sm_reader.plotter import QA4SMPlotter, mapplot, box_stats
+from qa4sm_reader.plot_utils import get_basemap, save_figure, _hashable
+from PIL import Image
+from qa4sm_reader import globals
+import matplotlib.pyplot as plt
+from matplotlib.cbook import boxplot_stats
+import numpy as np
 from qa4sm_reader.img import QA4SMImg
+from qa4sm_reader.plot_all import plot_all
 import os
 import unittest
 import tempfile
@@ -88,6 +95,65 @@ class TestQA4SMMetaImgGLDASPlotter_newFormat(unittest.TestCase):
 
         shutil.rmtree(self.plotdir)
 
+    def test_mapplot_basemap(self):
+        varname = 'R_between_0-GLDAS_and_1-C3S'
+        df = self.img.var_df(varname)
+        extent = (-20, 60, -10, 50)
+        rasters = []
+        for cache_basemap in [False, True, True]:
+            fig, ax = mapplot(df, varname, 'R', 'GLDAS', plot_extent=extent,
+                              cache_basemap=cache_basemap)
+            fig.canvas.draw()
+            rasters.append(np.asarray(fig.canvas.buffer_rgba()).astype(float))
+            plt.close(fig)
+        # background is rendered once, and looks (almost) the same
+        assert get_basemap(extent, globals.map_figsize, globals.dpi) is \
+               get_basemap(extent, globals.map_figsize, globals.dpi)
+        assert len(get_basemap(extent, globals.map_figsize, globals.dpi).labels) > 0
+        # unhashable style arguments are turned into cache keys
+        key = _hashable({'add_grid': True, 'extent': [1, 2], 'kw': {'a': [3]}})
+        assert hash(key) == hash(_hashable({'kw': {'a': [3]}, 'extent': [1, 2],
+                                            'add_grid': True}))
+        assert np.abs(rasters[0] - rasters[1]).mean() < 2.
+        np.testing.assert_array_equal(rasters[1], rasters[2])
+
+        shutil.rmtree(self.plotdir)
+
+
+    def test_save_formats(self):
+        fnames = self.plotter.mapplot_var('R_between_0-GLDAS_and_1-C3S',
+                                          out_type=['png', 'svg', 'pdf', 'jpg'])
+        assert sorted([os.path.splitext(f)[1] for f in fnames]) == \
+               ['.jpg', '.pdf', '.png', '.svg']
+        for fname in fnames:
+            assert os.path.getsize(fname) > 0
+
+        # same bounds as saving each format with a tight bounding box
+        fig, ax = QA4SMPlotter(self.img, None).boxplot_basic('R')
+        fig.savefig(os.path.join(self.plotdir, 'tight.png'), bbox_inches='tight')
+        save_figure(fig, self.plotdir, 'once', {'.png', '.jpg'})
+        plt.close('all')
+        size = Image.open(os.path.join(self.plotdir, 'tight.png')).size
+        assert Image.open(os.path.join(self.plotdir, 'once.png')).size == size
+        assert Image.open(os.path.join(self.plotdir, 'once.jpg')).size == size
+
+        shutil.rmtree(self.plotdir)
+
+    def test_box_stats(self):
+        df = self.img.metric_df('R')
+        labels = ['box {}'.format(i) for i in range(len(df.columns))]
+        for col, box in zip(df.columns, box_stats(df, labels)):
+            # same boxes as matplotlib computes from the values
+            should = boxplot_stats(df[col].dropna().values.astype(np.float64))[0]
+            for k in ['med', 'q1', 'q3', 'whislo', 'whishi', 'mean']:
+                np.testing.assert_allclose(box[k], should[k])
+        assert [box['label'] for box in box_stats(df, labels)] == labels
+
+        fig, ax = QA4SMPlotter(self.img, None).boxplot_basic('R')
+        labels = [t.get_text() for t in ax.get_xticklabels()]
+        assert len(labels) == len(df.columns) and all('median' in l for l in labels)
+        plt.close('all')
+        shutil.rmtree(self.plotdir)
 
 class TestQA4SMMetaImgBasicPlotter(unittest.TestCase):
 
@@ -147,6 +213,62 @@ class TestQA4SMMetaImgBasicPlotter(unittest.TestCase):
         shutil.rmtree(self.plotdir)
 
 
+class TestPlotAll(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.testfile = '3-GLDAS.SoilMoi0_10cm_inst_with_1-C3S.sm_with_2-SMOS.Soil_Moisture.nc'
+        self.testfile_path = os.path.join(os.path.dirname(__file__), '..','tests',
+                                          'test_data', 'tc', self.testfile)
+        self.plotdir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.plotdir)
+
+    def test_parallel(self):
+        metrics = ['n_obs', 'R', 'snr']
+        boxes, maps = plot_all(self.testfile_path, metrics=metrics,
+                               out_dir=os.path.join(self.plotdir, 'seq'))
+        boxes_par, maps_par = plot_all(self.testfile_path, metrics=metrics, n_workers=3,
+                                       out_dir=os.path.join(self.plotdir, 'par'))
+        # same files in the same order
+        assert [os.path.basename(f) for f in boxes] == \
+               [os.path.basename(f) for f in boxes_par]
+        assert [os.path.basename(f) for f in maps] == \
+               [os.path.basename(f) for f in maps_par]
+        assert len(boxes) == 1 + 1 + 2  # snr box plots for each metric dataset
+        assert len(maps) == 1 + 2 + 2
+        assert all(os.path.isfile(f) for f in boxes_par + maps_par)
+
+    def test_spawn(self):
+        # spawned workers attach to the shared values of the image
+        boxes, maps = plot_all(self.testfile_path, metrics=['R'], n_workers=2,
+                               start_method='spawn', out_dir=self.plotdir)
+        assert len(boxes) == 1
+        assert len(maps) == 2
+        assert all(os.path.isfile(f) for f in boxes + maps)
+
+    def test_errors(self):
+        with self.assertRaises(TypeError):
+            plot_all(self.testfile_path, metrics=['n_obs'], out_dir=self.plotdir,
+                     mapplot_kwargs={'not_a_kwarg': 1}, n_workers=1)
+        # errors in workers are raised with their traceback
+        with self.assertRaises(RuntimeError) as cm:
+            plot_all(self.testfile_path, metrics=['n_obs'], out_dir=self.plotdir,
+                     mapplot_kwargs={'not_a_kwarg': 1}, n_workers=2)
+        assert isinstance(cm.exception.__cause__, TypeError)
+        assert 'Traceback' in str(cm.exception) and 'mapplot_var' in str(cm.exception)
+        errors = []
+        boxes, maps = plot_all(self.testfile_path, metrics=['n_obs', 'R'],
+                               out_dir=self.plotdir, errors=errors,
+                               mapplot_kwargs={'not_a_kwarg': 1}, n_workers=2)
+        assert len(boxes) == 2
+        assert maps == []
+        assert [job for job, _ in errors] == [('map', 'n_obs'),
+                                              ('map', 'R_between_3-GLDAS_and_1-C3S'),
+                                              ('map', 'R_between_3-GLDAS_and_2-SMOS')]
+        assert 'not_a_kwarg' in errors[0][1]
+
+
 if __name__ == '__main__':
     pass
     # suite = unittest.TestSuite()
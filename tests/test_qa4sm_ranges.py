@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+from qa4sm_reader.ranges import value_ranges, save_value_ranges, load_value_ranges
+from qa4sm_reader.plotter import QA4SMPlotter
+from qa4sm_reader.img import QA4SMImg
+from qa4sm_reader import globals
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import os
+import unittest
+import tempfile
+import shutil
+
+class TestValueRanges(unittest.TestCase):
+
+    def setUp(self) -> None:
+        test_data = os.path.join(os.path.dirname(__file__), '..', 'tests', 'test_data')
+        self.testfile_paths = [
+            os.path.join(test_data, 'basic',
+                         '0-GLDAS.SoilMoi0_10cm_inst_with_1-C3S.sm_with_2-SMOS.Soil_Moisture.nc'),
+            os.path.join(test_data, 'tc',
+                         '3-GLDAS.SoilMoi0_10cm_inst_with_1-C3S.sm_with_2-SMOS.Soil_Moisture.nc')]
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmpdir)
+
+    def test_value_ranges(self):
+        ranges = value_ranges(self.testfile_paths, metrics=['R', 'BIAS', 'n_obs'])
+        assert sorted(ranges.keys()) == ['BIAS', 'R', 'n_obs']
+        assert ranges['R'] == tuple(globals._metric_value_ranges['R'])  # fixed range
+        # open limits from the values of all files
+        values = pd.concat([img.metric_df('BIAS').stack() for img in
+                            [QA4SMImg(path) for path in self.testfile_paths]])
+        v_max = max(abs(values.quantile(0.025)), abs(values.quantile(0.975)))
+        np.testing.assert_allclose(ranges['BIAS'], (-v_max, v_max), rtol=0.02)
+
+        path = os.path.join(self.tmpdir, 'ranges.json')
+        save_value_ranges(ranges, path)
+        assert load_value_ranges(path) == ranges
+
+        plotter = QA4SMPlotter(QA4SMImg(self.testfile_paths[0]), value_ranges=path)
+        varname = QA4SMImg(self.testfile_paths[0]).metric_meta('BIAS').popitem()[0]
+        fig, ax = plotter.mapplot_var(varname)
+        assert ax.images[0].get_clim() == ranges['BIAS']
+        plt.close('all')
+
+    def test_value_ranges_extent(self):
+        extent = (-6, -5, 56, 57)  # only covers (a part of) the second file
+        ranges = value_ranges(self.testfile_paths, metrics=['BIAS'], extent=extent)
+        # open limits from the values within the extent only
+        values = QA4SMImg(self.testfile_paths[1], extent=extent).metric_df('BIAS').stack()
+        v_max = max(abs(values.quantile(0.025)), abs(values.quantile(0.975)))
+        np.testing.assert_allclose(ranges['BIAS'], (-v_max, v_max), rtol=0.02)
+        assert ranges != value_ranges(self.testfile_paths, metrics=['BIAS'])
+
+    def test_var_chunks(self):
+        img = QA4SMImg(self.testfile_paths[0], lazy=True, ignore_empty=False)
+        varname = list(img.metric_meta('BIAS').keys())[0]
+        values = np.concatenate([v for _, v in img.var_chunks(varname, keep=False)])
+        assert np.isfinite(values).sum() == len(img.var_df(varname))
+        assert img._store.isloaded(varname)  # var_df loaded the values
+        list(img.var_chunks(varname, keep=False))
+        assert img._store.isloaded(varname)  # values that were loaded before are kept
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+from qa4sm_reader.raster import colormap_lut, color_index, land_mask, render_grid, _contains
+from shapely.geometry import Polygon, MultiPolygon
+from qa4sm_reader.plotter import QA4SMPlotter
+from qa4sm_reader.img import QA4SMImg
+from qa4sm_reader import globals
+from matplotlib.colors import Normalize
+import matplotlib.pyplot as plt
+from PIL import Image
+import numpy as np
+import os
+import unittest
+import tempfile
+import shutil
+
+class TestRaster(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.testfile = '0-GLDAS.SoilMoi0_10cm_inst_with_1-C3S.sm_with_2-SMOS.Soil_Moisture.nc'
+        self.testfile_path = os.path.join(os.path.dirname(__file__), '..','tests',
+                                          'test_data', 'basic', self.testfile)
+        self.plotdir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.plotdir)
+
+    def test_colors(self):
+        cmap = globals._colormaps['R']
+        zz = np.array([[-2., -1., -0.5, np.nan], [0., 0.3, 1., 2.]])
+        rgba = render_grid(zz, cmap, -1, 1)
+        # same colors as matplotlib, first row on top
+        should = plt.get_cmap(cmap)(Normalize(-1, 1)(np.ma.masked_invalid(zz)),
+                                    bytes=True)[::-1]
+        np.testing.assert_array_equal(rgba, should)
+        assert color_index(zz, -1, 1)[0, 3] == colormap_lut(cmap).shape[0] - 1
+
+    def test_land(self):
+        extent = (-10, 10, -10, 10)
+        mask = land_mask(extent, (20, 20))
+        assert mask.any() and not mask.all()
+        assert land_mask(extent, (20, 20)) is mask
+
+        zz = np.full((20, 20), np.nan)
+        rgba = render_grid(zz, 'viridis', 0, 1, extent=extent, scale=2, land=True)
+        assert rgba.shape == (40, 40, 4)
+        assert (rgba[..., 3] > 0).sum() == mask.sum() * 4
+
+    def test_contains(self):
+        outer = [(0, 0), (0, 10), (10, 10), (10, 0)]  # clockwise
+        hole = [(2, 2), (8, 2), (8, 8), (2, 8)]  # counter-clockwise
+        geom = MultiPolygon([Polygon(outer, [hole]), Polygon([(20, 0), (30, 0), (30, 5)])])
+        inside = _contains(geom, [(1, 1), (5, 5), (15, 1), (29, 1)])
+        np.testing.assert_array_equal(inside, [True, False, False, True])
+
+    def test_mapplot_raster(self):
+        img = QA4SMImg(self.testfile_path)
+        plotter = QA4SMPlotter(img, self.plotdir)
+        varname = 'R_between_0-GLDAS_and_1-C3S'
+        fname = plotter.mapplot_raster(varname)
+        assert os.path.basename(fname) == 'overview_0-GLDAS_and_1-C3S_R.png'
+        rgba = QA4SMPlotter(img, None).mapplot_raster(varname, land=False)
+        assert Image.open(fname).size == rgba.shape[1::-1]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from qa4sm_reader.stats import QuantileSketch, describe, describe_columns
+from qa4sm_reader.plot_utils import get_value_range
+from qa4sm_reader import globals
+from matplotlib.cbook import boxplot_stats
+import numpy as np
+import unittest
+
+class TestQuantileSketch(unittest.TestCase):
+
+    def setUp(self) -> None:
+        rng = np.random.RandomState(0)
+        self.values = np.concatenate([rng.normal(0.3, 0.4, 50000), [0.], [np.nan] * 10])
+
+    def test_accuracy(self):
+        sketch = QuantileSketch().update(self.values)
+        valid = self.values[~np.isnan(self.values)]
+        assert sketch.count == len(valid)
+        for q in (0.025, 0.25, 0.5, 0.75, 0.975):
+            should = np.quantile(valid, q)
+            assert abs(sketch.quantile(q) - should) <= \
+                   2 * sketch.rel_accuracy * abs(should) + 1e-3
+        assert sketch.quantile(0) == valid.min() and sketch.quantile(1) == valid.max()
+        assert len(sketch._pos) + len(sketch._neg) <= 2 * sketch.max_buckets
+
+    def test_merge(self):
+        chunks = np.array_split(self.values, 7)
+        merged = QuantileSketch()
+        for chunk in chunks:
+            merged.merge(QuantileSketch().update(chunk))
+        whole = QuantileSketch().update(self.values)
+        for q in (0.025, 0.5, 0.975):
+            assert merged.quantile(q) == whole.quantile(q)
+
+        # stats of partitions, e.g. files
+        parts = [describe(lambda: [chunk], quantiles=(0.5,), method='sketch')
+                 for chunk in chunks]
+        stats = parts[0]
+        for part in parts[1:]:
+            stats = stats.merge(part)
+        assert stats.count == whole.count
+        np.testing.assert_almost_equal(stats.mean, np.nanmean(self.values))
+        assert stats.median == whole.quantile(0.5)
+        assert get_value_range(stats.sketch, 'BIAS') == get_value_range(stats, 'BIAS')
+
+    def test_box(self):
+        should = boxplot_stats(self.values[~np.isnan(self.values)],
+                               whis=globals.boxplot_whis)[0]
+        quantiles = (0.25, 0.5, 0.75)
+        exact = describe_columns([self.values], quantiles=quantiles)[0].box()
+        sketch = describe(lambda: [self.values], quantiles=quantiles,
+                          method='sketch').box()
+        for k in ('med', 'q1', 'q3', 'whislo', 'whishi'):
+            np.testing.assert_almost_equal(exact[k], should[k])
+            assert abs(sketch[k] - should[k]) <= 0.01 * abs(should[k]) + 1e-3
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+from qa4sm_reader.store import SpatialIndex, QA4SMValueStore, SharedArrays
+import os
+import pickle
+import unittest
+import numpy as np
+import xarray as xr
+
+class TestSpatialIndex(unittest.TestCase):
+
+    def setUp(self) -> None:
+        rng = np.random.RandomState(42)
+        self.lat = rng.uniform(-90, 90, 5000)
+        self.lon = rng.uniform(-180, 180, 5000)
+        self.sindex = SpatialIndex(self.lat, self.lon)
+
+    def test_query(self):
+        for extent in [(-10, 30, 35, 70), (-180, 180, -90, 90), (100, 101, 0, 1),
+                       (170, 200, -100, -80), (0, 10, 95, 99)]:
+            rows = self.sindex.query(extent)
+            should = np.flatnonzero((self.lon >= extent[0]) & (self.lon <= extent[1]) &
+                                    (self.lat >= extent[2]) & (self.lat <= extent[3]))
+            np.testing.assert_array_equal(rows, should)
+
+
+class TestQA4SMValueStore(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.testfile = '3-ERA5_LAND.swvl1_with_1-C3S.sm_with_2-ASCAT.sm.nc'
+        self.testfile_path = os.path.join(os.path.dirname(__file__), '..','tests',
+                                          'test_data', 'tc', self.testfile)
+        self.ds = xr.open_dataset(self.testfile_path)
+        self.store = QA4SMValueStore(self.ds)
+
+    def test_subset(self):
+        extent = (np.median(self.store.lon), self.store.lon.max(),
+                  self.store.lat.min(), np.median(self.store.lat))
+        sub = self.store.subset(extent)
+        from_file = QA4SMValueStore(self.ds, extent=extent)
+        assert 0 < len(sub) < len(self.store)
+        np.testing.assert_array_equal(sub.lat, from_file.lat)
+        np.testing.assert_array_equal(sub.lon, from_file.lon)
+        assert sub.frame('n_obs').equals(from_file.frame('n_obs'))
+        assert not from_file.isloaded('R_between_3-ERA5_LAND_and_1-C3S')
+
+    def test_read_slabs(self):
+        extent = (self.store.lon.min(), np.median(self.store.lon),
+                  self.store.lat.min(), self.store.lat.max())
+        sub = QA4SMValueStore(self.ds, extent=extent)
+        sub._slabs, sub._slab_rows = sub._plan_reads(max_gap=0)
+        assert len(sub._slabs) > 1
+        rows = self.store.rows_in(extent)
+        np.testing.assert_array_equal(sub.values('n_obs'),
+                                      self.store.values('n_obs')[rows])
+
+    def test_grid(self):
+        lat, lon = np.arange(40., 50., 0.5), np.arange(-10., 10., 0.5)
+        values = np.arange(len(lat) * len(lon), dtype=float).reshape(len(lat), len(lon))
+        ds = xr.Dataset({'n_obs': (('lat', 'lon'), values)},
+                        coords={'lat': lat, 'lon': lon})
+        store = QA4SMValueStore(ds)
+        assert len(store) == values.size
+        extent = (-2.2, 3.1, 41.1, 44.)
+        sub = QA4SMValueStore(ds, extent=extent)
+        assert len(sub._slabs) == 1
+        should = ds['n_obs'].sel(lat=slice(41.1, 44.), lon=slice(-2.2, 3.1))
+        np.testing.assert_array_equal(sub.values('n_obs'), should.values.ravel())
+
+    def test_share(self):
+        self.store.load(['n_obs', 'R_between_3-ERA5_LAND_and_1-C3S'])
+        shared = self.store.share()
+        assert os.path.isfile(shared.path)
+        try:
+            data = pickle.dumps(self.store)
+            assert len(data) < self.store.values('n_obs').nbytes
+            store = pickle.loads(data)
+            assert not store._shared.owner
+            assert store.ds is None
+            for varname in ['n_obs', 'R_between_3-ERA5_LAND_and_1-C3S']:
+                # zero-copy, read-only views on the shared file
+                values = store.values(varname)
+                assert not values.flags.owndata and not values.flags.writeable
+                np.testing.assert_array_equal(values, self.store.values(varname))
+                np.testing.assert_array_equal(store.mask(varname), self.store.mask(varname))
+            assert store.frame('n_obs').equals(self.store.frame('n_obs'))
+        finally:
+            self.store.unshare()
+        assert not os.path.isfile(shared.path)
+        assert store.frame('n_obs').equals(self.store.frame('n_obs'))
+
+    def test_shared_arrays(self):
+        arrays = {'a': np.arange(5, dtype=np.int8), 'b': np.array([], dtype=float),
+                  'c': np.ones((3, 2), dtype=bool)}
+        shared = SharedArrays(arrays)
+        attached = pickle.loads(pickle.dumps(shared)).arrays
+        for name, values in arrays.items():
+            assert attached[name].dtype == values.dtype
+            np.testing.assert_array_equal(attached[name], values)
+        shared.release()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+from qa4sm_reader.tiles import export_tiles, resample, resample_tile, downsample
+from qa4sm_reader.img import QA4SMImg
+from PIL import Image
+import numpy as np
+import os
+import unittest
+import tempfile
+import shutil
+
+class TestTiles(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.testfile = '0-GLDAS.SoilMoi0_10cm_inst_with_1-C3S.sm_with_2-SMOS.Soil_Moisture.nc'
+        self.testfile_path = os.path.join(os.path.dirname(__file__), '..','tests',
+                                          'test_data', 'basic', self.testfile)
+        self.tiledir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tiledir)
+
+    def test_resample(self):
+        # 2 x 2 cells covering the western hemisphere
+        zz = np.array([[1., 2.], [3., 4.]])
+        values, tx0, ty0 = resample(zz, (-180, 0, -85, 85), 1, tile_size=4)
+        assert (tx0, ty0) == (0, 0)
+        assert values.shape == (8, 4)
+        np.testing.assert_array_equal(values[0], [3., 3., 4., 4.])
+        np.testing.assert_array_equal(values[-1], [1., 1., 2., 2.])
+
+    def test_resample_tile(self):
+        zz = np.arange(35.).reshape(5, 7)
+        extent = (-20, 30, -10, 40)
+        values, tx0, ty0 = resample(zz, extent, 4, tile_size=16)
+        assert values.shape[1] > 16
+        # a single tile is the same as the tile in the resampled level
+        np.testing.assert_array_equal(resample_tile(zz, extent, 4, tx0 + 1, ty0, tile_size=16),
+                                      values[:16, 16:32])
+
+    def test_downsample(self):
+        values = np.full((4, 4), np.nan)
+        values[:2, :2] = [[1., 2.], [np.nan, 6.]]
+        coarse, tx0, ty0 = downsample(values, 3, 2, tile_size=2)
+        # tiles 3 and 4 are padded to 2 - 5, to start and end at an even tile
+        assert (tx0, ty0) == (1, 1)
+        assert coarse.shape == (2, 4)
+        assert coarse[0, 1] == 3.
+        assert np.isnan(coarse[0, 0]) and np.isnan(coarse[1]).all()
+
+    def test_export_tiles(self):
+        img = QA4SMImg(self.testfile_path)
+        fnames = export_tiles(img, 'R_between_0-GLDAS_and_1-C3S', self.tiledir,
+                              max_zoom=5)
+        zooms = sorted([int(os.path.relpath(f, self.tiledir).split(os.sep)[0])
+                        for f in fnames])
+        assert zooms == [0, 1, 2, 3, 4, 5]  # the values fit into one tile per level
+        for fname in fnames:
+            tile = np.asarray(Image.open(fname))
+            assert tile.shape == (256, 256, 4)
+            assert (tile[..., 3] > 0).any()
+
+        # only the tiles from min_zoom are written
+        fnames = export_tiles(img, 'R_between_0-GLDAS_and_1-C3S',
+                              os.path.join(self.tiledir, 'z'), min_zoom=3, max_zoom=5)
+        assert sorted(set([int(os.path.relpath(f, self.tiledir).split(os.sep)[1])
+                           for f in fnames])) == [3, 4, 5]
+
+
+if __name__ == '__main__':
+    unittest.main()